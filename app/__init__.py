@@ -1,4 +1,5 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Depends
+from fastapi.responses import PlainTextResponse
 from fastapi_cache import FastAPICache
 from fastapi_cache.backends.inmemory import InMemoryBackend
 import os
@@ -13,7 +14,7 @@ logging.basicConfig(
 )
 
 # Import routers and register them
-from app.routes.voice import voice_router
+from app.routes.voice import voice_router, realtime_pool
 
 from app.routes.auth import auth_router
 from app.routes.dentist import dentist_router
@@ -25,6 +26,12 @@ from app.routes.dashboard import dashboard_router
 from app.routes.settings import settings_router
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
+from app.utils.db import get_db_connection, close_pool
+from app.utils.query_stats import QueryStatsMiddleware
+from app.utils.metrics import METRICS_ENABLED, CONTENT_TYPE, MetricsMiddleware, render as render_metrics
+from app.utils.kafka_producer import ai_response_producer
+from app.utils.voice_context import start_context_refresher, stop_context_refresher
+from app.utils.speech_services import speech_service
 
 
 
@@ -35,10 +42,20 @@ async def lifespan(app: FastAPI):
 
     # Setup database if needed
     # db.create_all()  # Uncomment if your DB requires table creation
+
+    # Pre-warm OpenAI Realtime sessions for incoming calls, and keep their
+    # availability context built ahead of time
+    await realtime_pool.start()
+    start_context_refresher()
     
     yield  # App runs here
     
     # Cleanup actions (if necessary)
+    await realtime_pool.close()
+    stop_context_refresher()
+    ai_response_producer.close()
+    speech_service.close()
+    close_pool()
 
 def create_app():
     app = FastAPI(lifespan=lifespan)
@@ -50,15 +67,32 @@ def create_app():
         "AZURE_STORAGE_VOICE_CONTAINER":'bytheapp-voice-data'
     }
 
+    # One pooled DB connection per REST request; the voice bridge checks out per query.
+    # Login and the other password endpoints also check out per query, so a login
+    # burst waiting on bcrypt does not hold the pool (user_router binds the rest).
+    db_dependencies = [Depends(get_db_connection)]
+
     app.include_router(voice_router, prefix="/voice", tags=["voice"])
     app.include_router(auth_router, prefix="/auth", tags=["authentication"])
-    app.include_router(dentist_router, prefix="/api", tags=["dentists"])
+    app.include_router(dentist_router, prefix="/api", tags=["dentists"], dependencies=db_dependencies)
     app.include_router(user_router, prefix="/api", tags=["users"])
-    app.include_router(patient_router, prefix="/api", tags=["patients"])
-    app.include_router(availability_router, prefix="/api", tags=["availability"])
-    app.include_router(appointment_router, prefix="/api", tags=["appointments"])
-    app.include_router(dashboard_router, prefix="/api", tags=["dashboard"])
-    app.include_router(settings_router, prefix="/api", tags=["settings"])
+    app.include_router(patient_router, prefix="/api", tags=["patients"], dependencies=db_dependencies)
+    app.include_router(availability_router, prefix="/api", tags=["availability"], dependencies=db_dependencies)
+    app.include_router(appointment_router, prefix="/api", tags=["appointments"], dependencies=db_dependencies)
+    app.include_router(dashboard_router, prefix="/api", tags=["dashboard"], dependencies=db_dependencies)
+    app.include_router(settings_router, prefix="/api", tags=["settings"], dependencies=db_dependencies)
+
+    # Prometheus scrape endpoint (route latency, DB pool, media streams, Kafka producer)
+    if METRICS_ENABLED:
+        async def metrics():
+            return PlainTextResponse(render_metrics(), media_type=CONTENT_TYPE)
+
+        app.add_api_route("/metrics", metrics, methods=["GET"], include_in_schema=False)
+
+    # Per-request query count / DB time (Server-Timing header) and N+1 warnings
+    app.add_middleware(QueryStatsMiddleware)
+    # Per-route latency histograms for /metrics
+    app.add_middleware(MetricsMiddleware)
 
     app.add_middleware(
         CORSMiddleware,
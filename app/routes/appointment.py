@@ -1,13 +1,13 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import List, Optional, Tuple
 from datetime import datetime, timezone, date, time
-import jwt
-from jwt import PyJWTError
-import os
 import logging
-from app.utils.db import conn
+from app.utils.db import conn, run_db
+from app.utils.auth import require_admin, require_admin_or_receptionist, require_authenticated_user
+from app.utils.stats import cached_stats
+from app.utils.voice_context import invalidate_availability_context
+from app.utils.pagination import COUNT_MODES, encode_cursor, decode_cursor, count_rows
 from psycopg2.extras import RealDictCursor
 import psycopg2
 from app.routes.availability import ensure_time_slot_available, set_time_slot_availability
@@ -15,16 +15,9 @@ from app.routes.availability import ensure_time_slot_available, set_time_slot_av
 # Initialize router
 appointment_router = APIRouter()
 
-# Security setup
-security = HTTPBearer()
-
 # Logger
 logger = logging.getLogger(__name__)
 
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
-
 # Pydantic models
 class AppointmentBase(BaseModel):
     patient: str
@@ -68,73 +61,20 @@ class AppointmentSearch(BaseModel):
 
 class PaginatedAppointments(BaseModel):
     items: List[AppointmentResponse]
-    page: int
+    page: Optional[int] = None  # None when paging by cursor
     page_size: int
-    total_items: int
-    total_pages: int
+    total_items: Optional[int] = None  # None when count="none"
+    total_pages: Optional[int] = None
     has_next: bool
     has_prev: bool
+    next_cursor: Optional[str] = None
+    total_is_estimate: bool = False
 
 RELEASE_STATUSES = {"cancelled", "rescheduled"}
 NON_ACTIVE_STATUSES = {"cancelled", "rescheduled", "completed", "no_show"}
 VALID_STATUSES = {"confirmed", "cancelled", "completed", "no_show", "rescheduled", "arrived"}
 VALID_STATUSES = {"confirmed", "cancelled", "completed", "no_show", "rescheduled"}
 
-# Authentication functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    # Get user from database
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-    
-    if user is None:
-        raise credentials_exception
-    
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=401,
-            detail="Inactive user"
-        )
-    
-    return user
-
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin role"""
-    if current_user.get('role') != 'admin':
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_admin_or_receptionist(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin or receptionist role"""
-    if current_user.get('role') not in ['admin', 'receptionist']:
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_authenticated_user(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require any authenticated user"""
-    return current_user
-
 # Database helper functions
 def format_appointment_data(appointment: dict) -> dict:
     """Format appointment data for API response"""
@@ -290,89 +230,145 @@ def get_all_appointments() -> List[dict]:
         return [format_appointment_data(appointment) for appointment in results]
 
 def create_appointment(appointment_data: AppointmentCreate) -> dict:
-    """Create a new appointment"""
-    # Check if dentist exists
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT id, name FROM dentists WHERE id = %s", (appointment_data.dentist_id,))
-        dentist = cur.fetchone()
-        if not dentist:
-            raise HTTPException(status_code=404, detail="Dentist not found")
+    """
+    Create a new appointment.
+    Dentist check, conflict check, slot claim, insert and the patient's
+    next_appointment update run as one statement, so they commit or fail together.
+    """
+    excluded_statuses = list(NON_ACTIVE_STATUSES)
     
-    # Check for time conflicts
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Data-modifying CTEs share one snapshot and cannot see each other's writes,
+        # so every step is gated on the checks explicitly and the patient's next
+        # appointment also considers the row being inserted.
         cur.execute("""
-            SELECT id FROM appointments 
-            WHERE dentist_id = %s 
-              AND appointment_date = %s 
-              AND appointment_time = %s
-              AND status NOT IN ('cancelled', 'rescheduled')
-        """, (
-            appointment_data.dentist_id,
-            appointment_data.appointment_date,
-            appointment_data.appointment_time
-        ))
-        conflict = cur.fetchone()
-        if conflict:
-            raise HTTPException(
-                status_code=400,
-                detail="Time slot is already booked for this dentist"
+            WITH dentist AS (
+                SELECT id, name FROM dentists WHERE id = %(dentist_id)s
+            ),
+            conflict AS (
+                SELECT id FROM appointments
+                WHERE dentist_id = %(dentist_id)s
+                  AND appointment_date = %(appointment_date)s
+                  AND appointment_time = %(appointment_time)s::time
+                  AND status NOT IN ('cancelled', 'rescheduled')
+            ),
+            day AS (
+                SELECT id FROM availability
+                WHERE dentist_id = %(dentist_id)s AND date = %(appointment_date)s
+            ),
+            slot AS (
+                SELECT s.id, s.available
+                FROM availability_slots s
+                JOIN day ON s.availability_id = day.id
+                WHERE s.start_time = %(appointment_time)s::time
+            ),
+            checks_passed AS (
+                SELECT 1
+                WHERE EXISTS (SELECT 1 FROM dentist)
+                  AND NOT EXISTS (SELECT 1 FROM conflict)
+                  AND EXISTS (SELECT 1 FROM slot WHERE available)
+            ),
+            claimed AS (
+                UPDATE availability_slots
+                SET available = false, updated_at = CURRENT_TIMESTAMP
+                WHERE id = (SELECT id FROM slot)
+                  AND available
+                  AND %(books_slot)s
+                  AND EXISTS (SELECT 1 FROM checks_passed)
+                RETURNING id
+            ),
+            inserted AS (
+                INSERT INTO appointments (patient, phone, dentist_id, appointment_date, appointment_time, treatment, status, notes)
+                SELECT %(patient)s, %(phone)s, %(dentist_id)s, %(appointment_date)s, %(appointment_time)s,
+                       %(treatment)s, %(status)s, %(notes)s
+                WHERE EXISTS (SELECT 1 FROM checks_passed)
+                  AND (NOT %(books_slot)s OR EXISTS (SELECT 1 FROM claimed))
+                RETURNING id, patient, phone, dentist_id, appointment_date, appointment_time, treatment, status, notes, created_at, updated_at
+            ),
+            patient_record AS (
+                SELECT id, name, phone FROM patients
+                WHERE phone = %(phone)s OR name = %(patient)s
+                ORDER BY (phone = %(phone)s) DESC, updated_at DESC
+                LIMIT 1
+            ),
+            next_appointment AS (
+                SELECT MIN(upcoming.appointment_date) AS appointment_date
+                FROM patient_record p,
+                     LATERAL (
+                         SELECT a.appointment_date, a.status FROM appointments a
+                         WHERE a.phone = p.phone OR a.patient = p.name
+                         UNION ALL
+                         SELECT i.appointment_date, i.status FROM inserted i
+                         WHERE i.phone = p.phone OR i.patient = p.name
+                     ) AS upcoming
+                WHERE upcoming.status <> ALL(%(excluded_statuses)s)
+                  AND upcoming.appointment_date >= CURRENT_DATE
+            ),
+            patient_synced AS (
+                UPDATE patients
+                SET next_appointment = (SELECT appointment_date FROM next_appointment),
+                    updated_at = %(now)s
+                WHERE id = (SELECT id FROM patient_record)
+                  AND EXISTS (SELECT 1 FROM inserted)
+                RETURNING id
             )
+            SELECT inserted.*,
+                   (SELECT name FROM dentist) AS dentist_name,
+                   EXISTS (SELECT 1 FROM conflict) AS has_conflict,
+                   EXISTS (SELECT 1 FROM day) AS has_availability,
+                   (SELECT available FROM slot) AS slot_available
+            FROM (SELECT 1) AS outcome
+            LEFT JOIN inserted ON TRUE
+        """, {
+            "dentist_id": appointment_data.dentist_id,
+            "appointment_date": appointment_data.appointment_date,
+            "appointment_time": appointment_data.appointment_time,
+            "patient": appointment_data.patient,
+            "phone": appointment_data.phone,
+            "treatment": appointment_data.treatment,
+            "status": appointment_data.status,
+            "notes": appointment_data.notes,
+            "books_slot": appointment_data.status not in RELEASE_STATUSES,
+            "excluded_statuses": excluded_statuses,
+            "now": datetime.now(timezone.utc)
+        })
+        result = cur.fetchone()
     
-    # Ensure availability slot exists and is open
-    ensure_time_slot_available(
-        appointment_data.dentist_id,
-        appointment_data.appointment_date,
-        appointment_data.appointment_time
-    )
+    has_conflict = result.pop('has_conflict')
+    has_availability = result.pop('has_availability')
+    slot_available = result.pop('slot_available')
     
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            INSERT INTO appointments (patient, phone, dentist_id, appointment_date, appointment_time, treatment, status, notes)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, patient, phone, dentist_id, appointment_date, appointment_time, treatment, status, notes, created_at, updated_at
-        """, (
-            appointment_data.patient,
-            appointment_data.phone,
-            appointment_data.dentist_id,
-            appointment_data.appointment_date,
-            appointment_data.appointment_time,
-            appointment_data.treatment,
-            appointment_data.status,
-            appointment_data.notes
-        ))
-        result = cur.fetchone()
-        result['dentist_name'] = dentist['name']
+    if result['dentist_name'] is None:
+        raise HTTPException(status_code=404, detail="Dentist not found")
     
-    formatted_result = format_appointment_data(result)
-    slot_reference = _extract_slot_reference(formatted_result)
+    if has_conflict:
+        raise HTTPException(
+            status_code=400,
+            detail="Time slot is already booked for this dentist"
+        )
     
-    if slot_reference and formatted_result.get('status') not in RELEASE_STATUSES:
-        slot_updated = set_time_slot_availability(
-            slot_reference['dentist_id'],
-            slot_reference['date'],
-            slot_reference['time'],
-            available=False
+    if not has_availability:
+        raise HTTPException(
+            status_code=400,
+            detail="Availability is not configured for this dentist on the selected date"
         )
-        if not slot_updated:
-            logger.error(
-                "Failed to mark time slot as booked",
-                extra={
-                    "dentist_id": slot_reference['dentist_id'],
-                    "date": slot_reference['date'],
-                    "start": slot_reference['time']
-                }
-            )
-            raise HTTPException(
-                status_code=500,
-                detail="Appointment created but failed to update availability schedule"
-            )
     
-    _sync_patient_next_appointment(
-        formatted_result.get('patient'),
-        formatted_result.get('phone')
-    )
+    if slot_available is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Requested time slot is not available in the schedule"
+        )
     
-    return formatted_result
+    # Either already booked, or a concurrent request claimed the slot first
+    if not slot_available or result['id'] is None:
+        raise HTTPException(
+            status_code=400,
+            detail="Requested time slot has already been booked"
+        )
+    
+    # The slot claimed above is no longer offered to callers
+    invalidate_availability_context()
+    return format_appointment_data(result)
 
 def update_appointment(appointment_id: int, appointment_data: AppointmentUpdate) -> Optional[dict]:
     """Update an existing appointment"""
@@ -610,9 +606,16 @@ def search_appointments(
     status: str = None,
     treatment: str = None,
     page: int = 1,
-    page_size: int = 25
-) -> Tuple[int, List[dict]]:
-    """Search appointments by various criteria with pagination"""
+    page_size: int = 25,
+    after: Optional[Tuple[date, time, int]] = None,
+    count: str = "exact"
+) -> Tuple[Optional[int], List[dict], Optional[str]]:
+    """
+    Search appointments by various criteria with pagination.
+    Pages by OFFSET unless `after` (a decoded cursor) is given, in which case rows
+    strictly after that (appointment_date, appointment_time, id) key are returned.
+    Returns (total_items or None, appointments, next_cursor or None).
+    """
     if page < 1:
         page = 1
     if page_size < 1:
@@ -651,27 +654,37 @@ def search_appointments(
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
-        count_query = f"""
-            SELECT COUNT(*)
+        total_items = count_rows(cur, f"""
+            SELECT 1
             FROM appointments a
             WHERE {where_clause}
-        """
-        cur.execute(count_query, params)
-        count_row = cur.fetchone()
-        total_items = count_row["count"] if count_row else 0
+        """, params, count)
+        
+        if after:
+            where_clause += " AND (a.appointment_date, a.appointment_time, a.id) > (%s, %s, %s)"
+            params.extend(after)
+            offset = 0
         
+        # Fetch one extra row to know whether another page follows
         query = f"""
             SELECT a.*, d.name as dentist_name
             FROM appointments a
             JOIN dentists d ON a.dentist_id = d.id
             WHERE {where_clause}
-            ORDER BY a.appointment_date, a.appointment_time
+            ORDER BY a.appointment_date, a.appointment_time, a.id
             LIMIT %s OFFSET %s
         """
-        query_params = params + [page_size, offset]
+        query_params = params + [page_size + 1, offset]
         cur.execute(query, query_params)
         results = cur.fetchall()
-        return total_items, [format_appointment_data(appointment) for appointment in results]
+        
+        next_cursor = None
+        if len(results) > page_size:
+            # Built from the raw row before appointment_time is reformatted
+            last = results[page_size - 1]
+            next_cursor = encode_cursor(last['appointment_date'], last['appointment_time'], last['id'])
+        
+        return total_items, [format_appointment_data(appointment) for appointment in results[:page_size]], next_cursor
 
 def get_appointments_by_dentist(dentist_id: int, date: date = None) -> List[dict]:
     """Get appointments for a specific dentist"""
@@ -801,63 +814,62 @@ def update_appointment_status(appointment_id: int, status: str) -> Optional[dict
     return formatted_result
 
 def get_appointment_statistics() -> dict:
-    """Get appointment statistics"""
+    """Get appointment statistics (from the appointment_daily_stats rollup)"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Total appointments
-        cur.execute("SELECT COUNT(*) as total FROM appointments")
-        total_appointments = cur.fetchone()['total']
+        # Total, today's and upcoming (next 7 days) appointments
+        cur.execute("""
+            SELECT
+                COALESCE(SUM(appointment_count), 0)::bigint as total,
+                COALESCE(SUM(appointment_count) FILTER (
+                    WHERE appointment_date = CURRENT_DATE
+                ), 0)::bigint as today_appointments,
+                COALESCE(SUM(appointment_count) FILTER (
+                    WHERE appointment_date >= CURRENT_DATE
+                    AND appointment_date <= CURRENT_DATE + INTERVAL '7 days'
+                ), 0)::bigint as upcoming_appointments
+            FROM appointment_daily_stats
+        """)
+        totals = cur.fetchone()
         
         # Appointments by status
         cur.execute("""
-            SELECT status, COUNT(*) as count 
-            FROM appointments 
+            SELECT NULLIF(status, '') as status, SUM(appointment_count)::bigint as count 
+            FROM appointment_daily_stats 
             GROUP BY status
+            HAVING SUM(appointment_count) > 0
         """)
         appointments_by_status = cur.fetchall()
         
         # Appointments by dentist
         cur.execute("""
-            SELECT d.name as dentist_name, COUNT(a.id) as appointment_count
+            SELECT d.name as dentist_name, COALESCE(s.appointment_count, 0)::bigint as appointment_count
             FROM dentists d
-            LEFT JOIN appointments a ON d.id = a.dentist_id
-            GROUP BY d.id, d.name
+            LEFT JOIN (
+                SELECT dentist_id, SUM(appointment_count) as appointment_count
+                FROM appointment_daily_stats
+                GROUP BY dentist_id
+            ) s ON d.id = s.dentist_id
             ORDER BY appointment_count DESC
         """)
         appointments_by_dentist = cur.fetchall()
         
-        # Today's appointments
-        cur.execute("""
-            SELECT COUNT(*) as today_appointments 
-            FROM appointments 
-            WHERE appointment_date = CURRENT_DATE
-        """)
-        today_appointments = cur.fetchone()['today_appointments']
-        
-        # Upcoming appointments (next 7 days)
-        cur.execute("""
-            SELECT COUNT(*) as upcoming_appointments 
-            FROM appointments 
-            WHERE appointment_date >= CURRENT_DATE 
-            AND appointment_date <= CURRENT_DATE + INTERVAL '7 days'
-        """)
-        upcoming_appointments = cur.fetchone()['upcoming_appointments']
-        
         # Most common treatments
         cur.execute("""
-            SELECT treatment, COUNT(*) as count 
-            FROM appointments 
+            SELECT NULLIF(treatment, '') as treatment, SUM(appointment_count)::bigint as count 
+            FROM appointment_daily_stats 
             GROUP BY treatment 
+            HAVING SUM(appointment_count) > 0
             ORDER BY count DESC 
             LIMIT 5
         """)
         common_treatments = cur.fetchall()
     
     return {
-        "total_appointments": total_appointments,
+        "total_appointments": totals['total'],
         "appointments_by_status": appointments_by_status,
         "appointments_by_dentist": appointments_by_dentist,
-        "today_appointments": today_appointments,
-        "upcoming_appointments": upcoming_appointments,
+        "today_appointments": totals['today_appointments'],
+        "upcoming_appointments": totals['upcoming_appointments'],
         "common_treatments": common_treatments
     }
 
@@ -873,18 +885,33 @@ async def get_appointments(
     treatment: Optional[str] = None,
     page: int = 1,
     page_size: int = 25,
+    cursor: Optional[str] = None,
+    count: str = "exact",
     current_user: dict = Depends(require_authenticated_user)
 ):
     """
-    Get all appointments with optional filtering
+    Get all appointments with optional filtering.
+    Pass the `next_cursor` of a previous response as `cursor` to page by key
+    instead of OFFSET (constant time at any depth); `page` is then ignored.
+    `count` is "exact" (default), "estimated" (planner estimate) or "none".
     """
     if page < 1:
         raise HTTPException(status_code=400, detail="page must be >= 1")
     if page_size < 1 or page_size > 100:
         raise HTTPException(status_code=400, detail="page_size must be between 1 and 100")
+    if count not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail="count must be one of 'exact', 'estimated' or 'none'")
+    
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
     
     try:
-        total_items, appointments = search_appointments(
+        total_items, appointments, next_cursor = await run_db(
+            search_appointments,
             patient,
             dentist_id,
             date_from,
@@ -892,17 +919,24 @@ async def get_appointments(
             status,
             treatment,
             page,
-            page_size
+            page_size,
+            after,
+            count
         )
-        total_pages = (total_items + page_size - 1) // page_size if total_items else 0
+        total_pages = None
+        if total_items is not None:
+            total_pages = (total_items + page_size - 1) // page_size if total_items else 0
+        
         return PaginatedAppointments(
             items=appointments,
-            page=page,
+            page=None if after else page,
             page_size=page_size,
             total_items=total_items,
             total_pages=total_pages,
-            has_next=page < total_pages,
-            has_prev=page > 1 and total_pages > 0
+            has_next=next_cursor is not None,
+            has_prev=after is not None or page > 1,
+            next_cursor=next_cursor,
+            total_is_estimate=count == "estimated"
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch appointments: {str(e)}")
@@ -913,7 +947,7 @@ async def get_appointment(appointment_id: int, current_user: dict = Depends(requ
     Get a specific appointment by ID
     """
     try:
-        appointment = get_appointment_by_id(appointment_id)
+        appointment = await run_db(get_appointment_by_id, appointment_id)
         if not appointment:
             raise HTTPException(status_code=404, detail="Appointment not found")
         return appointment
@@ -932,7 +966,7 @@ async def get_dentist_appointments(
     Get appointments for a specific dentist
     """
     try:
-        appointments = get_appointments_by_dentist(dentist_id, date)
+        appointments = await run_db(get_appointments_by_dentist, dentist_id, date)
         return appointments
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch dentist appointments: {str(e)}")
@@ -946,7 +980,7 @@ async def get_patient_appointments(
     Get appointments for a specific patient
     """
     try:
-        appointments = get_appointments_by_patient(patient_name)
+        appointments = await run_db(get_appointments_by_patient, patient_name)
         return appointments
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch patient appointments: {str(e)}")
@@ -960,7 +994,7 @@ async def create_appointment_endpoint(
     Create a new appointment
     """
     try:
-        appointment = create_appointment(appointment_data)
+        appointment = await run_db(create_appointment, appointment_data)
         return appointment
     except HTTPException:
         raise
@@ -978,11 +1012,11 @@ async def update_appointment_endpoint(
     """
     try:
         # Check if appointment exists
-        existing_appointment = get_appointment_by_id(appointment_id)
+        existing_appointment = await run_db(get_appointment_by_id, appointment_id)
         if not existing_appointment:
             raise HTTPException(status_code=404, detail="Appointment not found")
         
-        appointment = update_appointment(appointment_id, appointment_data)
+        appointment = await run_db(update_appointment, appointment_id, appointment_data)
         return appointment
     except HTTPException:
         raise
@@ -999,15 +1033,16 @@ async def delete_appointment_endpoint(
     """
     try:
         # Check if appointment exists
-        existing_appointment = get_appointment_by_id(appointment_id)
+        existing_appointment = await run_db(get_appointment_by_id, appointment_id)
         if not existing_appointment:
             raise HTTPException(status_code=404, detail="Appointment not found")
         
-        success = delete_appointment(appointment_id)
+        success = await run_db(delete_appointment, appointment_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete appointment")
         
-        _sync_patient_next_appointment(
+        await run_db(
+            _sync_patient_next_appointment,
             existing_appointment.get('patient'),
             existing_appointment.get('phone')
         )
@@ -1028,7 +1063,7 @@ async def update_appointment_status_endpoint(
     Update appointment status
     """
     try:
-        updated = update_appointment_status(appointment_id, status)
+        updated = await run_db(update_appointment_status, appointment_id, status)
         if not updated:
             raise HTTPException(status_code=404, detail="Appointment not found")
         
@@ -1047,7 +1082,7 @@ async def get_appointment_stats(current_user: dict = Depends(require_admin)):
     Get appointment statistics (admin only)
     """
     try:
-        stats = get_appointment_statistics()
+        stats = await cached_stats("appointment", get_appointment_statistics)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch appointment statistics: {str(e)}")
@@ -1,26 +1,19 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from datetime import datetime, timezone
-from passlib.context import CryptContext
 import jwt
 from jwt import PyJWTError
-import os
-from app.utils.db import conn
+from app.utils.db import conn, run_db
+from app.utils.auth import SECRET_KEY, ALGORITHM, get_current_user, invalidate_cached_user
+from app.utils.passwords import PasswordHasherBusy, get_password_hash, hasher_busy, verify_and_update
 from psycopg2.extras import RealDictCursor
 import datetime as dt
 
 # Initialize router
 auth_router = APIRouter()
 
-# Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-security = HTTPBearer()
-
 # JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
 
@@ -66,42 +59,6 @@ class UserResponse(BaseModel):
     updated_at: datetime
 
 # Helper functions
-def get_password_hash(password: str) -> str:
-    """Hash a password (bcrypt max 72 bytes)"""
-    try:
-        # Truncate password to 72 bytes if longer (encode to bytes, truncate, decode)
-        password_bytes = password.encode('utf-8')
-        if len(password_bytes) > 72:
-            password = password_bytes[:72].decode('utf-8', errors='ignore')
-        return pwd_context.hash(password)
-    except Exception as e:
-        # If hashing fails for any reason, print error and re-raise
-        print(f"Error hashing password: {e}")
-        raise ValueError(f"Failed to hash password: {str(e)}")
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    # Truncate password to 72 bytes if longer (for bcrypt compatibility)
-    # Note: This means passwords longer than 72 bytes will be truncated
-    original_password = plain_password
-    password_bytes = plain_password.encode('utf-8')
-    if len(password_bytes) > 72:
-        plain_password = password_bytes[:72].decode('utf-8', errors='ignore')
-    
-    try:
-        return pwd_context.verify(plain_password, hashed_password)
-    except Exception as e:
-        error_msg = str(e).lower()
-        # Check for specific bcrypt error about password length
-        if "password cannot be longer than 72 bytes" in error_msg:
-            # This happens when the hash was created with a password > 72 bytes
-            print(f"⚠️  Password verification failed: Hash was created with password > 72 bytes")
-            print(f"⚠️  Attempted password length: {len(original_password)} characters, {len(password_bytes)} bytes")
-            return False
-        # For other errors, just return False
-        print(f"⚠️  Password verification failed: {e}")
-        return False
-
 def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -130,10 +87,8 @@ def get_user_by_email(email: str) -> Optional[dict]:
         cur.execute("SELECT * FROM users WHERE email = %s", (email,))
         return cur.fetchone()
 
-def register_user(user_data: UserRegister) -> dict:
+def register_user(user_data: UserRegister, hashed_password: str) -> dict:
     """Register a new user (pending admin approval)"""
-    hashed_password = get_password_hash(user_data.password)
-    
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             INSERT INTO users (username, email, password_hash, name, role, is_active)
@@ -149,39 +104,15 @@ def register_user(user_data: UserRegister) -> dict:
         ))
         return cur.fetchone()
 
-def update_last_login(user_id: int):
-    """Update last login timestamp"""
+def update_last_login(user_id: int, rehashed_password: Optional[str] = None):
+    """Update last login timestamp, storing a rehashed password in the same statement"""
     with conn.cursor() as cur:
         cur.execute("""
             UPDATE users 
-            SET last_login = %s, updated_at = %s
+            SET last_login = %s, updated_at = %s, password_hash = COALESCE(%s, password_hash)
             WHERE id = %s
-        """, (datetime.now(timezone.utc), datetime.now(timezone.utc), user_id))
-
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user from JWT token"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    user = get_user_by_username(username)
-    if user is None:
-        raise credentials_exception
-    
-    # Remove password hash from response
-    user_dict = {k: v for k, v in user.items() if k != 'password_hash'}
-    return user_dict
+        """, (datetime.now(timezone.utc), datetime.now(timezone.utc), rehashed_password, user_id))
+    invalidate_cached_user(user_id=user_id)
 
 # Routes
 @auth_router.post("/login", response_model=Token)
@@ -200,11 +131,15 @@ async def login(user_credentials: UserLogin):
             )
         
         # Try to find user by username or email
-        user = get_user_by_username(user_credentials.username)
+        user = await run_db(get_user_by_username, user_credentials.username)
         if not user:
-            user = get_user_by_email(user_credentials.username)
+            user = await run_db(get_user_by_email, user_credentials.username)
         
-        if not user or not verify_password(user_credentials.password, user['password_hash']):
+        # bcrypt runs on the hashing pool; new_hash is set when AUTH_BCRYPT_ROUNDS changed
+        valid, new_hash = (False, None)
+        if user:
+            valid, new_hash = await verify_and_update(user_credentials.password, user['password_hash'])
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password"
@@ -216,8 +151,8 @@ async def login(user_credentials: UserLogin):
                 detail="Account is deactivated. Please contact administrator."
             )
         
-        # Update last login
-        update_last_login(user['id'])
+        # Update last login (and upgrade the stored hash to the current cost)
+        await run_db(update_last_login, user['id'], new_hash)
         
         # Create access token and refresh token
         access_token = create_access_token(data={"sub": user['username']})
@@ -234,6 +169,8 @@ async def login(user_credentials: UserLogin):
         }
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         error_msg = str(e)
         raise HTTPException(status_code=500, detail=f"Login failed: {error_msg}")
@@ -259,18 +196,21 @@ async def register(user_data: UserRegister):
             )
         
         # Check if username or email already exists
-        existing_username = get_user_by_username(user_data.username)
-        existing_email = get_user_by_email(user_data.email)
+        existing_username = await run_db(get_user_by_username, user_data.username)
+        existing_email = await run_db(get_user_by_email, user_data.email)
         
         if existing_username:
             raise HTTPException(status_code=400, detail="Username already exists")
         if existing_email:
             raise HTTPException(status_code=400, detail="Email already exists")
         
-        user = register_user(user_data)
+        hashed_password = await get_password_hash(user_data.password)
+        user = await run_db(register_user, user_data, hashed_password)
         return user
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
@@ -307,7 +247,7 @@ async def refresh_token(refresh_request: RefreshTokenRequest):
             )
         
         # Get user from database
-        user = get_user_by_username(username)
+        user = await run_db(get_user_by_username, username)
         if not user:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
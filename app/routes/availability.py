@@ -1,14 +1,20 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import List, Optional
 from datetime import datetime, timezone, date, time
-import jwt
-from jwt import PyJWTError
-import os
 import logging
-from app.utils.db import conn
-from psycopg2.extras import RealDictCursor, Json
+from app.utils.db import (
+    conn,
+    run_db,
+    transaction,
+    get_time_slot,
+    set_slot_availability,
+    TIME_SLOTS_JSON_SQL
+)
+from app.utils.auth import require_admin, require_admin_or_receptionist, require_authenticated_user
+from app.utils.stats import cached_stats
+from app.utils.voice_context import invalidate_availability_context
+from psycopg2.extras import RealDictCursor, execute_values
 import psycopg2
 
 # Set up logging
@@ -17,13 +23,6 @@ logger = logging.getLogger(__name__)
 # Initialize router
 availability_router = APIRouter()
 
-# Security setup
-security = HTTPBearer()
-
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
-
 # Pydantic models
 class TimeSlot(BaseModel):
     start: str  # Format: "HH:MM"
@@ -59,67 +58,18 @@ class AvailabilitySearch(BaseModel):
     date_to: Optional[date] = None
     available_only: Optional[bool] = None
 
-# Authentication functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    # Get user from database
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-    
-    if user is None:
-        raise credentials_exception
-    
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=401,
-            detail="Inactive user"
-        )
-    
-    return user
-
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin role"""
-    if current_user.get('role') != 'admin':
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_admin_or_receptionist(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin or receptionist role"""
-    if current_user.get('role') not in ['admin', 'receptionist']:
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_authenticated_user(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require any authenticated user"""
-    return current_user
-
 # Database helper functions
+# Slots live one per row in availability_slots; `time_slots` in responses is rebuilt from them
+AVAILABILITY_COLUMNS = f"""
+    a.id, a.dentist_id, a.date, {TIME_SLOTS_JSON_SQL} AS time_slots,
+    a.created_at, a.updated_at, d.name as dentist_name
+"""
+
 def _get_availability_by_id(availability_id: int) -> Optional[dict]:
     """Get a single availability by ID (internal helper)"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT a.*, d.name as dentist_name
+        cur.execute(f"""
+            SELECT {AVAILABILITY_COLUMNS}
             FROM availability a
             JOIN dentists d ON a.dentist_id = d.id
             WHERE a.id = %s
@@ -129,8 +79,8 @@ def _get_availability_by_id(availability_id: int) -> Optional[dict]:
 def _get_availability_by_dentist_and_date(dentist_id: int, date: date) -> Optional[dict]:
     """Get availability for a specific dentist on a specific date (internal helper)"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        query = """
-            SELECT a.*, d.name as dentist_name
+        query = f"""
+            SELECT {AVAILABILITY_COLUMNS}
             FROM availability a
             JOIN dentists d ON a.dentist_id = d.id
             WHERE a.dentist_id = %s AND a.date = %s
@@ -149,30 +99,25 @@ def _normalize_time_str(value) -> Optional[str]:
         return value.strftime("%H:%M")
     return str(value)
 
-def _get_time_slot_details(dentist_id: int, slot_date: date, start_time: str):
-    """Retrieve availability record, time slots list, and matching slot for given start time"""
-    if isinstance(slot_date, str):
-        slot_date = datetime.strptime(slot_date, "%Y-%m-%d").date()
-    
-    normalized_start = _normalize_time_str(start_time)
-    record = _get_availability_by_dentist_and_date(dentist_id, slot_date)
-    
-    if not record:
-        return None, None, None
-    
-    time_slots = record.get("time_slots", [])
-    matching_slot = None
-    for slot in time_slots:
-        slot_start = _normalize_time_str(slot.get("start"))
-        if slot_start == normalized_start:
-            # Normalize stored values for downstream checks
-            slot["start"] = slot_start
-            if "end" in slot:
-                slot["end"] = _normalize_time_str(slot.get("end"))
-            matching_slot = slot
-            break
-    
-    return record, time_slots, matching_slot
+def _replace_time_slots(cur, availability: dict, time_slots: List[dict]):
+    """Make the slot rows of one availability record match `time_slots` (run inside a transaction)"""
+    starts = [slot["start"] for slot in time_slots]
+    cur.execute("""
+        DELETE FROM availability_slots
+        WHERE availability_id = %s AND NOT (start_time = ANY(%s::time[]))
+    """, (availability["id"], starts))
+    execute_values(cur, """
+        INSERT INTO availability_slots (availability_id, dentist_id, date, start_time, end_time, available)
+        VALUES %s
+        ON CONFLICT (dentist_id, date, start_time) DO UPDATE
+        SET end_time = EXCLUDED.end_time,
+            available = EXCLUDED.available,
+            updated_at = CURRENT_TIMESTAMP
+    """, [
+        (availability["id"], availability["dentist_id"], availability["date"],
+         slot["start"], slot["end"], slot["available"])
+        for slot in time_slots
+    ])
 
 def set_time_slot_availability(
     dentist_id: int,
@@ -181,47 +126,23 @@ def set_time_slot_availability(
     available: bool,
     end_time: Optional[str] = None
 ) -> bool:
-    """Set availability flag for a specific time slot"""
-    record, _, matching_slot = _get_time_slot_details(dentist_id, slot_date, start_time)
-    
-    if not record or not matching_slot:
-        return False
-    
+    """
+    Set availability flag for a specific time slot.
+    Booking is a single conditional update, so it returns False if the slot was
+    taken concurrently; releasing a slot that is already free returns True.
+    """
     normalized_start = _normalize_time_str(start_time)
-    normalized_end = _normalize_time_str(end_time) if end_time else matching_slot.get("end")
+    normalized_end = _normalize_time_str(end_time) if end_time else None
     
-    current_flag = matching_slot.get("available")
-    if isinstance(current_flag, str):
-        current_flag = current_flag.lower() == "true"
-    
-    if current_flag == available:
+    if set_slot_availability(dentist_id, slot_date, normalized_start, available, normalized_end):
+        invalidate_availability_context()
         return True
     
-    with conn.cursor() as cur:
-        cur.execute("""
-            UPDATE availability 
-            SET time_slots = (
-                SELECT jsonb_agg(
-                    CASE 
-                        WHEN slot->>'start' = %s
-                             AND (%s IS NULL OR slot->>'end' = %s)
-                        THEN jsonb_set(slot, '{available}', %s::jsonb)
-                        ELSE slot
-                    END
-                )
-                FROM jsonb_array_elements(time_slots) AS slot
-            ),
-            updated_at = %s
-            WHERE id = %s
-        """, (
-            normalized_start,
-            normalized_end,
-            normalized_end,
-            'true' if available else 'false',
-            datetime.now(timezone.utc),
-            record["id"]
-        ))
-        return cur.rowcount > 0
+    if not available:
+        return False
+    
+    slot = get_time_slot(dentist_id, slot_date, normalized_start)
+    return slot is not None and slot["available"]
 
 def ensure_time_slot_available(
     dentist_id: int,
@@ -229,7 +150,15 @@ def ensure_time_slot_available(
     start_time
 ) -> None:
     """Validate that the requested time slot exists and is currently available"""
-    record, _, matching_slot = _get_time_slot_details(dentist_id, slot_date, start_time)
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT a.id, s.available
+            FROM availability a
+            LEFT JOIN availability_slots s
+                ON s.availability_id = a.id AND s.start_time = %s::time
+            WHERE a.dentist_id = %s AND a.date = %s
+        """, (_normalize_time_str(start_time), dentist_id, slot_date))
+        record = cur.fetchone()
     
     if not record:
         raise HTTPException(
@@ -237,17 +166,13 @@ def ensure_time_slot_available(
             detail="Availability is not configured for this dentist on the selected date"
         )
     
-    if not matching_slot:
+    if record["available"] is None:
         raise HTTPException(
             status_code=400,
             detail="Requested time slot is not available in the schedule"
         )
     
-    flag = matching_slot.get("available", False)
-    if isinstance(flag, str):
-        flag = flag.lower() == "true"
-    
-    if not flag:
+    if not record["available"]:
         raise HTTPException(
             status_code=400,
             detail="Requested time slot has already been booked"
@@ -256,8 +181,8 @@ def ensure_time_slot_available(
 def get_all_availability() -> List[dict]:
     """Get all availability records"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT a.*, d.name as dentist_name
+        cur.execute(f"""
+            SELECT {AVAILABILITY_COLUMNS}
             FROM availability a
             JOIN dentists d ON a.dentist_id = d.id
             ORDER BY a.date, a.dentist_id
@@ -280,68 +205,59 @@ def create_availability(availability_data: AvailabilityCreate) -> dict:
         if not dentist:
             raise HTTPException(status_code=404, detail="Dentist not found")
     
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            INSERT INTO availability (dentist_id, date, time_slots)
-            VALUES (%s, %s, %s::jsonb)
-            RETURNING id, dentist_id, date, time_slots, created_at, updated_at
-        """, (
-            availability_data.dentist_id,
-            availability_data.date,
-            Json([slot.dict() for slot in availability_data.time_slots])
-        ))
-        result = cur.fetchone()
-        result['dentist_name'] = dentist['name']
-        return result
+    with transaction():
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                INSERT INTO availability (dentist_id, date)
+                VALUES (%s, %s)
+                RETURNING id, dentist_id, date, created_at, updated_at
+            """, (
+                availability_data.dentist_id,
+                availability_data.date
+            ))
+            result = cur.fetchone()
+            time_slots = [slot.dict() for slot in availability_data.time_slots]
+            _replace_time_slots(cur, result, time_slots)
+    invalidate_availability_context()
+    
+    result['time_slots'] = sorted(time_slots, key=lambda slot: slot['start'])
+    result['dentist_name'] = dentist['name']
+    return result
 
 def update_availability(availability_id: int, availability_data: AvailabilityUpdate) -> Optional[dict]:
     """Update an existing availability record"""
-    # Build dynamic update query
-    update_fields = []
-    values = []
+    # time_slots is the only updatable field; it is stored as one row per slot
+    time_slots = availability_data.dict(exclude_unset=True).get("time_slots")
     
-    for field, value in availability_data.dict(exclude_unset=True).items():
-        if value is not None:
-            if field == "time_slots":
-                update_fields.append("time_slots = %s::jsonb")
-                # value is already a list of dicts from .dict()
-                values.append(Json(value))
-            else:
-                update_fields.append(f"{field} = %s")
-                values.append(value)
-    
-    if not update_fields:
+    if time_slots is None:
         return _get_availability_by_id(availability_id)
     
-    # Add updated_at timestamp
-    update_fields.append("updated_at = %s")
-    values.append(datetime.now(timezone.utc))
-    
-    values.append(availability_id)
+    with transaction():
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("""
+                UPDATE availability 
+                SET updated_at = %s
+                WHERE id = %s
+                RETURNING id, dentist_id, date
+            """, (datetime.now(timezone.utc), availability_id))
+            record = cur.fetchone()
+            
+            if not record:
+                return None
+            
+            _replace_time_slots(cur, record, time_slots)
+    invalidate_availability_context()
     
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute(f"""
-            UPDATE availability 
-            SET {', '.join(update_fields)}
-            WHERE id = %s
-            RETURNING id, dentist_id, date, time_slots, created_at, updated_at
-        """, values)
-        result = cur.fetchone()
-        
-        if result:
-            # Get dentist name
-            with conn.cursor(cursor_factory=RealDictCursor) as dentist_cur:
-                dentist_cur.execute("SELECT name FROM dentists WHERE id = %s", (result['dentist_id'],))
-                dentist = dentist_cur.fetchone()
-                result['dentist_name'] = dentist['name'] if dentist else None
-        
-        return result
+    return _get_availability_by_id(availability_id)
 
 def delete_availability(availability_id: int) -> bool:
-    """Delete an availability record"""
+    """Delete an availability record (its slot rows are removed by cascade)"""
     with conn.cursor() as cur:
         cur.execute("DELETE FROM availability WHERE id = %s", (availability_id,))
-        return cur.rowcount > 0
+        deleted = cur.rowcount > 0
+    if deleted:
+        invalidate_availability_context()
+    return deleted
 
 def search_availability(
     dentist_id: int = None,
@@ -366,10 +282,18 @@ def search_availability(
             conditions.append("a.date <= %s")
             params.append(date_to)
         
+        if available_only:
+            conditions.append("""
+                EXISTS (
+                    SELECT 1 FROM availability_slots s
+                    WHERE s.availability_id = a.id AND s.available
+                )
+            """)
+        
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
         cur.execute(f"""
-            SELECT a.*, d.name as dentist_name
+            SELECT {AVAILABILITY_COLUMNS}
             FROM availability a
             JOIN dentists d ON a.dentist_id = d.id
             WHERE {where_clause}
@@ -377,23 +301,18 @@ def search_availability(
         """, params)
         results = cur.fetchall()
         
-        # Filter by available slots if requested
+        # Only return the open slots if requested
         if available_only:
-            filtered_results = []
             for result in results:
-                available_slots = [slot for slot in result['time_slots'] if slot.get('available', False)]
-                if available_slots:
-                    result['time_slots'] = available_slots
-                    filtered_results.append(result)
-            return filtered_results
+                result['time_slots'] = [slot for slot in result['time_slots'] if slot.get('available', False)]
         
         return results
 
 def get_available_slots_by_dentist(dentist_id: int, date: date) -> List[dict]:
     """Get available time slots for a specific dentist on a specific date"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT a.*, d.name as dentist_name
+        cur.execute(f"""
+            SELECT {AVAILABILITY_COLUMNS}
             FROM availability a
             JOIN dentists d ON a.dentist_id = d.id
             WHERE a.dentist_id = %s AND a.date = %s
@@ -408,94 +327,55 @@ def get_available_slots_by_dentist(dentist_id: int, date: date) -> List[dict]:
         result['time_slots'] = available_slots
         return [result] if available_slots else []
 
+def _set_slot_by_availability_id(availability_id: int, time_slot: TimeSlot, available: bool) -> bool:
+    """
+    Set one slot of an availability record. Booking is conditional (False if the
+    slot is missing or already taken); releasing succeeds whenever the slot exists.
+    """
+    # Only booking needs the compare-and-set; releasing a free slot is not an error
+    only_if_free = "" if available else "AND available = true"
+    with conn.cursor() as cur:
+        cur.execute(f"""
+            UPDATE availability_slots
+            SET available = %s, updated_at = %s
+            WHERE availability_id = %s
+              AND start_time = %s::time
+              AND end_time = %s::time
+              {only_if_free}
+        """, (
+            available,
+            datetime.now(timezone.utc),
+            availability_id,
+            time_slot.start,
+            time_slot.end
+        ))
+        changed = cur.rowcount > 0
+    if changed:
+        invalidate_availability_context()
+    return changed
+
 def book_time_slot(availability_id: int, time_slot: TimeSlot) -> bool:
     """Book a specific time slot"""
-    with conn.cursor() as cur:
-        # Get current availability
-        cur.execute("SELECT time_slots FROM availability WHERE id = %s", (availability_id,))
-        result = cur.fetchone()
-        
-        if not result:
-            return False
-        
-        time_slots = result[0]
-        
-        # Find and update the specific time slot
-        for slot in time_slots:
-            if slot['start'] == time_slot.start and slot['end'] == time_slot.end:
-                slot['available'] = False
-                break
-        
-        # Update the availability record
-        cur.execute("""
-            UPDATE availability 
-            SET time_slots = %s::jsonb, updated_at = %s
-            WHERE id = %s
-        """, (Json(time_slots), datetime.now(timezone.utc), availability_id))
-        
-        return cur.rowcount > 0
+    return _set_slot_by_availability_id(availability_id, time_slot, available=False)
 
 def release_time_slot(availability_id: int, time_slot: TimeSlot) -> bool:
     """Release a specific time slot"""
-    with conn.cursor() as cur:
-        # Get current availability
-        cur.execute("SELECT time_slots FROM availability WHERE id = %s", (availability_id,))
-        result = cur.fetchone()
-        
-        if not result:
-            return False
-        
-        time_slots = result[0]
-        
-        # Find and update the specific time slot
-        for slot in time_slots:
-            if slot['start'] == time_slot.start and slot['end'] == time_slot.end:
-                slot['available'] = True
-                break
-        
-        # Update the availability record
-        cur.execute("""
-            UPDATE availability 
-            SET time_slots = %s::jsonb, updated_at = %s
-            WHERE id = %s
-        """, (Json(time_slots), datetime.now(timezone.utc), availability_id))
-        
-        return cur.rowcount > 0
+    return _set_slot_by_availability_id(availability_id, time_slot, available=True)
 
 def get_availability_statistics() -> dict:
-    """Get availability statistics"""
+    """Get availability statistics (from the availability_dentist_stats rollup)"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Total availability records
-        cur.execute("SELECT COUNT(*) as total FROM availability")
-        total_availability = cur.fetchone()['total']
-        
         # Availability by dentist
         cur.execute("""
-            SELECT d.name as dentist_name, COUNT(a.id) as availability_count
+            SELECT d.name as dentist_name, COALESCE(s.availability_count, 0) as availability_count,
+                   COALESCE(s.open_slots, 0) as open_slots, COALESCE(s.booked_slots, 0) as booked_slots
             FROM dentists d
-            LEFT JOIN availability a ON d.id = a.dentist_id
-            GROUP BY d.id, d.name
+            LEFT JOIN availability_dentist_stats s ON d.id = s.dentist_id
             ORDER BY availability_count DESC
         """)
-        availability_by_dentist = cur.fetchall()
-        
-        # Total available slots
-        cur.execute("""
-            SELECT COUNT(*) as total_slots
-            FROM availability, jsonb_array_elements(time_slots) as slot
-            WHERE (slot->>'available')::boolean = true
-        """)
-        total_available_slots = cur.fetchone()['total_slots']
-        
-        # Total booked slots
-        cur.execute("""
-            SELECT COUNT(*) as total_booked_slots
-            FROM availability, jsonb_array_elements(time_slots) as slot
-            WHERE (slot->>'available')::boolean = false
-        """)
-        total_booked_slots = cur.fetchone()['total_booked_slots']
+        rows = cur.fetchall()
         
-        # Upcoming availability (next 7 days)
+        # Upcoming availability (next 7 days) - an index range scan on availability.date
         cur.execute("""
             SELECT COUNT(*) as upcoming_availability
             FROM availability
@@ -503,10 +383,15 @@ def get_availability_statistics() -> dict:
         """)
         upcoming_availability = cur.fetchone()['upcoming_availability']
     
+    availability_by_dentist = [
+        {"dentist_name": row['dentist_name'], "availability_count": row['availability_count']}
+        for row in rows
+    ]
+    
     return {
-        "total_availability_records": total_availability,
-        "total_available_slots": total_available_slots,
-        "total_booked_slots": total_booked_slots,
+        "total_availability_records": sum(row['availability_count'] for row in rows),
+        "total_available_slots": sum(row['open_slots'] for row in rows),
+        "total_booked_slots": sum(row['booked_slots'] for row in rows),
         "availability_by_dentist": availability_by_dentist,
         "upcoming_availability": upcoming_availability
     }
@@ -525,7 +410,7 @@ async def get_availability(
     Get availability records with optional filtering
     """
     try:
-        availability = search_availability(dentist_id, date_from, date_to, available_only)
+        availability = await run_db(search_availability, dentist_id, date_from, date_to, available_only)
         return availability
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch availability: {str(e)}")
@@ -536,7 +421,7 @@ async def get_availability_by_id(availability_id: int, current_user: dict = Depe
     Get a specific availability record by ID
     """
     try:
-        availability = _get_availability_by_id(availability_id)
+        availability = await run_db(_get_availability_by_id, availability_id)
         if not availability:
             raise HTTPException(status_code=404, detail="Availability record not found")
         return availability
@@ -555,7 +440,7 @@ async def get_availability_by_dentist_and_date(
     Get availability for a specific dentist on a specific date
     """
     try:
-        availability = _get_availability_by_dentist_and_date(dentist_id, date)
+        availability = await run_db(_get_availability_by_dentist_and_date, dentist_id, date)
         if not availability:
             raise HTTPException(status_code=404, detail="No availability found for this dentist on this date")
         return availability
@@ -574,7 +459,7 @@ async def get_available_slots(
     Get only available time slots for a specific dentist on a specific date
     """
     try:
-        available_slots = get_available_slots_by_dentist(dentist_id, date)
+        available_slots = await run_db(get_available_slots_by_dentist, dentist_id, date)
         return available_slots
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch available slots: {str(e)}")
@@ -588,7 +473,7 @@ async def create_availability_endpoint(
     Create a new availability record
     """
     try:
-        availability = create_availability(availability_data)
+        availability = await run_db(create_availability, availability_data)
         return availability
     except HTTPException:
         raise
@@ -606,11 +491,11 @@ async def update_availability_endpoint(
     """
     try:
         # Check if availability exists
-        existing_availability = _get_availability_by_id(availability_id)
+        existing_availability = await run_db(_get_availability_by_id, availability_id)
         if not existing_availability:
             raise HTTPException(status_code=404, detail="Availability record not found")
         
-        availability = update_availability(availability_id, availability_data)
+        availability = await run_db(update_availability, availability_id, availability_data)
         return availability
     except HTTPException:
         raise
@@ -627,11 +512,11 @@ async def delete_availability_endpoint(
     """
     try:
         # Check if availability exists
-        existing_availability = _get_availability_by_id(availability_id)
+        existing_availability = await run_db(_get_availability_by_id, availability_id)
         if not existing_availability:
             raise HTTPException(status_code=404, detail="Availability record not found")
         
-        success = delete_availability(availability_id)
+        success = await run_db(delete_availability, availability_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete availability record")
         
@@ -651,7 +536,7 @@ async def book_time_slot_endpoint(
     Book a specific time slot
     """
     try:
-        success = book_time_slot(availability_id, time_slot)
+        success = await run_db(book_time_slot, availability_id, time_slot)
         if not success:
             raise HTTPException(status_code=400, detail="Failed to book time slot")
         
@@ -671,7 +556,7 @@ async def release_time_slot_endpoint(
     Release a specific time slot
     """
     try:
-        success = release_time_slot(availability_id, time_slot)
+        success = await run_db(release_time_slot, availability_id, time_slot)
         if not success:
             raise HTTPException(status_code=400, detail="Failed to release time slot")
         
@@ -687,7 +572,7 @@ async def get_availability_stats(current_user: dict = Depends(require_admin)):
     Get availability statistics (admin only)
     """
     try:
-        stats = get_availability_statistics()
+        stats = await cached_stats("availability", get_availability_statistics)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch availability statistics: {str(e)}")
@@ -1,59 +1,112 @@
 from fastapi import APIRouter, Depends, HTTPException, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import List, Dict, Any, Optional
 from datetime import datetime, date
-import jwt
-from jwt import PyJWTError
-import os
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from app.utils.db import conn
+from app.utils.db import conn, run_db
+from app.utils.auth import require_authenticated_user
+from app.utils.stats import cached_stats
+from app.utils.pagination import COUNT_MODES, encode_cursor, decode_cursor, count_rows
 
 dashboard_router = APIRouter()
 
-# Security setup
-security = HTTPBearer()
-
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
-
-# Authentication functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    # Get user from database
+def get_dashboard_counts(today: date):
+    """
+    Get today's, total patient, pending and estimated revenue counts.
+    Reads the trigger-maintained rollups (sql_files/add_stats_rollups.sql) in one query.
+    """
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-    
-    if user is None:
-        raise credentials_exception
+        cur.execute("""
+            SELECT
+                -- 1. Today's Appointments
+                (SELECT COALESCE(SUM(appointment_count), 0)::bigint
+                 FROM appointment_daily_stats
+                 WHERE appointment_date = %(today)s) as today_appointments,
+                -- 2. Total Patients
+                (SELECT COALESCE(SUM(patient_count), 0)::bigint
+                 FROM patient_status_stats) as total_patients,
+                -- 3. Pending Appointments (status = 'pending' or status = 'confirmed' but not completed)
+                (SELECT COALESCE(SUM(appointment_count), 0)::bigint
+                 FROM appointment_daily_stats
+                 WHERE status = 'pending'
+                    OR (status = 'confirmed' AND appointment_date >= %(today)s)) as pending_appointments,
+                -- 4. Revenue This Month (estimated at 100 per appointment until appointments carry a price)
+                (SELECT COALESCE(SUM(appointment_count), 0)::bigint * 100
+                 FROM appointment_daily_stats
+                 WHERE appointment_date >= date_trunc('month', %(today)s::date)
+                   AND appointment_date < date_trunc('month', %(today)s::date) + INTERVAL '1 month') as estimated_revenue
+        """, {"today": today})
+        counts = cur.fetchone()
     
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=401,
-            detail="Inactive user"
-        )
-    
-    return user
+    return (
+        counts['today_appointments'],
+        counts['total_patients'],
+        counts['pending_appointments'],
+        counts['estimated_revenue']
+    )
+
+def get_upcoming_appointments_page(
+    filter_type: str,
+    page_size: int,
+    offset: int,
+    after: Optional[tuple] = None,
+    count: str = "exact"
+):
+    """
+    Get total count, one page of today's or upcoming active appointments and the
+    cursor for the next page. With `after`, pages by key instead of OFFSET.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Build base WHERE clause based on filter_type
+        if filter_type == "today":
+            date_condition = "a.appointment_date = CURRENT_DATE"
+        else:
+            date_condition = "a.appointment_date > CURRENT_DATE"
+        # (date, time, id) ordering keeps pages stable and matches the keyset cursor
+        order_clause = "ORDER BY a.appointment_date, a.appointment_time, a.id"
 
-def require_authenticated_user(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require any authenticated user"""
-    return current_user
+        # Get total count
+        total_items = count_rows(cur, f"""
+            SELECT 1
+            FROM appointments a
+            WHERE {date_condition}
+              AND a.status NOT IN ('cancelled', 'rescheduled', 'completed', 'no_show')
+        """, (), count)
+
+        params = []
+        keyset_condition = ""
+        if after:
+            keyset_condition = "AND (a.appointment_date, a.appointment_time, a.id) > (%s, %s, %s)"
+            params.extend(after)
+            offset = 0
+
+        # Get paginated appointments (one extra row tells us whether a next page exists)
+        appointments_query = f"""
+            SELECT 
+                a.id,
+                a.patient,
+                a.appointment_time as time,
+                a.treatment,
+                COALESCE(a.status, 'confirmed') as status,
+                d.name as dentist_name,
+                a.appointment_date
+            FROM appointments a
+            LEFT JOIN dentists d ON a.dentist_id = d.id
+            WHERE {date_condition}
+              AND a.status NOT IN ('cancelled', 'rescheduled', 'completed', 'no_show')
+              {keyset_condition}
+            {order_clause}
+            LIMIT %s OFFSET %s
+        """
+        cur.execute(appointments_query, params + [page_size + 1, offset])
+        appointments = cur.fetchall()
+
+    next_cursor = None
+    if len(appointments) > page_size:
+        last = appointments[page_size - 1]
+        next_cursor = encode_cursor(last['appointment_date'], last['time'], last['id'])
+    
+    return total_items, appointments[:page_size], next_cursor
 
 @dashboard_router.get("/dashboard/stats")
 async def get_dashboard_stats(current_user: dict = Depends(require_authenticated_user)):
@@ -64,41 +117,9 @@ async def get_dashboard_stats(current_user: dict = Depends(require_authenticated
     try:
         today = date.today()
         
-        # 1. Today's Appointments
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT COUNT(*) as count
-                FROM appointments
-                WHERE appointment_date = %s
-            """, (today,))
-            today_appointments = cur.fetchone()['count'] or 0
-            
-            # 2. Total Patients
-            cur.execute("""
-                SELECT COUNT(*) as count
-                FROM patients
-            """)
-            total_patients = cur.fetchone()['count'] or 0
-            
-            # 3. Pending Appointments (status = 'pending' or status = 'confirmed' but not completed)
-            cur.execute("""
-                SELECT COUNT(*) as count
-                FROM appointments
-                WHERE status = 'pending' OR (status = 'confirmed' AND appointment_date >= %s)
-            """, (today,))
-            pending_appointments = cur.fetchone()['count'] or 0
-            
-            # 4. Revenue This Month (assuming appointments have a cost field or estimating)
-            # For now, we'll calculate based on appointments count
-            # You may need to add a cost/price field to the appointments table
-            cur.execute("""
-                SELECT COUNT(*) * 100 as estimated_revenue
-                FROM appointments
-                WHERE EXTRACT(MONTH FROM appointment_date) = EXTRACT(MONTH FROM CURRENT_DATE)
-                AND EXTRACT(YEAR FROM appointment_date) = EXTRACT(YEAR FROM CURRENT_DATE)
-            """)
-            revenue_data = cur.fetchone()
-            revenue = revenue_data['estimated_revenue'] if revenue_data else 0
+        today_appointments, total_patients, pending_appointments, revenue = await cached_stats(
+            "dashboard", get_dashboard_counts, today
+        )
         
         # Calculate changes (simplified - in production, you'd compare with previous period)
         stats = [
@@ -138,6 +159,8 @@ async def get_today_appointments(
     filter_type: Optional[str] = "today",
     page: Optional[int] = 1,
     page_size: Optional[int] = 10,
+    cursor: Optional[str] = None,
+    count: Optional[str] = "exact",
     current_user: dict = Depends(require_authenticated_user)
 ):
     """
@@ -146,6 +169,8 @@ async def get_today_appointments(
         filter_type: "today" (default) or "upcoming" to filter appointments
         page: Page number (default: 1, must be >= 1)
         page_size: Number of appointments per page (default: 10, must be between 1 and 100)
+        cursor: next_cursor from a previous response; pages by key instead of page number
+        count: "exact" (default), "estimated" (planner estimate) or "none" to skip the total
     Returns: Paginated list of appointments scheduled for today or upcoming
     """
     try:
@@ -164,46 +189,24 @@ async def get_today_appointments(
         if page_size > 100:
             page_size = 100
         
+        if count not in COUNT_MODES:
+            raise HTTPException(
+                status_code=400,
+                detail="count must be one of 'exact', 'estimated' or 'none'"
+            )
+        
+        after = None
+        if cursor:
+            try:
+                after = decode_cursor(cursor)
+            except ValueError:
+                raise HTTPException(status_code=400, detail="Invalid cursor")
+        
         offset = (page - 1) * page_size
         
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Build base WHERE clause based on filter_type
-            if filter_type == "today":
-                date_condition = "a.appointment_date = CURRENT_DATE"
-                order_clause = "ORDER BY a.appointment_time"
-            else:
-                date_condition = "a.appointment_date > CURRENT_DATE"
-                order_clause = "ORDER BY a.appointment_date, a.appointment_time"
-            
-            # Get total count
-            count_query = f"""
-                SELECT COUNT(*) as total
-                FROM appointments a
-                WHERE {date_condition}
-                  AND a.status NOT IN ('cancelled', 'rescheduled', 'completed', 'no_show')
-            """
-            cur.execute(count_query)
-            total_items = cur.fetchone()['total']
-            
-            # Get paginated appointments
-            appointments_query = f"""
-                SELECT 
-                    a.id,
-                    a.patient,
-                    a.appointment_time as time,
-                    a.treatment,
-                    COALESCE(a.status, 'confirmed') as status,
-                    d.name as dentist_name,
-                    a.appointment_date
-                FROM appointments a
-                LEFT JOIN dentists d ON a.dentist_id = d.id
-                WHERE {date_condition}
-                  AND a.status NOT IN ('cancelled', 'rescheduled', 'completed', 'no_show')
-                {order_clause}
-                LIMIT %s OFFSET %s
-            """
-            cur.execute(appointments_query, (page_size, offset))
-            appointments = cur.fetchall()
+        total_items, appointments, next_cursor = await run_db(
+            get_upcoming_appointments_page, filter_type, page_size, offset, after, count
+        )
         
         # Format appointments to match frontend requirements
         formatted_appointments = []
@@ -249,18 +252,22 @@ async def get_today_appointments(
             })
         
         # Calculate pagination metadata
-        total_pages = (total_items + page_size - 1) // page_size if total_items > 0 else 0
-        has_next = page < total_pages
-        has_prev = page > 1
+        total_pages = None
+        if total_items is not None:
+            total_pages = (total_items + page_size - 1) // page_size if total_items > 0 else 0
+        has_next = next_cursor is not None
+        has_prev = after is not None or page > 1
         
         return {
             "items": formatted_appointments,
-            "page": page,
+            "page": None if after else page,
             "page_size": page_size,
             "total_items": total_items,
             "total_pages": total_pages,
             "has_next": has_next,
             "has_prev": has_prev,
+            "next_cursor": next_cursor,
+            "total_is_estimate": count == "estimated",
             "filter_type": filter_type
         }
         
@@ -1,25 +1,16 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional, Dict
 from datetime import datetime, timezone
-import jwt
-from jwt import PyJWTError
-import os
-from app.utils.db import conn
+from app.utils.db import conn, run_db
+from app.utils.auth import get_current_user, require_admin, require_admin_or_dentist
+from app.utils.voice_context import invalidate_availability_context
 from psycopg2.extras import RealDictCursor
 import psycopg2
 
 # Initialize router
 dentist_router = APIRouter()
 
-# Security setup
-security = HTTPBearer()
-
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
-
 # Pydantic models for request/response
 class WorkingHours(BaseModel):
     """Working hours for a single day"""
@@ -55,57 +46,6 @@ class DentistResponse(DentistBase):
     class Config:
         from_attributes = True
 
-# Authentication functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    # Get user from database
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-    
-    if user is None:
-        raise credentials_exception
-    
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=401,
-            detail="Inactive user"
-        )
-    
-    return user
-
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin role"""
-    if current_user.get('role') != 'admin':
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_admin_or_dentist(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin or dentist role"""
-    if current_user.get('role') not in ['admin', 'dentist']:
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
 # Database helper functions
 def get_dentist_by_id(dentist_id: int) -> Optional[dict]:
     """Get a single dentist by ID"""
@@ -164,7 +104,9 @@ def create_dentist(dentist_data: DentistCreate) -> dict:
         # working_hours is already a dict from psycopg2 JSONB
         # No need to parse it
         
-        return result
+    # Dentist names/specialties are part of the voice assistant's context
+    invalidate_availability_context()
+    return result
 
 def update_dentist(dentist_id: int, dentist_data: DentistUpdate) -> Optional[dict]:
     """Update an existing dentist"""
@@ -207,13 +149,18 @@ def update_dentist(dentist_id: int, dentist_data: DentistUpdate) -> Optional[dic
         # working_hours is already a dict from psycopg2 JSONB
         # No need to parse it
         
-        return result
+    if result:
+        invalidate_availability_context()
+    return result
 
 def delete_dentist(dentist_id: int) -> bool:
     """Delete a dentist"""
     with conn.cursor() as cur:
         cur.execute("DELETE FROM dentists WHERE id = %s", (dentist_id,))
-        return cur.rowcount > 0
+        deleted = cur.rowcount > 0
+    if deleted:
+        invalidate_availability_context()
+    return deleted
 
 def search_dentists(query: str = None, specialty: str = None) -> List[dict]:
     """Search dentists by name or specialty"""
@@ -240,6 +187,43 @@ def search_dentists(query: str = None, specialty: str = None) -> List[dict]:
             return get_all_dentists()
         return cur.fetchall()
 
+def find_conflicting_dentist(email: str, license_num: str, exclude_id: Optional[int] = None) -> Optional[dict]:
+    """Find another dentist using the given email or license"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        if exclude_id is None:
+            cur.execute("SELECT id FROM dentists WHERE email = %s OR license = %s", 
+                       (email, license_num))
+        else:
+            cur.execute("""
+                SELECT id FROM dentists 
+                WHERE (email = %s OR license = %s) AND id != %s
+            """, (email, license_num, exclude_id))
+        return cur.fetchone()
+
+def count_dentist_appointments(dentist_id: int) -> int:
+    """Count appointments assigned to a dentist"""
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM appointments WHERE dentist_id = %s", (dentist_id,))
+        return cur.fetchone()[0]
+
+def get_dentist_appointment_list(dentist_id: int) -> List[dict]:
+    """Get all appointments for a dentist"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT a.*, d.name as dentist_name
+            FROM appointments a
+            JOIN dentists d ON a.dentist_id = d.id
+            WHERE a.dentist_id = %s
+            ORDER BY a.appointment_date, a.appointment_time
+        """, (dentist_id,))
+        return cur.fetchall()
+
+def get_specialties() -> List[str]:
+    """Get all unique dentist specialties"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT DISTINCT specialty FROM dentists ORDER BY specialty")
+        return [spec['specialty'] for spec in cur.fetchall()]
+
 # API Endpoints
 
 @dentist_router.get("/dentists", response_model=List[DentistResponse])
@@ -252,7 +236,7 @@ async def get_dentists(
     Get all dentists with optional search and specialty filtering
     """
     try:
-        dentists = search_dentists(search, specialty)
+        dentists = await run_db(search_dentists, search, specialty)
         return dentists
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch dentists: {str(e)}")
@@ -263,7 +247,7 @@ async def get_dentist(dentist_id: int, current_user: dict = Depends(get_current_
     Get a specific dentist by ID
     """
     try:
-        dentist = get_dentist_by_id(dentist_id)
+        dentist = await run_db(get_dentist_by_id, dentist_id)
         if not dentist:
             raise HTTPException(status_code=404, detail="Dentist not found")
         return dentist
@@ -279,17 +263,14 @@ async def create_dentist_endpoint(dentist_data: DentistCreate, current_user: dic
     """
     try:
         # Check if dentist with same email or license already exists
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT id FROM dentists WHERE email = %s OR license = %s", 
-                       (dentist_data.email, dentist_data.license))
-            existing = cur.fetchone()
-            if existing:
-                raise HTTPException(
-                    status_code=400, 
-                    detail="Dentist with this email or license already exists"
-                )
+        existing = await run_db(find_conflicting_dentist, dentist_data.email, dentist_data.license)
+        if existing:
+            raise HTTPException(
+                status_code=400, 
+                detail="Dentist with this email or license already exists"
+            )
         
-        dentist = create_dentist(dentist_data)
+        dentist = await run_db(create_dentist, dentist_data)
         return dentist
     except HTTPException:
         raise
@@ -303,27 +284,22 @@ async def update_dentist_endpoint(dentist_id: int, dentist_data: DentistUpdate,
     """
     try:
         # Check if dentist exists
-        existing_dentist = get_dentist_by_id(dentist_id)
+        existing_dentist = await run_db(get_dentist_by_id, dentist_id)
         if not existing_dentist:
             raise HTTPException(status_code=404, detail="Dentist not found")
         
         # Check for email/license conflicts if they're being updated
         if dentist_data.email or dentist_data.license:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                email = dentist_data.email or existing_dentist['email']
-                license_num = dentist_data.license or existing_dentist['license']
-                cur.execute("""
-                    SELECT id FROM dentists 
-                    WHERE (email = %s OR license = %s) AND id != %s
-                """, (email, license_num, dentist_id))
-                conflict = cur.fetchone()
-                if conflict:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Another dentist with this email or license already exists"
-                    )
+            email = dentist_data.email or existing_dentist['email']
+            license_num = dentist_data.license or existing_dentist['license']
+            conflict = await run_db(find_conflicting_dentist, email, license_num, dentist_id)
+            if conflict:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Another dentist with this email or license already exists"
+                )
         
-        dentist = update_dentist(dentist_id, dentist_data)
+        dentist = await run_db(update_dentist, dentist_id, dentist_data)
         return dentist
     except HTTPException:
         raise
@@ -337,21 +313,19 @@ async def delete_dentist_endpoint(dentist_id: int, current_user: dict = Depends(
     """
     try:
         # Check if dentist exists
-        existing_dentist = get_dentist_by_id(dentist_id)
+        existing_dentist = await run_db(get_dentist_by_id, dentist_id)
         if not existing_dentist:
             raise HTTPException(status_code=404, detail="Dentist not found")
         
         # Check if dentist has any appointments
-        with conn.cursor() as cur:
-            cur.execute("SELECT COUNT(*) FROM appointments WHERE dentist_id = %s", (dentist_id,))
-            appointment_count = cur.fetchone()[0]
-            if appointment_count > 0:
-                raise HTTPException(
-                    status_code=400,
-                    detail="Cannot delete dentist with existing appointments"
-                )
+        appointment_count = await run_db(count_dentist_appointments, dentist_id)
+        if appointment_count > 0:
+            raise HTTPException(
+                status_code=400,
+                detail="Cannot delete dentist with existing appointments"
+            )
         
-        success = delete_dentist(dentist_id)
+        success = await run_db(delete_dentist, dentist_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to delete dentist")
         
@@ -368,20 +342,11 @@ async def get_dentist_appointments(dentist_id: int, current_user: dict = Depends
     """
     try:
         # Check if dentist exists
-        existing_dentist = get_dentist_by_id(dentist_id)
+        existing_dentist = await run_db(get_dentist_by_id, dentist_id)
         if not existing_dentist:
             raise HTTPException(status_code=404, detail="Dentist not found")
         
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("""
-                SELECT a.*, d.name as dentist_name
-                FROM appointments a
-                JOIN dentists d ON a.dentist_id = d.id
-                WHERE a.dentist_id = %s
-                ORDER BY a.appointment_date, a.appointment_time
-            """, (dentist_id,))
-            appointments = cur.fetchall()
-        
+        appointments = await run_db(get_dentist_appointment_list, dentist_id)
         return appointments
     except HTTPException:
         raise
@@ -394,9 +359,6 @@ async def get_dentist_specialties(current_user: dict = Depends(get_current_user)
     Get all unique dentist specialties
     """
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            cur.execute("SELECT DISTINCT specialty FROM dentists ORDER BY specialty")
-            specialties = cur.fetchall()
-        return [spec['specialty'] for spec in specialties]
+        return await run_db(get_specialties)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch specialties: {str(e)}")
@@ -1,25 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import List, Optional, Tuple
 from datetime import datetime, timezone, date
-import jwt
-from jwt import PyJWTError
-import os
-from app.utils.db import conn
+from app.utils.db import conn, run_db
+from app.utils.auth import require_admin, require_admin_or_receptionist, require_authenticated_user
+from app.utils.stats import cached_stats
+from app.utils.pagination import COUNT_MODES, count_rows
 from psycopg2.extras import RealDictCursor
 import psycopg2
 
 # Initialize router
 patient_router = APIRouter()
 
-# Security setup
-security = HTTPBearer()
-
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
-
 # Pydantic models
 class PatientBase(BaseModel):
     name: str
@@ -62,60 +54,17 @@ class PatientSearch(BaseModel):
     date_of_birth_from: Optional[date] = None
     date_of_birth_to: Optional[date] = None
 
-# Authentication functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    # Get user from database
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-    
-    if user is None:
-        raise credentials_exception
-    
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=401,
-            detail="Inactive user"
-        )
-    
-    return user
+class PaginatedPatients(BaseModel):
+    items: List[PatientResponse]
+    page: int
+    page_size: int
+    total_items: Optional[int] = None  # None when count="none"
+    total_pages: Optional[int] = None
+    has_next: bool
+    has_prev: bool
+    total_is_estimate: bool = False
 
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin role"""
-    if current_user.get('role') != 'admin':
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_admin_or_receptionist(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin or receptionist role"""
-    if current_user.get('role') not in ['admin', 'receptionist']:
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_authenticated_user(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require any authenticated user"""
-    return current_user
+SEARCH_MODES = {"contains", "fuzzy"}
 
 # Database helper functions
 def get_patient_by_id(patient_id: int) -> Optional[dict]:
@@ -207,12 +156,25 @@ def search_patients(
     phone: str = None,
     status: str = None,
     date_of_birth_from: date = None,
-    date_of_birth_to: date = None
-) -> List[dict]:
-    """Search patients by various criteria"""
+    date_of_birth_to: date = None,
+    search: str = None,
+    search_mode: str = "contains",
+    page: int = 1,
+    page_size: int = 25,
+    count: str = "exact"
+) -> Tuple[Optional[int], List[dict], bool]:
+    """
+    Search patients by various criteria with pagination.
+    `search` matches name, email or phone: "contains" is a substring match,
+    "fuzzy" is a pg_trgm word-similarity match ranked by best score.
+    Returns (total_items or None, patients, has_more).
+    """
+    offset = (page - 1) * page_size
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         conditions = []
         params = []
+        order_clause = "ORDER BY created_at DESC, id DESC"
+        order_params = []
         
         if name:
             conditions.append("name ILIKE %s")
@@ -226,6 +188,23 @@ def search_patients(
             conditions.append("phone ILIKE %s")
             params.append(f"%{phone}%")
         
+        if search and search_mode == "fuzzy":
+            # <% is index-backed by the gin_trgm_ops indexes (add_patient_search_indexes.sql)
+            conditions.append("(%s <%% name OR %s <%% email OR %s <%% phone)")
+            params.extend([search, search, search])
+            order_clause = """
+                ORDER BY GREATEST(
+                    word_similarity(%s, name),
+                    word_similarity(%s, email),
+                    word_similarity(%s, phone)
+                ) DESC, name, id
+            """
+            order_params = [search, search, search]
+        elif search:
+            # Trigram indexes also serve these ILIKE '%...%' predicates
+            conditions.append("(name ILIKE %s OR email ILIKE %s OR phone ILIKE %s)")
+            params.extend([f"%{search}%"] * 3)
+        
         if status:
             conditions.append("status = %s")
             params.append(status)
@@ -240,14 +219,32 @@ def search_patients(
         
         where_clause = " AND ".join(conditions) if conditions else "1=1"
         
+        total_items = count_rows(cur, f"""
+            SELECT 1
+            FROM patients 
+            WHERE {where_clause}
+        """, params, count)
+        
+        # Fetch one extra row to know whether another page follows
         cur.execute(f"""
             SELECT id, name, email, phone, date_of_birth, last_visit, 
                    next_appointment, status, created_at, updated_at
             FROM patients 
             WHERE {where_clause}
-            ORDER BY created_at DESC
-        """, params)
-        return cur.fetchall()
+            {order_clause}
+            LIMIT %s OFFSET %s
+        """, params + order_params + [page_size + 1, offset])
+        results = cur.fetchall()
+        return total_items, results[:page_size], len(results) > page_size
+
+def find_patient_email_conflict(email: str, patient_id: int) -> Optional[dict]:
+    """Find another patient already using this email"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id FROM patients 
+            WHERE email = %s AND id != %s
+        """, (email, patient_id))
+        return cur.fetchone()
 
 def update_patient_last_visit(patient_id: int, visit_date: date):
     """Update patient's last visit date"""
@@ -282,66 +279,91 @@ def get_patient_appointments(patient_id: int) -> List[dict]:
         return cur.fetchall()
 
 def get_patient_statistics() -> dict:
-    """Get patient statistics"""
+    """Get patient statistics (from the patient_status_stats / patient_daily_stats rollups)"""
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Total patients
-        cur.execute("SELECT COUNT(*) as total FROM patients")
-        total_patients = cur.fetchone()['total']
-        
-        # Active patients
-        cur.execute("SELECT COUNT(*) as active FROM patients WHERE status = 'active'")
-        active_patients = cur.fetchone()['active']
-        
         # Patients by status
         cur.execute("""
-            SELECT status, COUNT(*) as count 
-            FROM patients 
-            GROUP BY status
+            SELECT status, patient_count as count 
+            FROM patient_status_stats 
+            WHERE patient_count > 0
         """)
         patients_by_status = cur.fetchall()
         
-        # Recent patients (last 30 days)
+        # Recent patients (last 30 days) and patients with upcoming appointments
         cur.execute("""
-            SELECT COUNT(*) as recent_patients 
-            FROM patients 
-            WHERE created_at >= NOW() - INTERVAL '30 days'
-        """)
-        recent_patients = cur.fetchone()['recent_patients']
-        
-        # Patients with upcoming appointments
-        cur.execute("""
-            SELECT COUNT(*) as upcoming_appointments 
-            FROM patients 
-            WHERE next_appointment >= CURRENT_DATE
+            SELECT
+                COALESCE(SUM(patient_count) FILTER (
+                    WHERE metric = 'created' AND stat_date >= CURRENT_DATE - 30
+                ), 0)::bigint as recent_patients,
+                COALESCE(SUM(patient_count) FILTER (
+                    WHERE metric = 'next_appointment' AND stat_date >= CURRENT_DATE
+                ), 0)::bigint as upcoming_appointments
+            FROM patient_daily_stats
+            WHERE (metric = 'created' AND stat_date >= CURRENT_DATE - 30)
+               OR (metric = 'next_appointment' AND stat_date >= CURRENT_DATE)
         """)
-        upcoming_appointments = cur.fetchone()['upcoming_appointments']
+        daily = cur.fetchone()
+    
+    total_patients = sum(row['count'] for row in patients_by_status)
+    active_patients = sum(row['count'] for row in patients_by_status if row['status'] == 'active')
     
     return {
         "total_patients": total_patients,
         "active_patients": active_patients,
         "inactive_patients": total_patients - active_patients,
         "patients_by_status": patients_by_status,
-        "recent_patients": recent_patients,
-        "upcoming_appointments": upcoming_appointments
+        "recent_patients": daily['recent_patients'],
+        "upcoming_appointments": daily['upcoming_appointments']
     }
 
 # API Endpoints
 
-@patient_router.get("/patients", response_model=List[PatientResponse])
+@patient_router.get("/patients", response_model=PaginatedPatients)
 async def get_patients(
     search: Optional[str] = None,
     status: Optional[str] = None,
+    search_mode: str = "contains",
+    page: int = 1,
+    page_size: int = 25,
+    count: str = "exact",
     current_user: dict = Depends(require_authenticated_user)
 ):
     """
-    Get all patients with optional search and status filtering
+    Get patients with optional search and status filtering, one page at a time.
+    search_mode "fuzzy" tolerates typos and ranks the closest matches first.
     """
+    if page < 1:
+        raise HTTPException(status_code=400, detail="page must be >= 1")
+    if page_size < 1 or page_size > 100:
+        raise HTTPException(status_code=400, detail="page_size must be between 1 and 100")
+    if search_mode not in SEARCH_MODES:
+        raise HTTPException(status_code=400, detail="search_mode must be either 'contains' or 'fuzzy'")
+    if count not in COUNT_MODES:
+        raise HTTPException(status_code=400, detail="count must be one of 'exact', 'estimated' or 'none'")
+    
     try:
-        if search:
-            patients = search_patients(name=search, email=search, phone=search)
-        else:
-            patients = search_patients(status=status)
-        return patients
+        total_items, patients, has_more = await run_db(
+            search_patients,
+            status=status,
+            search=search,
+            search_mode=search_mode,
+            page=page,
+            page_size=page_size,
+            count=count
+        )
+        total_pages = None
+        if total_items is not None:
+            total_pages = (total_items + page_size - 1) // page_size if total_items else 0
+        return PaginatedPatients(
+            items=patients,
+            page=page,
+            page_size=page_size,
+            total_items=total_items,
+            total_pages=total_pages,
+            has_next=has_more,
+            has_prev=page > 1,
+            total_is_estimate=count == "estimated"
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch patients: {str(e)}")
 
@@ -351,7 +373,7 @@ async def get_patient(patient_id: int, current_user: dict = Depends(require_auth
     Get a specific patient by ID
     """
     try:
-        patient = get_patient_by_id(patient_id)
+        patient = await run_db(get_patient_by_id, patient_id)
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         return patient
@@ -367,11 +389,11 @@ async def create_patient_endpoint(patient_data: PatientCreate, current_user: dic
     """
     try:
         # Check if patient with same email already exists
-        existing_patient = get_patient_by_email(patient_data.email)
+        existing_patient = await run_db(get_patient_by_email, patient_data.email)
         if existing_patient:
             raise HTTPException(status_code=400, detail="Patient with this email already exists")
         
-        patient = create_patient(patient_data)
+        patient = await run_db(create_patient, patient_data)
         return patient
     except HTTPException:
         raise
@@ -385,25 +407,20 @@ async def update_patient_endpoint(patient_id: int, patient_data: PatientUpdate,
     """
     try:
         # Check if patient exists
-        existing_patient = get_patient_by_id(patient_id)
+        existing_patient = await run_db(get_patient_by_id, patient_id)
         if not existing_patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
         # Check for email conflicts if email is being updated
         if patient_data.email:
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id FROM patients 
-                    WHERE email = %s AND id != %s
-                """, (patient_data.email, patient_id))
-                conflict = cur.fetchone()
-                if conflict:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Another patient with this email already exists"
-                    )
+            conflict = await run_db(find_patient_email_conflict, patient_data.email, patient_id)
+            if conflict:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Another patient with this email already exists"
+                )
         
-        patient = update_patient(patient_id, patient_data)
+        patient = await run_db(update_patient, patient_id, patient_data)
         return patient
     except HTTPException:
         raise
@@ -417,11 +434,11 @@ async def delete_patient_endpoint(patient_id: int, current_user: dict = Depends(
     """
     try:
         # Check if patient exists
-        existing_patient = get_patient_by_id(patient_id)
+        existing_patient = await run_db(get_patient_by_id, patient_id)
         if not existing_patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        success = delete_patient(patient_id)
+        success = await run_db(delete_patient, patient_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to deactivate patient")
         
@@ -438,11 +455,11 @@ async def get_patient_appointments_endpoint(patient_id: int, current_user: dict
     """
     try:
         # Check if patient exists
-        patient = get_patient_by_id(patient_id)
+        patient = await run_db(get_patient_by_id, patient_id)
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        appointments = get_patient_appointments(patient_id)
+        appointments = await run_db(get_patient_appointments, patient_id)
         return appointments
     except HTTPException:
         raise
@@ -455,11 +472,11 @@ async def update_last_visit(patient_id: int, visit_date: date, current_user: dic
     Update patient's last visit date
     """
     try:
-        patient = get_patient_by_id(patient_id)
+        patient = await run_db(get_patient_by_id, patient_id)
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        update_patient_last_visit(patient_id, visit_date)
+        await run_db(update_patient_last_visit, patient_id, visit_date)
         return {"message": "Last visit updated successfully"}
     except HTTPException:
         raise
@@ -472,11 +489,11 @@ async def update_next_appointment(patient_id: int, appointment_date: date, curre
     Update patient's next appointment date
     """
     try:
-        patient = get_patient_by_id(patient_id)
+        patient = await run_db(get_patient_by_id, patient_id)
         if not patient:
             raise HTTPException(status_code=404, detail="Patient not found")
         
-        update_patient_next_appointment(patient_id, appointment_date)
+        await run_db(update_patient_next_appointment, patient_id, appointment_date)
         return {"message": "Next appointment updated successfully"}
     except HTTPException:
         raise
@@ -489,7 +506,7 @@ async def get_patient_stats(current_user: dict = Depends(require_admin)):
     Get patient statistics (admin only)
     """
     try:
-        stats = get_patient_statistics()
+        stats = await cached_stats("patient", get_patient_statistics)
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch patient statistics: {str(e)}")
@@ -1,6 +1,5 @@
 from fastapi import APIRouter, HTTPException
 from azure.data.tables import TableServiceClient
-import bcrypt
 import os
 from pydantic import BaseModel, EmailStr
 import jwt
@@ -8,6 +7,7 @@ from datetime import datetime, timedelta
 from sendgrid import SendGridAPIClient
 from sendgrid.helpers.mail import Mail
 from app.utils.azure_utils import get_jwt_secret_key
+from app.utils.passwords import PasswordHasherBusy, get_password_hash, hasher_busy
 
 # FastAPI Router for password reset
 reset_router = APIRouter()
@@ -92,8 +92,11 @@ async def reset_password(data: ResetPassword):
     if not user_data:
         raise HTTPException(status_code=400, detail="User not found")
 
-    # Hash new password
-    hashed_password = bcrypt.hashpw(data.new_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
+    # Hash new password (on the hashing pool, at AUTH_BCRYPT_ROUNDS)
+    try:
+        hashed_password = await get_password_hash(data.new_password)
+    except PasswordHasherBusy:
+        raise hasher_busy()
 
     # Update password in Azure Table Storage
     user_entity = user_data[0]
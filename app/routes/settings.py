@@ -1,25 +1,15 @@
 from fastapi import APIRouter, HTTPException, Depends
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from typing import Optional, Dict
 from datetime import datetime, timezone
-import jwt
-from jwt import PyJWTError
-import os
-from app.utils.db import conn
+from app.utils.db import conn, run_db
+from app.utils.auth import require_admin, require_authenticated_user
 from psycopg2.extras import RealDictCursor, Json
 import psycopg2
 
 # Initialize router
 settings_router = APIRouter()
 
-# Security setup
-security = HTTPBearer()
-
-# JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
-
 # Pydantic models
 class DayWorkingHours(BaseModel):
     """Working hours for a single day"""
@@ -58,52 +48,6 @@ class SettingsResponse(SettingsBase):
     class Config:
         from_attributes = True
 
-# Authentication functions
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    # Get user from database
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
-        user = cur.fetchone()
-    
-    if user is None:
-        raise credentials_exception
-    
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=401,
-            detail="Inactive user"
-        )
-    
-    return user
-
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin role"""
-    if current_user.get('role') != 'admin':
-        raise HTTPException(
-            status_code=403,
-            detail="Not enough permissions"
-        )
-    return current_user
-
-def require_authenticated_user(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require any authenticated user"""
-    return current_user
-
 # Database helper functions
 def get_settings() -> Optional[dict]:
     """Get settings (singleton - only one record with id=1)"""
@@ -224,7 +168,7 @@ async def get_settings_endpoint(current_user: dict = Depends(require_authenticat
     Get current settings (any authenticated user can view)
     """
     try:
-        settings = get_settings()
+        settings = await run_db(get_settings)
         if not settings:
             raise HTTPException(status_code=404, detail="Settings not found")
         return settings
@@ -243,7 +187,7 @@ async def create_settings_endpoint(
     Note: Only one settings record can exist (singleton pattern)
     """
     try:
-        settings = create_settings(settings_data)
+        settings = await run_db(create_settings, settings_data)
         return settings
     except HTTPException:
         raise
@@ -259,7 +203,7 @@ async def update_settings_endpoint(
     Update settings (admin only)
     """
     try:
-        settings = update_settings(settings_data)
+        settings = await run_db(update_settings, settings_data)
         if not settings:
             raise HTTPException(status_code=404, detail="Settings not found")
         return settings
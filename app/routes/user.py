@@ -1,26 +1,22 @@
 from fastapi import APIRouter, HTTPException, Depends, status
-from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from pydantic import BaseModel, EmailStr
 from typing import List, Optional
 from datetime import datetime, timezone
-from passlib.context import CryptContext
 import jwt
-from jwt import PyJWTError
-import os
-from app.utils.db import conn
+from app.utils.db import conn, get_db_connection, run_db
+from app.utils.auth import SECRET_KEY, ALGORITHM, get_current_user, require_admin, invalidate_cached_user
+from app.utils.passwords import PasswordHasherBusy, get_password_hash, hasher_busy, verify_and_update, verify_password
 from psycopg2.extras import RealDictCursor
 import psycopg2
 
 # Initialize router
 user_router = APIRouter()
 
-# Security setup
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-security = HTTPBearer()
+# One pooled connection per request, except on the endpoints that hash or verify
+# a password: those check out per query so no connection is held through bcrypt
+db_dependencies = [Depends(get_db_connection)]
 
 # JWT settings
-SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
-ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
 # Pydantic models
@@ -72,14 +68,6 @@ class PasswordChange(BaseModel):
     new_password: str
 
 # Database helper functions
-def get_password_hash(password: str) -> str:
-    """Hash a password"""
-    return pwd_context.hash(password)
-
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return pwd_context.verify(plain_password, hashed_password)
-
 def create_access_token(data: dict):
     """Create JWT access token"""
     to_encode = data.copy()
@@ -112,10 +100,8 @@ def get_all_users() -> List[dict]:
         cur.execute("SELECT id, username, email, name, role, is_active, last_login, created_at, updated_at FROM users ORDER BY created_at DESC")
         return cur.fetchall()
 
-def create_user(user_data: UserCreate) -> dict:
+def create_user(user_data: UserCreate, hashed_password: str) -> dict:
     """Create a new user (admin only)"""
-    hashed_password = get_password_hash(user_data.password)
-    
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             INSERT INTO users (username, email, password_hash, name, role, is_active)
@@ -131,10 +117,8 @@ def create_user(user_data: UserCreate) -> dict:
         ))
         return cur.fetchone()
 
-def register_user(user_data: UserRegister) -> dict:
+def register_user(user_data: UserRegister, hashed_password: str) -> dict:
     """Register a new user (pending admin approval)"""
-    hashed_password = get_password_hash(user_data.password)
-    
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
             INSERT INTO users (username, email, password_hash, name, role, is_active)
@@ -159,7 +143,9 @@ def approve_user(user_id: int) -> Optional[dict]:
             WHERE id = %s
             RETURNING id, username, email, name, role, is_active, created_at, updated_at
         """, (datetime.now(timezone.utc), user_id))
-        return cur.fetchone()
+        result = cur.fetchone()
+    invalidate_cached_user(user_id=user_id)
+    return result
 
 def get_pending_users() -> List[dict]:
     """Get users pending approval"""
@@ -172,8 +158,8 @@ def get_pending_users() -> List[dict]:
         """)
         return cur.fetchall()
 
-def update_user(user_id: int, user_data: UserUpdate) -> Optional[dict]:
-    """Update an existing user"""
+def update_user(user_id: int, user_data: UserUpdate, hashed_password: Optional[str] = None) -> Optional[dict]:
+    """Update an existing user (a new password arrives already hashed)"""
     # Build dynamic update query
     update_fields = []
     values = []
@@ -181,8 +167,9 @@ def update_user(user_id: int, user_data: UserUpdate) -> Optional[dict]:
     for field, value in user_data.dict(exclude_unset=True).items():
         if value is not None:
             if field == "password":
-                update_fields.append("password_hash = %s")
-                values.append(get_password_hash(value))
+                if hashed_password is not None:
+                    update_fields.append("password_hash = %s")
+                    values.append(hashed_password)
             else:
                 update_fields.append(f"{field} = %s")
                 values.append(value)
@@ -203,7 +190,9 @@ def update_user(user_id: int, user_data: UserUpdate) -> Optional[dict]:
             WHERE id = %s
             RETURNING id, username, email, name, role, is_active, last_login, created_at, updated_at
         """, values)
-        return cur.fetchone()
+        result = cur.fetchone()
+    invalidate_cached_user(user_id=user_id)
+    return result
 
 def delete_user(user_id: int) -> bool:
     """Delete a user (soft delete by setting is_active to False)"""
@@ -213,16 +202,19 @@ def delete_user(user_id: int) -> bool:
             SET is_active = False, updated_at = %s
             WHERE id = %s
         """, (datetime.now(timezone.utc), user_id))
-        return cur.rowcount > 0
+        deleted = cur.rowcount > 0
+    invalidate_cached_user(user_id=user_id)
+    return deleted
 
-def update_last_login(user_id: int):
-    """Update user's last login timestamp"""
+def update_last_login(user_id: int, rehashed_password: Optional[str] = None):
+    """Update user's last login timestamp, storing a rehashed password in the same statement"""
     with conn.cursor() as cur:
         cur.execute("""
             UPDATE users 
-            SET last_login = %s, updated_at = %s
+            SET last_login = %s, updated_at = %s, password_hash = COALESCE(%s, password_hash)
             WHERE id = %s
-        """, (datetime.now(timezone.utc), datetime.now(timezone.utc), user_id))
+        """, (datetime.now(timezone.utc), datetime.now(timezone.utc), rehashed_password, user_id))
+    invalidate_cached_user(user_id=user_id)
 
 def search_users(query: str = None, role: str = None, is_active: bool = None) -> List[dict]:
     """Search users by various criteria"""
@@ -252,44 +244,59 @@ def search_users(query: str = None, role: str = None, is_active: bool = None) ->
         """, params)
         return cur.fetchall()
 
-# Authentication dependency
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
-    """Get current authenticated user"""
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
-    
-    try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-    except PyJWTError:
-        raise credentials_exception
-    
-    user = get_user_by_username(username)
-    if user is None:
-        raise credentials_exception
-    
-    if not user.get('is_active', False):
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Inactive user"
-        )
-    
-    return user
+def find_conflicting_user(username: str, email: str, user_id: int) -> Optional[dict]:
+    """Find another user already using this username or email"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            SELECT id FROM users 
+            WHERE (username = %s OR email = %s) AND id != %s
+        """, (username, email, user_id))
+        return cur.fetchone()
 
-# Authorization dependencies
-def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
-    """Require admin role"""
-    if current_user.get('role') != 'admin':
-        raise HTTPException(
-            status_code=status.HTTP_403_FORBIDDEN,
-            detail="Not enough permissions"
-        )
-    return current_user
+def update_password_hash(user_id: int, hashed_password: str):
+    """Store a new password hash for a user"""
+    with conn.cursor() as cur:
+        cur.execute("""
+            UPDATE users 
+            SET password_hash = %s, updated_at = %s
+            WHERE id = %s
+        """, (hashed_password, datetime.now(timezone.utc), user_id))
+
+def get_user_statistics() -> dict:
+    """Get user statistics"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        # Total users
+        cur.execute("SELECT COUNT(*) as total FROM users")
+        total_users = cur.fetchone()['total']
+        
+        # Active users
+        cur.execute("SELECT COUNT(*) as active FROM users WHERE is_active = true")
+        active_users = cur.fetchone()['active']
+        
+        # Users by role
+        cur.execute("""
+            SELECT role, COUNT(*) as count 
+            FROM users 
+            WHERE is_active = true 
+            GROUP BY role
+        """)
+        users_by_role = cur.fetchall()
+        
+        # Recent logins (last 7 days)
+        cur.execute("""
+            SELECT COUNT(*) as recent_logins 
+            FROM users 
+            WHERE last_login >= NOW() - INTERVAL '7 days'
+        """)
+        recent_logins = cur.fetchone()['recent_logins']
+    
+    return {
+        "total_users": total_users,
+        "active_users": active_users,
+        "inactive_users": total_users - active_users,
+        "users_by_role": users_by_role,
+        "recent_logins": recent_logins
+    }
 
 def require_admin_or_self(user_id: int, current_user: dict = Depends(get_current_user)) -> dict:
     """Require admin role or user accessing their own data"""
@@ -309,18 +316,21 @@ async def register(user_data: UserRegister):
     """
     try:
         # Check if username or email already exists
-        existing_username = get_user_by_username(user_data.username)
-        existing_email = get_user_by_email(user_data.email)
+        existing_username = await run_db(get_user_by_username, user_data.username)
+        existing_email = await run_db(get_user_by_email, user_data.email)
         
         if existing_username:
             raise HTTPException(status_code=400, detail="Username already exists")
         if existing_email:
             raise HTTPException(status_code=400, detail="Email already exists")
         
-        user = register_user(user_data)
+        hashed_password = await get_password_hash(user_data.password)
+        user = await run_db(register_user, user_data, hashed_password)
         return user
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Registration failed: {str(e)}")
 
@@ -331,11 +341,14 @@ async def login(user_credentials: UserLogin):
     """
     try:
         # Try to find user by username or email
-        user = get_user_by_username(user_credentials.username)
+        user = await run_db(get_user_by_username, user_credentials.username)
         if not user:
-            user = get_user_by_email(user_credentials.username)
+            user = await run_db(get_user_by_email, user_credentials.username)
         
-        if not user or not verify_password(user_credentials.password, user['password_hash']):
+        valid, new_hash = (False, None)
+        if user:
+            valid, new_hash = await verify_and_update(user_credentials.password, user['password_hash'])
+        if not valid:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Incorrect username or password"
@@ -347,8 +360,8 @@ async def login(user_credentials: UserLogin):
                 detail="Account is deactivated"
             )
         
-        # Update last login
-        update_last_login(user['id'])
+        # Update last login (and upgrade the stored hash to the current cost)
+        await run_db(update_last_login, user['id'], new_hash)
         
         # Create access token
         access_token = create_access_token(data={"sub": user['username']})
@@ -363,17 +376,19 @@ async def login(user_credentials: UserLogin):
         }
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Login failed: {str(e)}")
 
-@user_router.get("/me", response_model=UserResponse)
+@user_router.get("/me", response_model=UserResponse, dependencies=db_dependencies)
 async def get_current_user_info(current_user: dict = Depends(get_current_user)):
     """
     Get current user information
     """
     return current_user
 
-@user_router.get("/users", response_model=List[UserResponse])
+@user_router.get("/users", response_model=List[UserResponse], dependencies=db_dependencies)
 async def get_users(
     search: Optional[str] = None,
     role: Optional[str] = None,
@@ -384,18 +399,18 @@ async def get_users(
     Get all users (admin only)
     """
     try:
-        users = search_users(search, role, is_active)
+        users = await run_db(search_users, search, role, is_active)
         return users
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch users: {str(e)}")
 
-@user_router.get("/users/{user_id}", response_model=UserResponse)
+@user_router.get("/users/{user_id}", response_model=UserResponse, dependencies=db_dependencies)
 async def get_user(user_id: int, current_user: dict = Depends(require_admin_or_self)):
     """
     Get a specific user by ID
     """
     try:
-        user = get_user_by_id(user_id)
+        user = await run_db(get_user_by_id, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         return user
@@ -411,18 +426,21 @@ async def create_user_endpoint(user_data: UserCreate, current_user: dict = Depen
     """
     try:
         # Check if username or email already exists
-        existing_username = get_user_by_username(user_data.username)
-        existing_email = get_user_by_email(user_data.email)
+        existing_username = await run_db(get_user_by_username, user_data.username)
+        existing_email = await run_db(get_user_by_email, user_data.email)
         
         if existing_username:
             raise HTTPException(status_code=400, detail="Username already exists")
         if existing_email:
             raise HTTPException(status_code=400, detail="Email already exists")
         
-        user = create_user(user_data)
+        hashed_password = await get_password_hash(user_data.password)
+        user = await run_db(create_user, user_data, hashed_password)
         return user
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create user: {str(e)}")
 
@@ -433,7 +451,7 @@ async def update_user_endpoint(user_id: int, user_data: UserUpdate, current_user
     """
     try:
         # Check if user exists
-        existing_user = get_user_by_id(user_id)
+        existing_user = await run_db(get_user_by_id, user_id)
         if not existing_user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -442,33 +460,31 @@ async def update_user_endpoint(user_id: int, user_data: UserUpdate, current_user
             username = user_data.username or existing_user['username']
             email = user_data.email or existing_user['email']
             
-            with conn.cursor(cursor_factory=RealDictCursor) as cur:
-                cur.execute("""
-                    SELECT id FROM users 
-                    WHERE (username = %s OR email = %s) AND id != %s
-                """, (username, email, user_id))
-                conflict = cur.fetchone()
-                if conflict:
-                    raise HTTPException(
-                        status_code=400,
-                        detail="Username or email already exists"
-                    )
+            conflict = await run_db(find_conflicting_user, username, email, user_id)
+            if conflict:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Username or email already exists"
+                )
         
-        user = update_user(user_id, user_data)
+        hashed_password = await get_password_hash(user_data.password) if user_data.password else None
+        user = await run_db(update_user, user_id, user_data, hashed_password)
         return user
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to update user: {str(e)}")
 
-@user_router.delete("/users/{user_id}")
+@user_router.delete("/users/{user_id}", dependencies=db_dependencies)
 async def delete_user_endpoint(user_id: int, current_user: dict = Depends(require_admin)):
     """
     Deactivate a user (admin only)
     """
     try:
         # Check if user exists
-        existing_user = get_user_by_id(user_id)
+        existing_user = await run_db(get_user_by_id, user_id)
         if not existing_user:
             raise HTTPException(status_code=404, detail="User not found")
         
@@ -479,7 +495,7 @@ async def delete_user_endpoint(user_id: int, current_user: dict = Depends(requir
                 detail="Cannot deactivate your own account"
             )
         
-        success = delete_user(user_id)
+        success = await run_db(delete_user, user_id)
         if not success:
             raise HTTPException(status_code=500, detail="Failed to deactivate user")
         
@@ -496,31 +512,28 @@ async def change_password(user_id: int, password_data: PasswordChange, current_u
     """
     try:
         # Get user
-        user = get_user_by_id(user_id)
+        user = await run_db(get_user_by_id, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         # Verify current password
-        if not verify_password(password_data.current_password, user['password_hash']):
+        if not await verify_password(password_data.current_password, user['password_hash']):
             raise HTTPException(status_code=400, detail="Current password is incorrect")
         
         # Update password
-        hashed_password = get_password_hash(password_data.new_password)
+        hashed_password = await get_password_hash(password_data.new_password)
         
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE users 
-                SET password_hash = %s, updated_at = %s
-                WHERE id = %s
-            """, (hashed_password, datetime.now(timezone.utc), user_id))
+        await run_db(update_password_hash, user_id, hashed_password)
         
         return {"message": "Password changed successfully"}
     except HTTPException:
         raise
+    except PasswordHasherBusy:
+        raise hasher_busy()
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to change password: {str(e)}")
 
-@user_router.get("/users/roles")
+@user_router.get("/users/roles", dependencies=db_dependencies)
 async def get_user_roles(current_user: dict = Depends(require_admin)):
     """
     Get all available user roles
@@ -535,76 +548,44 @@ async def get_user_roles(current_user: dict = Depends(require_admin)):
         }
     }
 
-@user_router.get("/users/pending", response_model=List[UserResponse])
+@user_router.get("/users/pending", response_model=List[UserResponse], dependencies=db_dependencies)
 async def get_pending_users_endpoint(current_user: dict = Depends(require_admin)):
     """
     Get users pending admin approval
     """
     try:
-        pending_users = get_pending_users()
+        pending_users = await run_db(get_pending_users)
         return pending_users
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch pending users: {str(e)}")
 
-@user_router.post("/users/{user_id}/approve", response_model=UserResponse)
+@user_router.post("/users/{user_id}/approve", response_model=UserResponse, dependencies=db_dependencies)
 async def approve_user_endpoint(user_id: int, current_user: dict = Depends(require_admin)):
     """
     Approve a user registration (admin only)
     """
     try:
         # Check if user exists and is pending
-        user = get_user_by_id(user_id)
+        user = await run_db(get_user_by_id, user_id)
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
         
         if user.get('is_active', False):
             raise HTTPException(status_code=400, detail="User is already active")
         
-        approved_user = approve_user(user_id)
+        approved_user = await run_db(approve_user, user_id)
         return approved_user
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to approve user: {str(e)}")
 
-@user_router.get("/users/stats")
+@user_router.get("/users/stats", dependencies=db_dependencies)
 async def get_user_stats(current_user: dict = Depends(require_admin)):
     """
     Get user statistics (admin only)
     """
     try:
-        with conn.cursor(cursor_factory=RealDictCursor) as cur:
-            # Total users
-            cur.execute("SELECT COUNT(*) as total FROM users")
-            total_users = cur.fetchone()['total']
-            
-            # Active users
-            cur.execute("SELECT COUNT(*) as active FROM users WHERE is_active = true")
-            active_users = cur.fetchone()['active']
-            
-            # Users by role
-            cur.execute("""
-                SELECT role, COUNT(*) as count 
-                FROM users 
-                WHERE is_active = true 
-                GROUP BY role
-            """)
-            users_by_role = cur.fetchall()
-            
-            # Recent logins (last 7 days)
-            cur.execute("""
-                SELECT COUNT(*) as recent_logins 
-                FROM users 
-                WHERE last_login >= NOW() - INTERVAL '7 days'
-            """)
-            recent_logins = cur.fetchone()['recent_logins']
-        
-        return {
-            "total_users": total_users,
-            "active_users": active_users,
-            "inactive_users": total_users - active_users,
-            "users_by_role": users_by_role,
-            "recent_logins": recent_logins
-        }
+        return await run_db(get_user_statistics)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to fetch user statistics: {str(e)}")
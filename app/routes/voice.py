@@ -1,11 +1,12 @@
 import os
 import json
 import asyncio
+import time
 import websockets
-import base64
-from datetime import datetime
+from collections import deque
 from fastapi import FastAPI, Request, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.responses import PlainTextResponse, HTMLResponse
+from starlette.websockets import WebSocketState
 from twilio.twiml.voice_response import VoiceResponse, Connect, Say, Stream, Gather
 from app.utils.decorators_twilio_auth import validate_twilio_request
 from app.utils.training_data_loader import get_cached_training_data
@@ -17,9 +18,21 @@ import re
 from app.utils.speech_services import synthesize_speech
 from pathlib import Path
 from fastapi.routing import APIRouter
-from app.utils.db import fetch_available_slots, fetch_dentists, find_patient_by_name, find_patient_by_phone, find_patient_by_email, create_new_patient
-from app.utils.booking import build_context_text, parse_booking_intent, parse_booking_intent_ai, book_if_possible
+from app.utils.db import find_patient_by_name, find_patient_by_phone, find_patient_by_email, create_new_patient, run_db
+from app.utils.booking import parse_booking_intent, parse_booking_intent_ai, book_if_possible
 from app.utils.kafka_producer import ai_response_producer
+from app.utils.media_frames import TwilioFrames, input_audio_append, loads
+from app.utils.realtime_pool import RealtimeSessionPool
+from app.utils.voice_context import get_availability_context
+from app.utils.call_context import prefetch_caller, claim_caller
+from app.utils.directives import INLINE_DIRECTIVES, DirectiveStreamParser, directive_executor, extract_directives
+from app.utils.kafka_events import AI_TURN, DIRECTIVE_AUDIT, build_event, now_ms
+from app.utils.media_relay import (
+    RelayQueue, latency_summary, record_call,
+    OPENAI_QUEUE_FRAMES, OPENAI_QUEUE_POLICY, OPENAI_QUEUE_MAX_MS,
+    TWILIO_QUEUE_FRAMES, TWILIO_QUEUE_POLICY, TWILIO_QUEUE_MAX_MS
+)
+from app.utils.metrics import REGISTRY, Gauge, Histogram, counters, gauge
 
 # Initialize FastAPI app
 voice_router = APIRouter()
@@ -43,14 +56,32 @@ SYSTEM_MESSAGE = """
 VOICE = "alloy"
 PORT = int(os.getenv("PORT", 5050))
 TEMPERATURE = float(os.getenv('TEMPERATURE', 0.8))
-LOG_EVENT_TYPES = [
+LOG_EVENT_TYPES = frozenset([
     'error', 'response.content.done', 'rate_limits.updated',
     'response.done', 'input_audio_buffer.committed',
     'input_audio_buffer.speech_stopped', 'input_audio_buffer.speech_started',
     'session.created', 'session.updated'
-]
+])
 SHOW_TIMING_MATH = False
 BLOCK_NUMBERS = {"+14066521329", "+12106809570"}
+# Point at a local stand-in (tests/voice/fake_realtime_server.py) for load tests
+OPENAI_REALTIME_URL = os.getenv("OPENAI_REALTIME_URL", "wss://api.openai.com/v1/realtime?model=gpt-realtime&temperature={TEMPERATURE}")
+# Twilio sends `connected` and `start` right after the stream opens; don't wait longer than this
+TWILIO_START_TIMEOUT = float(os.getenv("VOICE_TWILIO_START_TIMEOUT", 5))
+
+ACTIVE_MEDIA_STREAMS = Gauge("voice_active_media_streams", "Open /voice/media-stream sessions")
+OPENAI_CONNECT_SECONDS = Histogram(
+    "voice_openai_connect_seconds", "Time to obtain a Realtime session for a call", ("prewarmed",)
+)
+# greeting: stream accepted -> first assistant audio
+# speech_to_audio: caller stops speaking (speech_stopped) -> first assistant audio
+# created_to_audio: response.created -> first audio delta; response: response.created -> response.done
+OPENAI_EVENT_SECONDS = Histogram(
+    "voice_openai_event_latency_seconds", "Latency between OpenAI Realtime events", ("stage",)
+)
+TWILIO_PLAYBACK_SECONDS = Histogram(
+    "voice_twilio_playback_seconds", "From queuing assistant audio to Twilio acknowledging its mark"
+)
 
 
 # Twilio voice route (main entry)
@@ -63,7 +94,10 @@ async def voice(request: Request):
     We'll return TwiML to instruct Twilio to stream media to our /media-stream WS endpoint.
     """
     host = request.url.hostname
-    caller_number = request.headers.get('From')
+    # Twilio posts call details as form fields
+    form = await request.form()
+    caller_number = form.get('From') or request.headers.get('From')
+    call_sid = form.get('CallSid')
     
     vr = VoiceResponse()
 
@@ -71,6 +105,9 @@ async def voice(request: Request):
         
         return HTMLResponse(content=str(VoiceResponse().say("Sorry, you are not allowed to call this number.", voice="Google.en-US-Chirp3-HD-Aoede")), media_type="application/xml")
 
+    # Look the caller up while the greeting plays; media_stream picks the result up by CallSid
+    prefetch_caller(call_sid, caller_number)
+
     vr.say("Welcome to the dental office. Please wait while we connect you to our AI assistant.", voice="Google.en-US-Chirp3-HD-Aoede")
     vr.pause(length=1)
     vr.say(   
@@ -79,7 +116,10 @@ async def voice(request: Request):
     )
     connect = Connect()
 
-    connect.stream(url=f"wss://{host}/voice/media-stream")
+    stream = connect.stream(url=f"wss://{host}/voice/media-stream")
+    if caller_number:
+        # Lets media_stream look the caller up itself if it lands on another replica
+        stream.parameter(name="caller", value=caller_number)
     vr.append(connect)
 
     return HTMLResponse(content=str(vr), media_type="application/xml")
@@ -93,75 +133,193 @@ async def media_stream(websocket: WebSocket):
     """
     await websocket.accept()
     print("🎧 Twilio client connected")
+    record_call()
+    accepted_at = time.monotonic()
+    ACTIVE_MEDIA_STREAMS.inc()
 
-    openai_ws_url = "wss://api.openai.com/v1/realtime?model=gpt-realtime&temperature={TEMPERATURE}"
-    headers = [("Authorization", f"Bearer {OPENAI_API_KEY}")]
     session_id = None
     pending_audio = []
 
-    try:
-        async with websockets.connect(openai_ws_url, additional_headers=headers) as openai_ws:
-            print("🔗 Connected to OpenAI Realtime API")
+    async def open_openai_session():
+        # A pre-warmed session already has the system prompt applied
+        started = time.monotonic()
+        openai_ws = await realtime_pool.acquire()
+        if openai_ws is not None:
+            OPENAI_CONNECT_SECONDS.labels(prewarmed="true").observe(time.monotonic() - started)
+            return openai_ws, True
+        openai_ws = await connect_realtime()
+        OPENAI_CONNECT_SECONDS.labels(prewarmed="false").observe(time.monotonic() - started)
+        return openai_ws, False
+
+    async def read_start():
+        async for message in websocket.iter_text():
+            data = loads(message)
+            if data.get('event') == 'start':
+                return data['start']
+        return None
+
+    async def wait_for_start():
+        """Read Twilio events up to `start`, which carries the CallSid and custom parameters."""
+        try:
+            return await asyncio.wait_for(read_start(), TWILIO_START_TIMEOUT)
+        except (asyncio.TimeoutError, WebSocketDisconnect):
+            return None
+
+    async def discard_session(task):
+        """Cancel the connect task and close the socket if it already opened one."""
+        task.cancel()
+        try:
+            openai_ws, _ = await task
+        except (asyncio.CancelledError, Exception):
+            return  # nothing was opened
+        await openai_ws.close()
 
-            await initialize_session(openai_ws)
+    try:
+        # Connect to OpenAI while Twilio announces the stream
+        start_task = asyncio.create_task(wait_for_start())
+        openai_task = asyncio.create_task(open_openai_session())
+        try:
+            start, (openai_ws, session_configured) = await asyncio.gather(start_task, openai_task)
+        except BaseException:
+            # The socket is not under `async with` yet, so close it here
+            start_task.cancel()
+            await discard_session(openai_task)
+            raise
+        print(f"🔗 Connected to OpenAI Realtime API (pre-warmed: {session_configured})")
+
+        async with openai_ws:
+            start = start or {}
+            call_sid = start.get('callSid')
+            caller_phone = (start.get('customParameters') or {}).get('caller')
+            # Usually already resolved: the lookup started when the webhook was hit
+            caller = await claim_caller(call_sid, caller_phone)
+            await initialize_session(openai_ws, session_configured=session_configured, caller=caller)
 
             # Connection specific state
-            stream_sid = None
+            stream_sid = start.get('streamSid')
+            if stream_sid:
+                print(f"Incoming stream has started {stream_sid}")
+            frames = TwilioFrames(stream_sid)
             latest_media_timestamp = 0
             last_assistant_item = None
-            mark_queue = []
+            mark_queue = []  # send times of marks Twilio has not played back yet
+            call_tasks = set()  # background work of this call, cancelled when it ends
+            playback_latencies = deque(maxlen=512)
             response_start_timestamp_twilio = None
 
+            # Set once either side is gone: the caller hung up, Twilio sent `stop`,
+            # the OpenAI session ended or a relay write failed
+            call_ended = asyncio.Event()
+
+            def end_call(reason):
+                if not call_ended.is_set():
+                    print(f"🛑 Ending media stream {stream_sid}: {reason}")
+                    call_ended.set()
+
+            # One bounded queue + writer task per socket, so a slow peer only backs up its own side
+            openai_out = RelayQueue(
+                "openai", openai_ws.send, input_audio_append,
+                OPENAI_QUEUE_FRAMES, OPENAI_QUEUE_POLICY, OPENAI_QUEUE_MAX_MS,
+                on_error=lambda e: end_call(f"write to OpenAI failed: {e}")
+            ).start()
+            twilio_out = RelayQueue(
+                "twilio", websocket.send_text, lambda payload: frames.media(payload),
+                TWILIO_QUEUE_FRAMES, TWILIO_QUEUE_POLICY, TWILIO_QUEUE_MAX_MS,
+                on_error=lambda e: end_call(f"write to Twilio failed: {e}")
+            ).start()
+
             # Handle OpenAI responses
             async def receive_from_twilio():
                 """Receive audio data from Twilio and send it to the OpenAI Realtime API."""
-                nonlocal stream_sid, latest_media_timestamp
-                try:
-                    async for message in websocket.iter_text():
-                        data = json.loads(message)
-                        if data['event'] == 'media' and openai_ws.state.name == 'OPEN':
-                            latest_media_timestamp = int(data['media']['timestamp'])
-                            audio_append = {
-                                "type": "input_audio_buffer.append",
-                                "audio": data['media']['payload']
-                            }
-                            await openai_ws.send(json.dumps(audio_append))
-                        elif data['event'] == 'start':
-                            stream_sid = data['start']['streamSid']
-                            print(f"Incoming stream has started {stream_sid}")
-                            response_start_timestamp_twilio = None
-                            latest_media_timestamp = 0
-                            last_assistant_item = None
-                        elif data['event'] == 'mark':
-                            if mark_queue:
-                                mark_queue.pop(0)
-                except WebSocketDisconnect:
-                    print("Client disconnected.")
-                    if openai_ws.state.name == 'OPEN':
-                        await openai_ws.close()
+                nonlocal stream_sid, frames, latest_media_timestamp
+                async for message in websocket.iter_text():
+                    data = loads(message)
+                    event = data['event']
+                    if event == 'media' and openai_ws.state.name == 'OPEN':
+                        media = data['media']
+                        latest_media_timestamp = int(media['timestamp'])
+                        # The base64 payload is forwarded untouched
+                        openai_out.put_audio(media['payload'])
+                    elif event == 'start':
+                        stream_sid = data['start']['streamSid']
+                        frames = TwilioFrames(stream_sid)
+                        print(f"Incoming stream has started {stream_sid}")
+                        response_start_timestamp_twilio = None
+                        latest_media_timestamp = 0
+                        last_assistant_item = None
+                    elif event == 'mark':
+                        if mark_queue:
+                            # Time from queuing assistant audio to Twilio playing it
+                            playback = time.monotonic() - mark_queue.pop(0)
+                            playback_latencies.append(playback)
+                            TWILIO_PLAYBACK_SECONDS.observe(playback)
+                    elif event == 'stop':
+                        end_call("Twilio stopped the stream")
+                        return
+                # iter_text() swallows WebSocketDisconnect and just stops
+                print("Client disconnected.")
+                end_call("caller disconnected")
 
             async def send_to_twilio():
                 """Receive events from the OpenAI Realtime API, send audio back to Twilio."""
                 nonlocal stream_sid, last_assistant_item, response_start_timestamp_twilio
+                turn_started_at = None
+                directive_parser = DirectiveStreamParser()
+                inline_turn = InlineDirectives(call_sid)
+                # monotonic marks for the event latency histograms
+                greeted = False
+                speech_stopped_at = None
+                response_created_at = None
+                awaiting_first_audio = False
                 try:
                     async for openai_message in openai_ws:
-                        response = json.loads(openai_message)
-                        if response['type'] in LOG_EVENT_TYPES:
-                            print(f"Received event: {response['type']}", response)
+                        received_at = time.monotonic()
+                        response = loads(openai_message)
+                        response_type = response.get('type')
+                        if response_type in LOG_EVENT_TYPES:
+                            print(f"Received event: {response_type}", response)
+
+                        if response_type == 'input_audio_buffer.speech_stopped':
+                            speech_stopped_at = received_at
+
+                        if response_type == 'response.created':
+                            turn_started_at = now_ms()
+                            response_created_at = received_at
+                            awaiting_first_audio = True
+                            directive_parser = DirectiveStreamParser()
+                            inline_turn = InlineDirectives(call_sid)
+
+                        # Directives are parsed as the transcript streams in, so an
+                        # inline booking starts while the assistant is still talking
+                        if response_type == 'response.output_audio_transcript.delta':
+                            for name, data in directive_parser.feed(response.get('delta', '')):
+                                print(f"✅ {name} detected in AI response!")
+                                if INLINE_DIRECTIVES:
+                                    inline_turn.submit({name: data})
 
                         # 🔹 Handle RAG text responses
-                        await process_ai_text_response(openai_ws, response)
+                        if response_type == 'response.done':
+                            if response_created_at is not None:
+                                OPENAI_EVENT_SECONDS.labels(stage="response").observe(received_at - response_created_at)
+                                response_created_at = None
+                            await process_ai_text_response(
+                                openai_ws, response, call_id=call_sid, started_at=turn_started_at,
+                                parser=directive_parser, inline_turn=inline_turn, call_tasks=call_tasks
+                            )
 
-                        if response.get('type') == 'response.output_audio.delta' and 'delta' in response:
-                            audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
-                            audio_delta = {
-                                "event": "media",
-                                "streamSid": stream_sid,
-                                "media": {
-                                    "payload": audio_payload
-                                }
-                            }
-                            await websocket.send_json(audio_delta)
+                        if response_type == 'response.output_audio.delta' and 'delta' in response:
+                            # OpenAI already sends base64 audio; relay it without decoding
+                            twilio_out.put_audio(response['delta'], received_at)
+
+                            if not greeted:
+                                greeted = True
+                                OPENAI_EVENT_SECONDS.labels(stage="greeting").observe(received_at - accepted_at)
+                            if awaiting_first_audio:
+                                awaiting_first_audio = False
+                                OPENAI_EVENT_SECONDS.labels(stage="created_to_audio").observe(received_at - response_created_at)
+                            if speech_stopped_at is not None:
+                                OPENAI_EVENT_SECONDS.labels(stage="speech_to_audio").observe(received_at - speech_stopped_at)
+                                speech_stopped_at = None
 
 
                             if response.get("item_id") and response["item_id"] != last_assistant_item:
@@ -170,10 +328,10 @@ async def media_stream(websocket: WebSocket):
                                 if SHOW_TIMING_MATH:
                                     print(f"Setting start timestamp for new response: {response_start_timestamp_twilio}ms")
 
-                            await send_mark(websocket, stream_sid)
+                            send_mark(stream_sid)
 
                         # Trigger an interruption. Your use case might work better using `input_audio_buffer.speech_stopped`, or combining the two.
-                        if response.get('type') == 'input_audio_buffer.speech_started':
+                        if response_type == 'input_audio_buffer.speech_started':
                             print("Speech started detected.")
                             if last_assistant_item:
                                 print(f"Interrupting response with id: {last_assistant_item}")
@@ -200,39 +358,61 @@ async def media_stream(websocket: WebSocket):
                             "content_index": 0,
                             "audio_end_ms": elapsed_time
                         }
-                        await openai_ws.send(json.dumps(truncate_event))
+                        openai_out.put_control(json.dumps(truncate_event))
 
-                    await websocket.send_json({
-                        "event": "clear",
-                        "streamSid": stream_sid
-                    })
+                    # Assistant audio still queued here would play after the clear
+                    twilio_out.discard_audio()
+                    twilio_out.put_control(frames.clear)
 
                     mark_queue.clear()
                     last_assistant_item = None
                     response_start_timestamp_twilio = None
             
-            async def send_mark(connection, stream_sid):
+            def send_mark(stream_sid):
                 if stream_sid:
-                    mark_event = {
-                        "event": "mark",
-                        "streamSid": stream_sid,
-                        "mark": {"name": "responsePart"}
-                    }
-                    await connection.send_json(mark_event)
-                    mark_queue.append('responsePart')
-            # Run both loops concurrently
-            await asyncio.gather(receive_from_twilio(), send_to_twilio())
+                    twilio_out.put_control(frames.mark)
+                    mark_queue.append(time.monotonic())
+            def relay_finished(task):
+                # Either loop ending for any reason ends the call
+                error = None if task.cancelled() else task.exception()
+                end_call(f"{task.get_name()} failed: {error}" if error else f"{task.get_name()} finished")
+
+            # Run both loops concurrently until either side is gone
+            relay_tasks = [
+                asyncio.create_task(receive_from_twilio(), name="receive_from_twilio"),
+                asyncio.create_task(send_to_twilio(), name="send_to_twilio"),
+            ]
+            for task in relay_tasks:
+                task.add_done_callback(relay_finished)
+            try:
+                await call_ended.wait()
+            finally:
+                for task in relay_tasks + list(call_tasks):
+                    task.cancel()
+                await asyncio.gather(*relay_tasks, *call_tasks, return_exceptions=True)
+                await openai_out.close()
+                await twilio_out.close()
+                print(f"📊 Relay stats for {stream_sid}: to_openai={openai_out.stats()} "
+                      f"to_twilio={twilio_out.stats()} playback={latency_summary(playback_latencies)}")
 
     except websockets.ConnectionClosedError as e:
         print("❌ OpenAI WebSocket closed:", e)
     finally:
-        await websocket.close()
+        ACTIVE_MEDIA_STREAMS.dec()
+        # Nothing to close if the caller already hung up
+        if websocket.client_state != WebSocketState.DISCONNECTED:
+            await websocket.close()
         print("🛑 Twilio client disconnected")
 
 
-async def initialize_session(openai_ws):
-    """Control initial session with OpenAI."""
-    session_update = {
+async def connect_realtime():
+    """Open a WebSocket to the OpenAI Realtime API."""
+    headers = [("Authorization", f"Bearer {OPENAI_API_KEY}")]
+    return await websockets.connect(OPENAI_REALTIME_URL, additional_headers=headers)
+
+def build_session_update():
+    """The static part of the session: audio formats, voice and SYSTEM_MESSAGE."""
+    return {
         "type": "session.update",
         "session": {
             "type": "realtime",
@@ -251,14 +431,48 @@ async def initialize_session(openai_ws):
             "instructions": SYSTEM_MESSAGE,
         }
     }
-    print('Sending session update:', json.dumps(session_update))
-    await openai_ws.send(json.dumps(session_update))
+
+async def open_warm_session():
+    """Connect and apply the static session config, waiting for OpenAI to acknowledge it."""
+    openai_ws = await connect_realtime()
+    try:
+        await openai_ws.send(json.dumps(build_session_update()))
+        async for message in openai_ws:
+            event = loads(message)
+            if event.get('type') == 'session.updated':
+                return openai_ws
+            if event.get('type') == 'error':
+                raise RuntimeError(event.get('error'))
+        raise RuntimeError("connection closed before session.updated")
+    except BaseException:
+        await openai_ws.close()
+        raise
+
+# Pre-warmed sessions, started and closed with the application (see app/__init__.py)
+realtime_pool = RealtimeSessionPool(open_warm_session)
+
+def _realtime_pool_collector():
+    snapshot = realtime_pool.metrics()
+    return [
+        counters("voice_realtime_pool_events_total", "Pre-warmed Realtime session pool events", snapshot,
+                 ("hits", "misses", "warmed", "expired", "failed")),
+        gauge("voice_realtime_pool_ready", "Pre-warmed Realtime sessions ready", snapshot["ready"]),
+    ]
+
+REGISTRY.register_collector(_realtime_pool_collector)
+
+async def initialize_session(openai_ws, session_configured=False, caller=None):
+    """Control initial session with OpenAI."""
+    if not session_configured:
+        session_update = build_session_update()
+        print('Sending session update:', json.dumps(session_update))
+        await openai_ws.send(json.dumps(session_update))
 
     # Inject dynamic RAG context (availability from DB)
     await inject_availability_context(openai_ws)
     
-    # Inject patient lookup context (will be called again with actual caller info when available)
-    await inject_patient_context(openai_ws)
+    # Inject patient lookup context (caller-ID lookup prefetched at /incoming-call)
+    await inject_patient_context(openai_ws, caller=caller)
 
     # Uncomment the next line to have the AI speak first
     await send_initial_conversation_item(openai_ws)
@@ -281,9 +495,13 @@ async def send_initial_conversation_item(openai_ws):
     await openai_ws.send(json.dumps(initial_conversation_item))
     await openai_ws.send(json.dumps({"type": "response.create"}))
 
-async def process_ai_text_response(openai_ws, response, call_id=None):
+async def process_ai_text_response(openai_ws, response, call_id=None, started_at=None, parser=None, inline_turn=None,
+                                   call_tasks=None):
     """
-    Handle AI text responses: send entire response to Kafka for processing.
+    Handle AI text responses: send the transcript and its directives to Kafka
+    as a compact AI_TURN event (or execute them inline, see VOICE_INLINE_DIRECTIVES).
+    `parser` holds the directives already parsed from the streamed transcript.
+    `call_tasks` keeps the call's background tasks so they can be cancelled with it.
     """
     try:
         if response.get("type") == "response.done":
@@ -300,38 +518,37 @@ async def process_ai_text_response(openai_ws, response, call_id=None):
 
             text_chunk = "".join(text_chunk)
             print("text_chunk ", text_chunk)
+
+            directives = parser.finish() if parser is not None else extract_directives(text_chunk)
             
-            # Debug: Check if PATIENT_CREATION is in the response
-            if "PATIENT_CREATION:" in text_chunk:
-                print("✅ PATIENT_CREATION detected in AI response!")
-            else:
-                print("❌ PATIENT_CREATION NOT found in AI response")
+            if "PATIENT_CREATION" not in directives:
                 # Send reminder if this might be a new patient scenario
                 if any(keyword in text_chunk.lower() for keyword in ["new patient", "create", "collect", "information", "record"]):
                     print("🔄 Sending PATIENT_CREATION reminder to AI...")
                     await send_patient_creation_reminder(openai_ws)
-            
-            # Debug: Check if BOOKING_CONFIRMATION is in the response
-            if "BOOKING_CONFIRMATION:" in text_chunk:
-                print("✅ BOOKING_CONFIRMATION detected in AI response!")
-            else:
-                print("❌ BOOKING_CONFIRMATION NOT found in AI response")
-
-            # Send entire AI response to Kafka for processing
-            success = ai_response_producer.send_ai_response(
-                call_id=call_id or "unknown",
-                response_type="AI_RESPONSE",
-                data={
-                    "raw_text": text_chunk,
-                    "full_response": response,
-                    "timestamp": datetime.now().isoformat()
-                },
-                metadata={
-                    "source": "voice_ai",
-                    "call_id": call_id or "unknown",
-                    "response_type": "complete_ai_response"
-                }
-            )
+
+            if INLINE_DIRECTIVES:
+                inline_turn = inline_turn or InlineDirectives(call_id)
+                # Anything the transcript stream did not already start
+                inline_turn.submit(directives)
+                if inline_turn.tasks:
+                    report = asyncio.create_task(inline_turn.report(openai_ws))
+                    tasks = _report_tasks if call_tasks is None else call_tasks
+                    tasks.add(report)
+                    report.add_done_callback(tasks.discard)
+                    report.add_done_callback(_log_task_error)
+                return
+
+            # Send the turn to Kafka; the consumer executes the directives
+            success = ai_response_producer.send_event(build_event(
+                AI_TURN,
+                call_id,
+                transcript=text_chunk,
+                directives=directives,
+                started_at=started_at,
+                completed_at=now_ms(),
+                metadata={"source": "voice_ai"}
+            ))
             
             if success:
                 print("✅ AI response sent to Kafka for processing")
@@ -343,28 +560,73 @@ async def process_ai_text_response(openai_ws, response, call_id=None):
     except Exception as e:
         print(f"❌ Error processing AI response: {e}")
 
-async def inject_availability_context(openai_ws, limit=5):
-    """
-    Fetch available dentist slots from DB and inject as RAG context into OpenAI session.
-    """
-    try:
-        # 1️⃣ Fetch slots
-        slots = fetch_available_slots(limit=limit)
-        if slots:
-            availability_text = build_context_text(slots)
-        else:
-            availability_text = "Currently no available appointments."
+# Report tasks started without a per-call set; referenced so they are not garbage collected
+_report_tasks = set()
 
-        # 2️⃣ Fetch dentists with specialties
-        dentists = fetch_dentists()
-        if dentists:
-            dentist_info = "\n".join([f"{d['name']} ({d['specialty']})" for d in dentists])
-        else:
-            dentist_info = "No dentists found."
+def _log_task_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        print(f"❌ Error reporting directive results: {task.exception()}")
 
-        context_text = f"Available appointments:\n{availability_text}\n\nDentists in this office:\n{dentist_info}"
+class InlineDirectives:
+    """
+    Directives of one assistant response executed in this process
+    (VOICE_INLINE_DIRECTIVES). Each is audited to Kafka when it finishes; the
+    assistant hears all the results together once the response is done.
+    """
 
-        context_message = {
+    def __init__(self, call_id):
+        self.call_id = call_id or "unknown"
+        self.tasks = []
+        self.results = []
+        self._submitted = {}
+
+    def submit(self, directives):
+        directives = {name: data for name, data in directives.items() if name not in self._submitted}
+        if not directives:
+            return
+        self._submitted.update(directives)
+        task = directive_executor.submit(self.call_id, directives, self._on_result)
+        if task:
+            self.tasks.append(task)
+
+    async def _on_result(self, results):
+        ai_response_producer.send_event(build_event(
+            DIRECTIVE_AUDIT,
+            self.call_id,
+            directives={result["directive"]: self._submitted[result["directive"]] for result in results},
+            results=results,
+            completed_at=now_ms(),
+            metadata={"source": "voice_ai"}
+        ))
+        self.results.extend(results)
+
+    async def report(self, openai_ws):
+        """Wait for the response's directives, then tell the AI how they went."""
+        # wait() rather than gather(): cancelling the report (the call ended)
+        # must not cancel a booking that is already running
+        await asyncio.wait(self.tasks)
+        if self.results and openai_ws.state.name == 'OPEN':
+            await send_directive_results(openai_ws, self.results)
+
+def describe_directive_result(result):
+    if result["directive"] == "PATIENT_CREATION":
+        if result["ok"]:
+            state = "already existed" if result.get("existing") else "was created"
+            return f"Patient record for {result.get('name')} {state}."
+        return f"Patient record for {result.get('name')} could NOT be created: {result.get('error')}."
+    appointment = f"{result.get('patient_name')} with {result.get('dentist')} on {result.get('date')} at {result.get('time')}"
+    if result["ok"]:
+        return f"Appointment for {appointment} is booked."
+    return f"Appointment for {appointment} could NOT be booked: {result.get('error')}."
+
+async def send_directive_results(openai_ws, results):
+    """
+    Tell the AI what actually happened so it can confirm the booking to the
+    caller, or offer another time if it failed.
+    """
+    try:
+        lines = "\n".join(describe_directive_result(result) for result in results)
+        result_message = {
             "type": "conversation.item.create",
             "item": {
                 "type": "message",
@@ -372,37 +634,50 @@ async def inject_availability_context(openai_ws, limit=5):
                 "content": [
                     {
                         "type": "input_text",
-                         "text": (
-                            f"Here are the available appointments:\n{context_text}\n\n"
-                            "When booking an appointment, always ask for the patient's full name "
-                            "if it has not been provided. Use this name when saving the appointment."
+                        "text": (
+                            f"RESULT:\n{lines}\n"
+                            "Tell the caller the outcome. If something failed, apologise and offer "
+                            "another available time. Do not repeat the directive for anything that succeeded."
                         )
                     }
                 ]
             }
         }
+        await openai_ws.send(json.dumps(result_message))
+        await openai_ws.send(json.dumps({"type": "response.create"}))
+        print(f"✅ Sent directive results to AI: {lines}")
+    except Exception as e:
+        print(f"❌ Error sending directive results: {e}")
 
-        await openai_ws.send(json.dumps(context_message))
+async def inject_availability_context(openai_ws, limit=5):
+    """
+    Inject available dentist slots as RAG context into the OpenAI session.
+    The message is prebuilt and cached (see app/utils/voice_context.py).
+    """
+    try:
+        await openai_ws.send(await get_availability_context(limit))
         print("✅ Injected RAG context (availability) into conversation.")
     except Exception as e:
         print(f"❌ Failed to inject RAG context: {e}")
 
-async def inject_patient_context(openai_ws, caller_name=None, caller_phone=None):
+async def inject_patient_context(openai_ws, caller_name=None, caller_phone=None, caller=None):
     """
     Inject patient lookup context to help AI determine if caller is new or existing patient.
+    `caller` is a prefetched lookup_caller() result; when given, no queries are made.
     """
     try:
         patient_context = ""
-        existing_patients = []
+        existing_patients = list(caller["patients"]) if caller else []
+        recent_appointments = caller["appointments"] if caller else []
         
         # If we have a name, search for existing patients
         if caller_name:
-            patients_by_name = find_patient_by_name(caller_name)
+            patients_by_name = await run_db(find_patient_by_name, caller_name)
             existing_patients.extend(patients_by_name)
         
         # If we have a phone, search for existing patients
         if caller_phone:
-            patient_by_phone = find_patient_by_phone(caller_phone)
+            patient_by_phone = await run_db(find_patient_by_phone, caller_phone)
             if patient_by_phone and patient_by_phone not in existing_patients:
                 existing_patients.append(patient_by_phone)
         
@@ -412,6 +687,12 @@ async def inject_patient_context(openai_ws, caller_name=None, caller_phone=None)
                 for p in existing_patients
             ])
             patient_context = f"EXISTING PATIENTS FOUND:\n{patient_info}\n\n"
+            if recent_appointments:
+                appointment_info = "\n".join([
+                    f"{a['appointment_date']} at {a['appointment_time']} with {a['dentist_name']}: {a['treatment']} ({a['status']})"
+                    for a in recent_appointments
+                ])
+                patient_context += f"RECENT APPOINTMENTS:\n{appointment_info}\n\n"
         else:
             patient_context = "NO EXISTING PATIENTS FOUND - This appears to be a new patient.\n\n"
         
@@ -478,7 +759,7 @@ async def create_patient_from_ai_response(openai_ws, patient_data):
             raise ValueError("Missing required patient information")
         
         # Create the patient record
-        patient_id = create_new_patient(name, email, phone, date_of_birth)
+        patient_id = await run_db(create_new_patient, name, email, phone, date_of_birth)
         
         if patient_id:
             # Send confirmation to AI
@@ -0,0 +1,115 @@
+from fastapi import Depends, HTTPException, status
+from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from typing import Optional
+import jwt
+from jwt import PyJWTError
+import os
+from psycopg2.extras import RealDictCursor
+from app.utils.cache import TTLCache
+from app.utils.db import conn, run_db
+
+# Security setup
+security = HTTPBearer()
+
+# JWT settings
+SECRET_KEY = os.getenv("JWT_SECRET_KEY", "your-secret-key-change-this-in-production")
+ALGORITHM = "HS256"
+
+# Authenticated principals are cached per process for this many seconds.
+# Writes through user.py invalidate immediately in this process; other
+# replicas pick up role/deactivation changes once their entry expires.
+USER_CACHE_TTL = float(os.getenv("AUTH_USER_CACHE_TTL", 30))
+USER_CACHE_MAX_SIZE = int(os.getenv("AUTH_USER_CACHE_MAX_SIZE", 1024))
+
+_user_cache = TTLCache(ttl=USER_CACHE_TTL, max_size=USER_CACHE_MAX_SIZE)  # username -> user without password_hash
+
+def _load_principal(username: str) -> Optional[dict]:
+    """Fetch a user row for authentication, without the password hash"""
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("SELECT * FROM users WHERE username = %s", (username,))
+        user = cur.fetchone()
+    if user is None:
+        return None
+    return {k: v for k, v in user.items() if k != 'password_hash'}
+
+def _get_cached_principal(username: str) -> Optional[dict]:
+    user = _user_cache.get(username)
+    # A copy, so request handlers cannot change the cached entry
+    return dict(user) if user is not None else None
+
+def _cache_principal(username: str, user: dict):
+    _user_cache.set(username, dict(user))
+
+def invalidate_cached_user(username: Optional[str] = None, user_id: Optional[int] = None):
+    """Drop cached principals by username and/or user id (call after any user write)"""
+    if username is not None:
+        _user_cache.invalidate(username)
+    if user_id is not None:
+        _user_cache.invalidate_values(lambda user: user.get('id') == user_id)
+
+def clear_user_cache():
+    """Drop every cached principal"""
+    _user_cache.clear()
+
+# Authentication functions
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+    """Get current authenticated user (cached for AUTH_USER_CACHE_TTL seconds)"""
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+
+    try:
+        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
+        username: str = payload.get("sub")
+        if username is None:
+            raise credentials_exception
+    except PyJWTError:
+        raise credentials_exception
+
+    user = _get_cached_principal(username)
+    if user is None:
+        user = await run_db(_load_principal, username)
+        if user is None:
+            raise credentials_exception
+        _cache_principal(username, user)
+
+    if not user.get('is_active', False):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Inactive user"
+        )
+
+    return user
+
+def require_admin(current_user: dict = Depends(get_current_user)) -> dict:
+    """Require admin role"""
+    if current_user.get('role') != 'admin':
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+def require_admin_or_receptionist(current_user: dict = Depends(get_current_user)) -> dict:
+    """Require admin or receptionist role"""
+    if current_user.get('role') not in ['admin', 'receptionist']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+def require_admin_or_dentist(current_user: dict = Depends(get_current_user)) -> dict:
+    """Require admin or dentist role"""
+    if current_user.get('role') not in ['admin', 'dentist']:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Not enough permissions"
+        )
+    return current_user
+
+def require_authenticated_user(current_user: dict = Depends(get_current_user)) -> dict:
+    """Require any authenticated user"""
+    return current_user
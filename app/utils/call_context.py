@@ -0,0 +1,79 @@
+import asyncio
+import os
+import time
+from app.utils.db import lookup_caller, run_db
+from app.utils.metrics import REGISTRY, counters, gauge
+
+# Per-call context collected before the media stream connects. /voice/incoming-call
+# starts the caller-ID lookup and stores the task under the Twilio CallSid;
+# /voice/media-stream claims it from the stream's `start` event. Entries nobody
+# claims (call hung up before streaming) expire after VOICE_CALL_CONTEXT_TTL.
+CALL_CONTEXT_TTL = float(os.getenv("VOICE_CALL_CONTEXT_TTL", 120))
+# How long media_stream waits for an unfinished lookup before going on without it
+PATIENT_PREFETCH_TIMEOUT = float(os.getenv("VOICE_PATIENT_PREFETCH_TIMEOUT", 2))
+
+_prefetched = {}  # call_sid -> (expires_at, task)
+_metrics = {"prefetched": 0, "claimed": 0, "missed": 0, "expired": 0, "timed_out": 0}
+
+def _prune():
+    now = time.monotonic()
+    for call_sid in [key for key, (expires_at, _) in _prefetched.items() if expires_at < now]:
+        _, task = _prefetched.pop(call_sid)
+        task.cancel()
+        _metrics["expired"] += 1
+
+def _consume_exception(task):
+    # Keep failed lookups nobody claimed from being reported as "never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+def prefetch_caller(call_sid, caller_phone):
+    """Start looking up the caller in the background (call from the incoming-call webhook)"""
+    if not call_sid or not caller_phone:
+        return
+    _prune()
+    task = asyncio.create_task(run_db(lookup_caller, caller_phone))
+    task.add_done_callback(_consume_exception)
+    _prefetched[call_sid] = (time.monotonic() + CALL_CONTEXT_TTL, task)
+    _metrics["prefetched"] += 1
+
+async def claim_caller(call_sid, caller_phone=None, timeout=PATIENT_PREFETCH_TIMEOUT):
+    """
+    Return the prefetched lookup for this call. If there is none (e.g. the webhook
+    was served by another replica) and the caller's number is known, look it up now.
+    Returns None if nothing is available within `timeout`.
+    """
+    entry = _prefetched.pop(call_sid, None) if call_sid else None
+    if entry is not None:
+        _metrics["claimed"] += 1
+        lookup = entry[1]
+    elif caller_phone:
+        _metrics["missed"] += 1
+        lookup = asyncio.ensure_future(run_db(lookup_caller, caller_phone))
+    else:
+        return None
+    try:
+        return await asyncio.wait_for(lookup, timeout)
+    except asyncio.TimeoutError:
+        _metrics["timed_out"] += 1
+        print(f"⚠️ Caller lookup for {call_sid} took longer than {timeout}s")
+    except Exception as e:
+        print(f"❌ Caller lookup for {call_sid} failed: {e}")
+    return None
+
+def call_context_metrics():
+    """prefetched/claimed/missed/expired/timed_out counters and pending lookups"""
+    _prune()
+    snapshot = dict(_metrics)
+    snapshot["pending"] = len(_prefetched)
+    return snapshot
+
+def _call_context_collector():
+    snapshot = call_context_metrics()
+    return [
+        counters("voice_caller_prefetch_total", "Caller-ID prefetch outcomes", snapshot,
+                 ("prefetched", "claimed", "missed", "expired", "timed_out")),
+        gauge("voice_caller_prefetch_pending", "Prefetched caller lookups not claimed yet", snapshot["pending"]),
+    ]
+
+REGISTRY.register_collector(_call_context_collector)
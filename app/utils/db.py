@@ -1,54 +1,401 @@
 import psycopg2
+from psycopg2 import extensions, pool as pg_pool
 from psycopg2.extras import RealDictCursor
 import os
+import time
+import asyncio
+import functools
+import threading
+import logging
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from fastapi.concurrency import run_in_threadpool
 from dotenv import load_dotenv
+from app.utils.query_stats import InstrumentedConnection
+from app.utils.metrics import REGISTRY, Counter, Histogram, gauge
 
 load_dotenv()
 
-conn = psycopg2.connect(
-    dbname=os.getenv("POSTGRES_DB"),
-    user=os.getenv("POSTGRES_USER"),
-    password=os.getenv("POSTGRES_PASSWORD"),
-    host=os.getenv("POSTGRES_HOST"),
-    port=os.getenv("POSTGRES_PORT", 28370),
-    sslmode='require'
+logger = logging.getLogger(__name__)
+
+# Pool settings
+POOL_MIN_SIZE = int(os.getenv("POSTGRES_POOL_MIN_SIZE", 1))
+POOL_MAX_SIZE = int(os.getenv("POSTGRES_POOL_MAX_SIZE", 10))
+POOL_TIMEOUT = float(os.getenv("POSTGRES_POOL_TIMEOUT", 10))
+# Idle connections older than this (seconds) are pinged before being handed out
+POOL_PING_INTERVAL = float(os.getenv("POSTGRES_POOL_PING_INTERVAL", 30))
+
+# Connection bound to the current request by get_db_connection()
+_request_connection: ContextVar = ContextVar("request_connection", default=None)
+
+POOL_WAIT_SECONDS = Histogram(
+    "db_pool_wait_seconds", "Time to check a connection out of the pool",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
 )
-conn.autocommit = True
+POOL_TIMEOUTS = Counter("db_pool_timeouts_total", "Checkouts that gave up waiting for a connection")
+
+class PoolTimeout(pg_pool.PoolError):
+    """Raised when no connection becomes available within the pool timeout"""
+
+class ConnectionPool:
+    """Thread-safe psycopg2 connection pool with health checks and reconnect"""
+
+    def __init__(self, minconn, maxconn, timeout=POOL_TIMEOUT, ping_interval=POOL_PING_INTERVAL, **connect_kwargs):
+        if minconn < 0 or maxconn < 1 or minconn > maxconn:
+            raise ValueError("Invalid pool size: require 0 <= min <= max and max >= 1")
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.timeout = timeout
+        self.ping_interval = ping_interval
+        self._connect_kwargs = connect_kwargs
+        self._idle = []  # (connection, last_used) pairs, most recently used last
+        self._in_use = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._closed = False
+
+        for _ in range(minconn):
+            self._idle.append((self._connect(), time.monotonic()))
+
+    def _connect(self):
+        # Cursors of pooled connections report to the current request's query stats
+        connection = psycopg2.connect(connection_factory=InstrumentedConnection, **self._connect_kwargs)
+        connection.autocommit = True
+        return connection
+
+    def _is_healthy(self, connection, last_used) -> bool:
+        """Cheap local checks first, round-trip ping only for long-idle connections"""
+        if connection.closed:
+            return False
+        if connection.get_transaction_status() == extensions.TRANSACTION_STATUS_UNKNOWN:
+            return False
+        if time.monotonic() - last_used < self.ping_interval:
+            return True
+        try:
+            with connection.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            return False
+
+    def getconn(self, timeout=None):
+        """Check out a healthy connection, reconnecting if the idle one is dead"""
+        if self._closed:
+            raise pg_pool.PoolError("connection pool is closed")
+        wait = self.timeout if timeout is None else timeout
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=wait):
+            POOL_TIMEOUTS.inc()
+            raise PoolTimeout(f"no database connection available after {wait}s")
+        POOL_WAIT_SECONDS.observe(time.perf_counter() - started)
+
+        try:
+            while True:
+                with self._lock:
+                    idle = self._idle.pop() if self._idle else None
+                if idle is None:
+                    connection = self._connect()
+                    break
+                connection, last_used = idle
+                if self._is_healthy(connection, last_used):
+                    break
+                logger.warning("Discarding broken database connection from pool")
+                self._discard(connection)
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+        return connection
+
+    def putconn(self, connection, close=False):
+        """Return a connection to the pool, closing it if broken or requested"""
+        try:
+            if not close and not connection.closed:
+                status = connection.get_transaction_status()
+                if status == extensions.TRANSACTION_STATUS_UNKNOWN:
+                    close = True
+                elif status != extensions.TRANSACTION_STATUS_IDLE:
+                    try:
+                        connection.rollback()
+                    except psycopg2.Error:
+                        close = True
+            if close or connection.closed or self._closed:
+                self._discard(connection)
+            else:
+                with self._lock:
+                    self._idle.append((connection, time.monotonic()))
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _discard(self, connection):
+        try:
+            connection.close()
+        except psycopg2.Error:
+            pass
+
+    def stats(self) -> dict:
+        """Current pool occupancy"""
+        with self._lock:
+            return {
+                "min_size": self.minconn,
+                "max_size": self.maxconn,
+                "in_use": self._in_use,
+                "idle": len(self._idle),
+            }
+
+    def closeall(self):
+        """Close all idle connections; checked-out ones are closed on return"""
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for connection, _ in idle:
+            self._discard(connection)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _connection_params() -> dict:
+    return dict(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT", 28370),
+        sslmode='require'
+    )
+
+def open_dedicated_connection():
+    """
+    Open an autocommit connection outside the pool, for long-lived uses that
+    would otherwise pin a pooled connection (e.g. LISTEN). The caller closes it.
+    """
+    connection = psycopg2.connect(**_connection_params())
+    connection.autocommit = True
+    return connection
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide pool, creating it on first use"""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ConnectionPool(POOL_MIN_SIZE, POOL_MAX_SIZE, **_connection_params())
+                logger.info(f"✅ Database pool initialized (min={POOL_MIN_SIZE}, max={POOL_MAX_SIZE})")
+    return _pool
+
+def _pool_metrics():
+    if _pool is None:
+        return []
+    stats = _pool.stats()
+    return [
+        ("db_pool_connections", "gauge", "Pooled database connections by state",
+         [({"state": "in_use"}, stats["in_use"]), ({"state": "idle"}, stats["idle"])]),
+        gauge("db_pool_max_size", "Maximum connections in the pool", stats["max_size"]),
+    ]
+
+REGISTRY.register_collector(_pool_metrics)
+
+def close_pool():
+    """Close the process-wide pool (application shutdown)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.closeall()
+            _pool = None
+
+@contextmanager
+def connection():
+    """
+    Yield a database connection: the one bound to the current request if any,
+    otherwise a connection checked out of the pool for the duration of the block.
+    """
+    bound = _request_connection.get()
+    if bound is not None:
+        yield bound
+        return
+
+    db_pool = get_pool()
+    db_conn = db_pool.getconn()
+    broken = False
+    try:
+        yield db_conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        db_pool.putconn(db_conn, close=broken)
+
+@contextmanager
+def transaction():
+    """
+    Run the block as one database transaction. `conn.cursor()` calls made inside
+    it share the transaction's connection; a nested block joins the outer one.
+    """
+    with connection() as db_conn:
+        if db_conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            yield db_conn
+            return
+
+        token = _request_connection.set(db_conn)
+        try:
+            with db_conn.cursor() as cur:
+                cur.execute("BEGIN")
+            try:
+                yield db_conn
+            except BaseException:
+                if not db_conn.closed:
+                    with db_conn.cursor() as cur:
+                        cur.execute("ROLLBACK")
+                raise
+            with db_conn.cursor() as cur:
+                cur.execute("COMMIT")
+        finally:
+            _request_connection.reset(token)
+
+async def get_db_connection():
+    """
+    FastAPI dependency: check out one pooled connection per request and bind it
+    so every `conn.cursor()` issued while handling the request reuses it.
+    """
+    db_pool = get_pool()
+    db_conn = await run_in_threadpool(db_pool.getconn)
+    _request_connection.set(db_conn)
+    broken = False
+    try:
+        yield db_conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        _request_connection.set(None)
+        db_pool.putconn(db_conn, close=broken)
+
+# Blocking DB helpers run here instead of on the event loop. Sized to the pool so
+# worker threads never queue up waiting for a connection they cannot get.
+_db_executor = ThreadPoolExecutor(max_workers=POOL_MAX_SIZE, thread_name_prefix="db")
+
+async def run_db(func, *args, **kwargs):
+    """
+    Await a blocking database helper without stalling the event loop.
+    The caller's context (including a request-bound connection) is carried over.
+    """
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        _db_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+class _PooledCursor:
+    """Context manager returned by `conn.cursor()`; holds a connection only while open"""
+
+    def __init__(self, args, kwargs):
+        self._args = args
+        self._kwargs = kwargs
+        self._connection_cm = None
+        self._cursor = None
+
+    def __enter__(self):
+        self._connection_cm = connection()
+        db_conn = self._connection_cm.__enter__()
+        try:
+            self._cursor = db_conn.cursor(*self._args, **self._kwargs)
+        except BaseException as exc:
+            self._connection_cm.__exit__(type(exc), exc, exc.__traceback__)
+            raise
+        return self._cursor
+
+    def __exit__(self, exc_type, exc, tb):
+        if not self._cursor.closed:
+            self._cursor.close()
+        return self._connection_cm.__exit__(exc_type, exc, tb)
+
+class _PooledConnection:
+    """
+    Drop-in stand-in for the old module-level connection: `with conn.cursor() as cur`
+    keeps working, but each cursor runs on a pooled (or request-bound) connection.
+    """
+
+    def cursor(self, *args, **kwargs):
+        return _PooledCursor(args, kwargs)
+
+conn = _PooledConnection()
+
+# Rebuilds the `time_slots` array API responses expect from availability_slots rows.
+# Use with the availability table aliased as `a`.
+TIME_SLOTS_JSON_SQL = """
+    COALESCE((
+        SELECT jsonb_agg(jsonb_build_object(
+                   'start', to_char(s.start_time, 'HH24:MI'),
+                   'end', to_char(s.end_time, 'HH24:MI'),
+                   'available', s.available
+               ) ORDER BY s.start_time)
+        FROM availability_slots s
+        WHERE s.availability_id = a.id
+    ), '[]'::jsonb)
+"""
 
 def fetch_available_slots(limit=5):
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
-            WITH time_slots_expanded AS (
-                SELECT d.id AS dentist_id, d.name AS dentist_name,
-                       a.date, 
-                       jsonb_array_elements(a.time_slots) as time_slot
-                FROM availability a
-                JOIN dentists d ON a.dentist_id = d.id
-            )
-            SELECT dentist_id, dentist_name, date, time_slot
-            FROM time_slots_expanded
-            WHERE (time_slot->>'available')::boolean = true
-            ORDER BY date, (time_slot->>'start')
+            SELECT s.dentist_id, d.name AS dentist_name, s.date,
+                   jsonb_build_object(
+                       'start', to_char(s.start_time, 'HH24:MI'),
+                       'end', to_char(s.end_time, 'HH24:MI'),
+                       'available', s.available
+                   ) AS time_slot
+            FROM availability_slots s
+            JOIN dentists d ON s.dentist_id = d.id
+            WHERE s.available
+            ORDER BY s.date, s.start_time
             LIMIT %s
         """, (limit,))
         return cur.fetchall()
 
-def mark_slot_booked(dentist_id, date, time):
-    with conn.cursor() as cur:
+def get_time_slot(dentist_id, date, start_time):
+    """
+    Get a single time slot row for a dentist, date and start time.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
         cur.execute("""
-            UPDATE availability
-            SET time_slots = (
-                SELECT jsonb_agg(
-                    CASE 
-                        WHEN slot->>'start' = %s 
-                        THEN jsonb_set(slot, '{available}', 'false'::jsonb)
-                        ELSE slot 
-                    END
-                )
-                FROM jsonb_array_elements(time_slots) as slot
-            )
-            WHERE dentist_id = %s AND date = %s
-        """, (time, dentist_id, date))
+            SELECT id, availability_id, dentist_id, date, start_time, end_time, available
+            FROM availability_slots
+            WHERE dentist_id = %s AND date = %s AND start_time = %s::time
+        """, (dentist_id, date, str(start_time)))
+        return cur.fetchone()
+
+def set_slot_availability(dentist_id, date, start_time, available, end_time=None):
+    """
+    Atomically flip one time slot. The update only matches while the slot is in
+    the opposite state, so of two concurrent bookings exactly one succeeds.
+    Returns the updated slot row, or None if the slot is missing or already set.
+    """
+    with conn.cursor(cursor_factory=RealDictCursor) as cur:
+        cur.execute("""
+            UPDATE availability_slots
+            SET available = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE dentist_id = %s AND date = %s AND start_time = %s::time
+              AND (%s::time IS NULL OR end_time = %s::time)
+              AND available = %s
+            RETURNING id, availability_id, dentist_id, date, start_time, end_time, available
+        """, (
+            available,
+            dentist_id,
+            date,
+            str(start_time),
+            end_time and str(end_time),
+            end_time and str(end_time),
+            not available
+        ))
+        return cur.fetchone()
+
+def mark_slot_booked(dentist_id, date, time):
+    return set_slot_availability(dentist_id, date, time, available=False) is not None
 
 def insert_appointment(dentist_id, patient_name, date, time, phone=None, treatment="General Checkup"):
     with conn.cursor() as cur:
@@ -78,32 +425,23 @@ def get_availability_by_dentist_and_date(dentist_id, date):
     Get availability for a specific dentist on a specific date.
     """
     with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("""
-            SELECT * FROM availability 
-            WHERE dentist_id = %s AND date = %s
+        cur.execute(f"""
+            SELECT a.id, a.dentist_id, a.date, {TIME_SLOTS_JSON_SQL} AS time_slots,
+                   a.created_at, a.updated_at
+            FROM availability a
+            WHERE a.dentist_id = %s AND a.date = %s
         """, (dentist_id, date))
         return cur.fetchone()
 
 def update_time_slot_availability(dentist_id, date, time_slot_start, available=False):
     """
     Update a specific time slot availability.
+    Booking (available=False) fails if the slot is already taken.
     """
-    with conn.cursor() as cur:
-        cur.execute("""
-            UPDATE availability 
-            SET time_slots = (
-                SELECT jsonb_agg(
-                    CASE 
-                        WHEN slot->>'start' = %s 
-                        THEN jsonb_set(slot, '{available}', %s::jsonb)
-                        ELSE slot 
-                    END
-                )
-                FROM jsonb_array_elements(time_slots) as slot
-            )
-            WHERE dentist_id = %s AND date = %s
-        """, (time_slot_start, str(available).lower(), dentist_id, date))
-        return cur.rowcount > 0
+    if set_slot_availability(dentist_id, date, time_slot_start, available) is not None:
+        return True
+    # Releasing a slot that is already free is not an error
+    return available and get_time_slot(dentist_id, date, time_slot_start) is not None
 
 def find_patient_by_name(name):
     """
@@ -130,6 +468,47 @@ def find_patient_by_phone(phone):
         """, (phone,))
         return cur.fetchone()
 
+# Caller ID comes in E.164 ("+14085551234") while stored numbers are free-form
+# ("(408) 555-1234"); both are compared on their last 10 digits
+# (indexed by sql_files/add_caller_id_indexes.sql)
+CALLER_ID_DIGITS_SQL = "right(regexp_replace({column}, '\\D', '', 'g'), 10)"
+
+def caller_id_digits(phone):
+    """Last 10 digits of a phone number, or None if it has fewer than 7"""
+    digits = "".join(ch for ch in str(phone or "") if ch.isdigit())
+    return digits[-10:] if len(digits) >= 7 else None
+
+def lookup_caller(phone, appointment_limit=3):
+    """
+    Patients whose phone matches a caller ID, plus their most recent appointments.
+    Returns {"phone": ..., "patients": [...], "appointments": [...]}.
+    """
+    digits = caller_id_digits(phone)
+    result = {"phone": phone, "patients": [], "appointments": []}
+    if digits is None:
+        return result
+    with connection() as db_conn:
+        with db_conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(f"""
+                SELECT id, name, email, phone, date_of_birth, status
+                FROM patients
+                WHERE {CALLER_ID_DIGITS_SQL.format(column='phone')} = %s
+                ORDER BY updated_at DESC NULLS LAST, id DESC
+                LIMIT 5
+            """, (digits,))
+            result["patients"] = cur.fetchall()
+            cur.execute(f"""
+                SELECT a.patient, a.appointment_date, to_char(a.appointment_time, 'HH24:MI') AS appointment_time,
+                       a.treatment, a.status, d.name AS dentist_name
+                FROM appointments a
+                JOIN dentists d ON a.dentist_id = d.id
+                WHERE {CALLER_ID_DIGITS_SQL.format(column='a.phone')} = %s
+                ORDER BY a.appointment_date DESC, a.appointment_time DESC
+                LIMIT %s
+            """, (digits, appointment_limit))
+            result["appointments"] = cur.fetchall()
+    return result
+
 def find_patient_by_email(email):
     """
     Find patient by email.
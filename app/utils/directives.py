@@ -0,0 +1,312 @@
+import asyncio
+import json
+import os
+import re
+import logging
+from app.utils.cache import TTLCache
+from app.utils.db import create_new_patient, find_patient_by_phone, run_db, transaction
+from app.utils.booking import book_if_possible
+from app.utils.voice_context import invalidate_availability_context
+from app.utils.metrics import REGISTRY, counters, gauge
+
+logger = logging.getLogger(__name__)
+
+# Hidden directives the assistant writes into its transcript (see SYSTEM_MESSAGE).
+# The voice bridge parses them from transcript deltas as they stream in. They are
+# executed by the Kafka consumer, or, with VOICE_INLINE_DIRECTIVES=true, directly
+# in the API process so the result can be read back to the caller.
+PATIENT_CREATION = "PATIENT_CREATION"
+BOOKING_CONFIRMATION = "BOOKING_CONFIRMATION"
+DIRECTIVE_NAMES = (PATIENT_CREATION, BOOKING_CONFIRMATION)  # execution order
+
+INLINE_DIRECTIVES = os.getenv("VOICE_INLINE_DIRECTIVES", "false").lower() == "true"
+DIRECTIVE_WORKERS = int(os.getenv("VOICE_DIRECTIVE_WORKERS", 4))
+# The assistant often repeats a directive in later turns; don't execute it twice
+DIRECTIVE_DEDUP_TTL = float(os.getenv("VOICE_DIRECTIVE_DEDUP_TTL", 3600))
+
+def extract_json_object(text, pattern):
+    """
+    Extract the JSON object that starts at group 1 of `pattern` in `text`,
+    matching braces so nested objects and braces inside strings are handled.
+    """
+    match = re.search(pattern, text)
+    if not match:
+        return None
+
+    json_text = text[match.start(1):]
+    brace_count = 0
+    in_string = False
+    escape_next = False
+
+    for i, char in enumerate(json_text):
+        if escape_next:
+            escape_next = False
+            continue
+        if char == '\\':
+            escape_next = True
+            continue
+        if char == '"':
+            in_string = not in_string
+            continue
+        if not in_string:
+            if char == '{':
+                brace_count += 1
+            elif char == '}':
+                brace_count -= 1
+                if brace_count == 0:
+                    return json.loads(json_text[:i + 1])
+    return None
+
+_DIRECTIVE_MARKER = re.compile("(" + "|".join(DIRECTIVE_NAMES) + "):")
+_MARKER_TAIL = max(len(name) for name in DIRECTIVE_NAMES)
+
+class DirectiveStreamParser:
+    """
+    Incremental directive parser for a streamed transcript. feed() takes each
+    transcript delta and returns the (name, data) directives it completed, so an
+    action can start as soon as its JSON object closes. Each directive name is
+    emitted at most once per parser; use one parser per assistant response.
+    """
+
+    def __init__(self):
+        self.directives = {}
+        self._pending = ""  # text not consumed yet
+        self._name = None   # directive whose JSON object is being read
+        self._json = None   # characters of that object so far, None until "{"
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, delta):
+        self._pending += delta
+        completed = []
+        while self._pending:
+            if self._name is None:
+                match = _DIRECTIVE_MARKER.search(self._pending)
+                if not match:
+                    # Keep enough text to recognise a marker split across deltas
+                    self._pending = self._pending[-_MARKER_TAIL:]
+                    break
+                self._name = match.group(1)
+                self._pending = self._pending[match.end():]
+            elif self._json is None:
+                stripped = self._pending.lstrip()
+                if not stripped:
+                    self._pending = ""
+                    break
+                if stripped[0] == "{":
+                    self._json = []
+                    self._pending = stripped
+                else:
+                    # A mention of the name, not a directive
+                    self._name = None
+                    self._pending = stripped
+            else:
+                end = self._scan(self._pending)
+                if end is None:
+                    self._json.append(self._pending)
+                    self._pending = ""
+                    break
+                self._json.append(self._pending[:end])
+                self._pending = self._pending[end:]
+                directive = self._complete("".join(self._json))
+                if directive:
+                    completed.append(directive)
+        return completed
+
+    def finish(self):
+        """
+        All directives of the response, once it is done, with the booking phone
+        filled in. Returns copies: the dicts feed() emitted may already be executing.
+        """
+        directives = {name: dict(data) for name, data in self.directives.items()}
+        booking = directives.get(BOOKING_CONFIRMATION)
+        if booking is not None and not booking.get("phone"):
+            booking["phone"] = directives.get(PATIENT_CREATION, {}).get("phone") or "N/A"
+        return directives
+
+    def _scan(self, text):
+        """Track braces through `text`; the index just past the closing brace, or None."""
+        for i, char in enumerate(text):
+            if self._escape:
+                self._escape = False
+            elif char == "\\":
+                self._escape = True
+            elif char == '"':
+                self._in_string = not self._in_string
+            elif not self._in_string:
+                if char == "{":
+                    self._depth += 1
+                elif char == "}":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        return i + 1
+        return None
+
+    def _complete(self, json_text):
+        name = self._name
+        self._name, self._json = None, None
+        self._depth, self._in_string, self._escape = 0, False, False
+        try:
+            data = json.loads(json_text)
+        except ValueError as e:
+            logger.error(f"❌ Invalid {name} JSON: {e}")
+            return None
+        if name in self.directives or not isinstance(data, dict):
+            return None
+        if name == BOOKING_CONFIRMATION and not data.get("phone"):
+            phone = self.directives.get(PATIENT_CREATION, {}).get("phone")
+            if phone:
+                data["phone"] = phone
+        self.directives[name] = data
+        return name, data
+
+def extract_directives(text):
+    """
+    Return {directive_name: data} for every directive in an assistant transcript.
+    A booking takes its phone number from a patient creation in the same text.
+    """
+    parser = DirectiveStreamParser()
+    parser.feed(text)
+    return parser.finish()
+
+def execute_patient_creation(data):
+    """Create the patient unless one with this phone exists. Returns a result dict."""
+    name = (data.get('name') or '').strip()
+    email = (data.get('email') or '').strip()
+    phone = (data.get('phone') or '').strip()
+    date_of_birth = (data.get('date_of_birth') or '').strip()
+
+    result = {"directive": PATIENT_CREATION, "ok": False, "name": name}
+    if not all([name, email, phone, date_of_birth]):
+        result["error"] = "missing required patient information"
+        return result
+
+    existing_patient = find_patient_by_phone(phone)
+    if existing_patient:
+        result.update(ok=True, patient_id=existing_patient['id'], existing=True)
+        return result
+
+    patient_id = create_new_patient(name, email, phone, date_of_birth)
+    if patient_id:
+        result.update(ok=True, patient_id=patient_id, existing=False)
+    else:
+        result["error"] = "patient record was not created"
+    return result
+
+def execute_booking(data):
+    """Claim the slot and insert the appointment in one transaction. Returns a result dict."""
+    result = {
+        "directive": BOOKING_CONFIRMATION,
+        "ok": False,
+        "patient_name": data.get("patient_name"),
+        "dentist": data.get("dentist"),
+        "date": data.get("date"),
+        "time": data.get("time")
+    }
+    if not all([data.get("dentist"), data.get("date"), data.get("time"), data.get("patient_name")]):
+        result["error"] = "missing dentist, date, time or patient name"
+        return result
+
+    with transaction():
+        booked = book_if_possible(data)
+    if booked:
+        result["ok"] = True
+        invalidate_availability_context()
+    else:
+        result["error"] = "the dentist was not found or the time slot is no longer available"
+    return result
+
+_EXECUTORS = {
+    PATIENT_CREATION: execute_patient_creation,
+    BOOKING_CONFIRMATION: execute_booking,
+}
+
+def execute_directives(directives):
+    """Run directives in DIRECTIVE_NAMES order; a failure is reported, not raised."""
+    results = []
+    for name in DIRECTIVE_NAMES:
+        if name not in directives:
+            continue
+        try:
+            results.append(_EXECUTORS[name](directives[name]))
+        except Exception as e:
+            logger.error(f"❌ Error executing {name}: {e}")
+            results.append({"directive": name, "ok": False, "error": "a system error occurred"})
+    return results
+
+class DirectiveExecutor:
+    """
+    Executes directives off the event loop with at most `workers` running at once.
+    Directives of one call run in order; `on_result(results)` is awaited afterwards.
+    """
+
+    def __init__(self, workers=DIRECTIVE_WORKERS):
+        self._slots = asyncio.Semaphore(max(1, workers))
+        self._call_locks = {}  # call_id -> [lock, batches queued or running]
+        self._seen = TTLCache(ttl=DIRECTIVE_DEDUP_TTL, max_size=10000)
+        self._tasks = set()
+        self._metrics = {"submitted": 0, "executed": 0, "failed": 0, "duplicates": 0}
+
+    def submit(self, call_id, directives, on_result):
+        """Schedule the directives not already executed for this call; returns the task or None."""
+        fresh = {}
+        keys = {}  # the dedup key each directive was recorded under, to invalidate on failure
+        for name, data in directives.items():
+            key = self._key(call_id, name, data)
+            if self._seen.get(key):
+                self._metrics["duplicates"] += 1
+                continue
+            self._seen.set(key, True)
+            fresh[name] = dict(data)
+            keys[name] = key
+        if not fresh:
+            return None
+
+        self._metrics["submitted"] += len(fresh)
+        task = asyncio.create_task(self._run(call_id, fresh, keys, on_result))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    @staticmethod
+    def _key(call_id, name, data):
+        return (call_id, name, json.dumps(data, sort_keys=True, default=str))
+
+    async def _run(self, call_id, directives, keys, on_result):
+        entry = self._call_locks.setdefault(call_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0], self._slots:
+                results = await run_db(execute_directives, directives)
+            for result in results:
+                if result["ok"]:
+                    self._metrics["executed"] += 1
+                else:
+                    # Let the assistant retry a directive that failed
+                    self._metrics["failed"] += 1
+                    self._seen.invalidate(keys[result["directive"]])
+            await on_result(results)
+        except Exception as e:
+            logger.error(f"❌ Directive execution for call {call_id} failed: {e}")
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                self._call_locks.pop(call_id, None)
+
+    def metrics(self):
+        snapshot = dict(self._metrics)
+        snapshot["running"] = len(self._tasks)
+        return snapshot
+
+    def collect_metrics(self):
+        """metrics() as Prometheus families (Registry.register_collector)"""
+        snapshot = self.metrics()
+        return [
+            counters("voice_directives_total", "Inline directives by outcome", snapshot,
+                     ("submitted", "executed", "failed", "duplicates"), label="outcome"),
+            gauge("voice_directives_running", "Inline directive batches queued or running", snapshot["running"]),
+        ]
+
+directive_executor = DirectiveExecutor()
+REGISTRY.register_collector(directive_executor.collect_metrics)
@@ -1,21 +1,97 @@
-import json
 import os
 import logging
-import re
-from kafka import KafkaConsumer
+import queue
+import threading
+import time
+import zlib
+import psycopg2
+from kafka import KafkaConsumer, ConsumerRebalanceListener
 from kafka.errors import KafkaError
+from kafka.structs import OffsetAndMetadata
 from datetime import datetime
-from app.utils.db import create_new_patient, find_patient_by_name, find_patient_by_phone
+from app.utils.db import create_new_patient, find_patient_by_name, find_patient_by_phone, PoolTimeout
 from app.utils.booking import book_if_possible
+from app.utils.directives import DIRECTIVE_NAMES, extract_directives, extract_json_object
+from app.utils.kafka_events import AI_TURN, DIRECTIVE_AUDIT, decode_event, is_event
+from app.utils.metrics import Histogram, counters, gauge
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class AIResponseConsumer:
+# Consumer engine settings. Messages are processed by a pool of worker threads;
+# all messages with the same key (call_id) go to the same worker, so each call is
+# handled in order while different calls run in parallel. Offsets are committed
+# manually and never past a message that has not finished processing.
+CONSUMER_WORKERS = int(os.getenv("KAFKA_CONSUMER_WORKERS", 4))
+CONSUMER_MAX_IN_FLIGHT = int(os.getenv("KAFKA_CONSUMER_MAX_IN_FLIGHT", 200))
+CONSUMER_COMMIT_INTERVAL = float(os.getenv("KAFKA_CONSUMER_COMMIT_INTERVAL", 5))
+CONSUMER_METRICS_INTERVAL = float(os.getenv("KAFKA_CONSUMER_METRICS_INTERVAL", 60))
+CONSUMER_REVOKE_TIMEOUT = float(os.getenv("KAFKA_CONSUMER_REVOKE_TIMEOUT", 10))
+CONSUMER_RETRY_BACKOFF_MAX = float(os.getenv("KAFKA_CONSUMER_RETRY_BACKOFF_MAX", 30))
+
+# Errors worth retrying (database unreachable or pool exhausted); anything else is
+# treated as a permanent failure so one bad message cannot block its partition.
+TRANSIENT_ERRORS = (psycopg2.OperationalError, psycopg2.InterfaceError, PoolTimeout)
+
+_STOP = object()
+
+PROCESS_SECONDS = Histogram("kafka_consumer_process_seconds", "Time to process one message, retries included", ("outcome",))
+# Producer timestamp to processed; includes time spent waiting in the topic (lag)
+END_TO_END_SECONDS = Histogram(
+    "kafka_consumer_end_to_end_seconds", "From the message's Kafka timestamp to processed",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+)
+
+def _offset_and_metadata(offset):
+    # kafka-python 2.0 takes (offset, metadata); newer releases add leader_epoch
+    extra = (-1,) * (len(OffsetAndMetadata._fields) - 2)
+    return OffsetAndMetadata(offset, "", *extra)
+
+class _PartitionOffsets:
+    """Offsets dispatched from one partition; the commit point never passes an unfinished one."""
+
     def __init__(self):
+        self.pending = set()
+        self.next_offset = None
+        self.committed = None
+
+    def dispatched(self, offset):
+        self.pending.add(offset)
+        if self.next_offset is None or offset >= self.next_offset:
+            self.next_offset = offset + 1
+
+    def finished(self, offset):
+        self.pending.discard(offset)
+
+    def commit_point(self):
+        return min(self.pending) if self.pending else self.next_offset
+
+class _RebalanceListener(ConsumerRebalanceListener):
+    def __init__(self, engine):
+        self.engine = engine
+
+    def on_partitions_revoked(self, revoked):
+        self.engine._on_partitions_revoked(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        logger.info(f"📥 Assigned partitions: {sorted(tp.partition for tp in assigned)}")
+
+class AIResponseConsumer:
+    def __init__(self, workers=CONSUMER_WORKERS):
         self.consumer = None
         self.topic = os.getenv("KAFKA_TOPIC", "ai-responses")
+        self.worker_count = max(1, workers)
+        self._work_queues = []
+        self._workers = []
+        self._offsets = {}  # TopicPartition -> _PartitionOffsets
+        self._offsets_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._paused = False
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"received": 0, "processed": 0, "failed": 0, "retried": 0, "committed": 0}
+        self._lag = {}
+        self._rate = {"since": time.monotonic(), "processed": 0, "per_second": 0.0}
         self._initialize_consumer()
     
     def _initialize_consumer(self):
@@ -28,11 +104,13 @@ class AIResponseConsumer:
             
             kafka_config = {
                 'bootstrap_servers': os.getenv("KAFKA_BOOTSTRAP_SERVERS"),
-                'value_deserializer': lambda m: json.loads(m.decode('utf-8')),
+                # Values are decoded per message (decode_event) so a bad payload fails only that message
                 'key_deserializer': lambda m: m.decode('utf-8') if m else None,
                 'group_id': os.getenv("KAFKA_GROUP_ID", "ai-response-processor"),
                 'auto_offset_reset': 'latest',
-                'enable_auto_commit': True,
+                # Offsets are committed by the engine once messages are processed
+                'enable_auto_commit': False,
+                'max_poll_records': CONSUMER_MAX_IN_FLIGHT,
                 'api_version': (0, 10, 1)
             }
             
@@ -52,7 +130,8 @@ class AIResponseConsumer:
             # Remove None values
             kafka_config = {k: v for k, v in kafka_config.items() if v is not None}
             
-            self.consumer = KafkaConsumer(self.topic, **kafka_config)
+            self.consumer = KafkaConsumer(**kafka_config)
+            self.consumer.subscribe([self.topic], listener=_RebalanceListener(self))
             logger.info("✅ Kafka consumer initialized successfully")
             
         except Exception as e:
@@ -89,6 +168,8 @@ class AIResponseConsumer:
                 logger.error(f"❌ Failed to create patient: {name}")
                 return False
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"❌ Error processing patient creation: {e}")
             return False
@@ -107,6 +188,8 @@ class AIResponseConsumer:
                 logger.error(f"❌ Booking failed for {data.get('patient_name')}")
                 return False
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"❌ Error processing booking confirmation: {e}")
             return False
@@ -114,50 +197,12 @@ class AIResponseConsumer:
     def extract_json_from_text(self, text, pattern):
         """Extract JSON from text using a more robust method."""
         try:
-            # Find the pattern
-            match = re.search(pattern, text)
-            if not match:
-                return None
-            
-            json_start = match.start(1)
-            json_text = text[json_start:]
-            
-            # Find the end of the JSON object by counting braces
-            brace_count = 0
-            json_end = 0
-            in_string = False
-            escape_next = False
-            
-            for i, char in enumerate(json_text):
-                if escape_next:
-                    escape_next = False
-                    continue
-                    
-                if char == '\\':
-                    escape_next = True
-                    continue
-                    
-                if char == '"' and not escape_next:
-                    in_string = not in_string
-                    continue
-                    
-                if not in_string:
-                    if char == '{':
-                        brace_count += 1
-                    elif char == '}':
-                        brace_count -= 1
-                        if brace_count == 0:
-                            json_end = i + 1
-                            break
-            
-            if json_end > 0:
-                json_str = json_text[:json_end]
-                logger.info(f"🔍 Extracted JSON: {json_str}")
-                return json.loads(json_str)
+            json_data = extract_json_object(text, pattern)
+            if json_data is None:
+                logger.error("❌ Could not find a complete JSON object")
             else:
-                logger.error("❌ Could not find end of JSON object")
-                return None
-                
+                logger.info(f"🔍 Extracted JSON: {json_data}")
+            return json_data
         except Exception as e:
             logger.error(f"❌ Error extracting JSON: {e}")
             return None
@@ -175,51 +220,33 @@ class AIResponseConsumer:
             # Debug: Log the full response for troubleshooting
             logger.info(f"🔍 Full AI Response: {raw_text}")
             
-            # Parse the AI response for different actions
+            # Parse the AI response for different actions (one pass over the text)
             actions_taken = []
+            directives = extract_directives(raw_text)
             
             # Check for patient creation
-            if "PATIENT_CREATION:" in raw_text:
-                logger.info("👤 Found PATIENT_CREATION in AI response")
-                patient_data = self.extract_json_from_text(raw_text, r"PATIENT_CREATION:\s*(\{)")
-                if patient_data:
-                    logger.info(f"📋 Patient data: {patient_data}")
-                    
-                    # Process patient creation
-                    if self.process_patient_creation(patient_data, call_id):
-                        actions_taken.append("PATIENT_CREATION")
-                        logger.info("✅ Patient creation completed")
-                    else:
-                        logger.error("❌ Patient creation failed")
+            patient_data = directives.get("PATIENT_CREATION")
+            if patient_data:
+                logger.info(f"📋 Patient data: {patient_data}")
+                
+                # Process patient creation
+                if self.process_patient_creation(patient_data, call_id):
+                    actions_taken.append("PATIENT_CREATION")
+                    logger.info("✅ Patient creation completed")
                 else:
-                    logger.error("❌ Failed to extract patient data")
+                    logger.error("❌ Patient creation failed")
             
-            # Check for booking confirmation
-            if "BOOKING_CONFIRMATION:" in raw_text:
-                logger.info("📅 Found BOOKING_CONFIRMATION in AI response")
-                booking_data = self.extract_json_from_text(raw_text, r"BOOKING_CONFIRMATION:\s*(\{)")
-                if booking_data:
-                    logger.info(f"📋 Booking data: {booking_data}")
-                    
-                    # Add phone number from patient data if available
-                    if "PATIENT_CREATION:" in raw_text:
-                        patient_data = self.extract_json_from_text(raw_text, r"PATIENT_CREATION:\s*(\{)")
-                        if patient_data and "phone" in patient_data:
-                            booking_data["phone"] = patient_data["phone"]
-                            logger.info(f"📞 Added phone to booking: {booking_data['phone']}")
-                        else:
-                            booking_data["phone"] = "N/A"
-                    else:
-                        booking_data["phone"] = "N/A"
-                    
-                    # Process booking confirmation
-                    if self.process_booking_confirmation(booking_data, call_id):
-                        actions_taken.append("BOOKING_CONFIRMATION")
-                        logger.info("✅ Booking confirmation completed")
-                    else:
-                        logger.error("❌ Booking confirmation failed")
+            # Check for booking confirmation (phone already taken from the patient data)
+            booking_data = directives.get("BOOKING_CONFIRMATION")
+            if booking_data:
+                logger.info(f"📋 Booking data: {booking_data}")
+                
+                # Process booking confirmation
+                if self.process_booking_confirmation(booking_data, call_id):
+                    actions_taken.append("BOOKING_CONFIRMATION")
+                    logger.info("✅ Booking confirmation completed")
                 else:
-                    logger.error("❌ Failed to extract booking data")
+                    logger.error("❌ Booking confirmation failed")
             
             # Log summary
             if actions_taken:
@@ -229,27 +256,70 @@ class AIResponseConsumer:
                 logger.info("ℹ️ No specific actions identified in AI response")
                 return True  # Still successful, just no actions needed
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"❌ Error processing AI response: {e}")
             return False
     
+    def process_ai_turn(self, event, call_id):
+        """Execute the directives the voice API extracted from one assistant turn."""
+        directives = event.get('directives') or {}
+        if not directives:
+            logger.info(f"ℹ️ No directives in AI turn for call {call_id}")
+            return True
+
+        handlers = {
+            "PATIENT_CREATION": self.process_patient_creation,
+            "BOOKING_CONFIRMATION": self.process_booking_confirmation,
+        }
+        success = True
+        for name in DIRECTIVE_NAMES:
+            if name in directives:
+                logger.info(f"📋 {name}: {directives[name]}")
+                success = handlers[name](directives[name], call_id) and success
+        return success
+
+    def process_directive_audit(self, data, call_id):
+        """Record directives the API already executed inline (VOICE_INLINE_DIRECTIVES)."""
+        for result in data.get('results', []):
+            status = "✅" if result.get('ok') else "❌"
+            logger.info(f"{status} Inline {result.get('directive')} for call {call_id}: {result}")
+        return True
+
     def process_message(self, message):
-        """Process a single Kafka message."""
+        """
+        Process a single Kafka message. Returns True/False for the outcome;
+        transient database errors are raised so the engine can retry.
+        """
         try:
-            call_id = message.key
-            response_type = message.value.get('response_type')
-            data = message.value.get('data', {})
-            metadata = message.value.get('metadata', {})
+            value = message.value
+            if isinstance(value, (bytes, bytearray)):
+                value = decode_event(value)
+
+            if is_event(value):
+                # Compact event (app/utils/kafka_events.py)
+                call_id = value.get('call_id') or message.key
+                response_type = value.get('type')
+                data = value
+            else:
+                call_id = message.key
+                response_type = value.get('response_type')
+                data = value.get('data', {})
             
             logger.info(f"📨 Processing message: {response_type} for call {call_id}")
             
             success = False
-            if response_type == "AI_RESPONSE":
+            if response_type == AI_TURN:
+                success = self.process_ai_turn(data, call_id)
+            elif response_type == "AI_RESPONSE":
                 success = self.process_ai_response(data, call_id)
             elif response_type == "PATIENT_CREATION":
                 success = self.process_patient_creation(data, call_id)
             elif response_type == "BOOKING_CONFIRMATION":
                 success = self.process_booking_confirmation(data, call_id)
+            elif response_type == DIRECTIVE_AUDIT:
+                success = self.process_directive_audit(data, call_id)
             else:
                 logger.warning(f"⚠️ Unknown response type: {response_type}")
             
@@ -257,21 +327,217 @@ class AIResponseConsumer:
                 logger.info(f"✅ Successfully processed {response_type} for call {call_id}")
             else:
                 logger.error(f"❌ Failed to process {response_type} for call {call_id}")
+            return success
                 
+        except TRANSIENT_ERRORS:
+            raise
         except Exception as e:
             logger.error(f"❌ Error processing message: {e}")
+            return False
     
+    # Consumer engine
+
+    def _count(self, metric, amount=1):
+        with self._metrics_lock:
+            self._metrics[metric] += amount
+
+    def _start_workers(self):
+        for index in range(self.worker_count):
+            work_queue = queue.Queue()
+            worker = threading.Thread(
+                target=self._worker_loop,
+                args=(work_queue,),
+                name=f"kafka-worker-{index}",
+                daemon=True
+            )
+            self._work_queues.append(work_queue)
+            self._workers.append(worker)
+            worker.start()
+
+    def _worker_for(self, message):
+        # Same call_id -> same worker, so a call's messages are handled in order
+        routing_key = message.key if message.key is not None else str(message.partition)
+        return self._work_queues[zlib.crc32(routing_key.encode('utf-8')) % self.worker_count]
+
+    def _dispatch(self, tp, message):
+        with self._offsets_lock:
+            self._offsets.setdefault(tp, _PartitionOffsets()).dispatched(message.offset)
+        self._count("received")
+        self._worker_for(message).put((tp, message))
+
+    def _worker_loop(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is _STOP:
+                return
+            tp, message = item
+            if self._handle(message):
+                with self._offsets_lock:
+                    tracker = self._offsets.get(tp)
+                    if tracker:
+                        tracker.finished(message.offset)
+
+    def _handle(self, message):
+        """
+        Run process_message, retrying transient errors with backoff.
+        Returns False only if shutdown interrupted it, leaving the offset uncommitted
+        so the message is redelivered.
+        """
+        attempt = 0
+        started = time.monotonic()
+        while True:
+            try:
+                success = self.process_message(message)
+                self._count("processed" if success else "failed")
+                PROCESS_SECONDS.labels(outcome="processed" if success else "failed").observe(time.monotonic() - started)
+                if message.timestamp and message.timestamp > 0:
+                    END_TO_END_SECONDS.observe(max(time.time() - message.timestamp / 1000, 0))
+                return True
+            except TRANSIENT_ERRORS as e:
+                attempt += 1
+                self._count("retried")
+                backoff = min(2 ** attempt, CONSUMER_RETRY_BACKOFF_MAX)
+                logger.warning(f"⚠️ Transient error on offset {message.offset} (attempt {attempt}), retrying in {backoff}s: {e}")
+                if self._stopping.wait(backoff):
+                    return False
+
+    def _in_flight(self):
+        with self._offsets_lock:
+            return sum(len(tracker.pending) for tracker in self._offsets.values())
+
+    def _apply_backpressure(self):
+        """Pause fetching while too many messages are queued for the workers."""
+        in_flight = self._in_flight()
+        assignment = self.consumer.assignment()
+        if not self._paused and in_flight >= CONSUMER_MAX_IN_FLIGHT:
+            self.consumer.pause(*assignment)
+            self._paused = True
+        elif self._paused and in_flight <= CONSUMER_MAX_IN_FLIGHT // 2:
+            self.consumer.resume(*assignment)
+            self._paused = False
+
+    def _commit(self, partitions=None):
+        """Commit, per partition, the offset of the first unfinished message."""
+        offsets = {}
+        with self._offsets_lock:
+            for tp, tracker in self._offsets.items():
+                if partitions is not None and tp not in partitions:
+                    continue
+                point = tracker.commit_point()
+                if point is not None and point != tracker.committed:
+                    offsets[tp] = point
+        if not offsets:
+            return
+        try:
+            self.consumer.commit({tp: _offset_and_metadata(offset) for tp, offset in offsets.items()})
+        except KafkaError as e:
+            logger.error(f"❌ Offset commit failed: {e}")
+            return
+        with self._offsets_lock:
+            for tp, offset in offsets.items():
+                tracker = self._offsets.get(tp)
+                if tracker:
+                    tracker.committed = offset
+        self._count("committed", len(offsets))
+
+    def _on_partitions_revoked(self, revoked):
+        """Let in-flight work on revoked partitions finish (bounded), commit it, forget them."""
+        revoked = set(revoked)
+        if not revoked:
+            return
+        deadline = time.monotonic() + CONSUMER_REVOKE_TIMEOUT
+        while time.monotonic() < deadline:
+            with self._offsets_lock:
+                busy = any(self._offsets[tp].pending for tp in revoked if tp in self._offsets)
+            if not busy:
+                break
+            time.sleep(0.05)
+        self._commit(revoked)
+        with self._offsets_lock:
+            for tp in revoked:
+                self._offsets.pop(tp, None)
+        logger.info(f"📤 Revoked partitions: {sorted(tp.partition for tp in revoked)}")
+
+    def _update_lag(self):
+        lag = {}
+        with self._offsets_lock:
+            trackers = dict(self._offsets)
+        for tp in self.consumer.assignment():
+            highwater = self.consumer.highwater(tp)
+            if highwater is None:
+                continue
+            tracker = trackers.get(tp)
+            point = tracker.commit_point() if tracker else None
+            if point is None:
+                point = self.consumer.position(tp)
+            lag[f"{tp.topic}-{tp.partition}"] = max(highwater - point, 0)
+        self._lag = lag
+
+    def _update_rate(self):
+        now = time.monotonic()
+        with self._metrics_lock:
+            processed = self._metrics["processed"] + self._metrics["failed"]
+            elapsed = now - self._rate["since"]
+            if elapsed > 0:
+                self._rate["per_second"] = (processed - self._rate["processed"]) / elapsed
+            self._rate["since"] = now
+            self._rate["processed"] = processed
+
+    def metrics(self):
+        """Counters, current in-flight/paused state, throughput and per-partition lag."""
+        with self._metrics_lock:
+            snapshot = dict(self._metrics)
+            snapshot["throughput_per_second"] = round(self._rate["per_second"], 2)
+        snapshot["in_flight"] = self._in_flight()
+        snapshot["paused"] = self._paused
+        snapshot["workers"] = self.worker_count
+        snapshot["lag"] = dict(self._lag)
+        snapshot["total_lag"] = sum(self._lag.values())
+        return snapshot
+
+    def collect_metrics(self):
+        """metrics() as Prometheus families (Registry.register_collector)"""
+        snapshot = self.metrics()
+        return [
+            counters("kafka_consumer_messages_total", "Kafka consumer messages by outcome", snapshot,
+                     ("received", "processed", "failed", "retried"), label="outcome"),
+            ("kafka_consumer_commits_total", "counter", "Partition offsets committed", [({}, snapshot["committed"])]),
+            gauge("kafka_consumer_in_flight", "Messages dispatched to workers and not yet finished", snapshot["in_flight"]),
+            gauge("kafka_consumer_paused", "1 while fetching is paused for backpressure", snapshot["paused"]),
+            gauge("kafka_consumer_throughput_per_second", "Messages processed per second over the last metrics interval",
+                  snapshot["throughput_per_second"]),
+            ("kafka_consumer_lag", "gauge", "Messages behind the partition high watermark",
+             [({"partition": partition}, lag) for partition, lag in sorted(snapshot["lag"].items())]),
+            gauge("kafka_consumer_total_lag", "Messages behind across assigned partitions", snapshot["total_lag"]),
+        ]
+
     def start_consuming(self):
         """Start consuming messages from Kafka."""
         if not self.consumer:
             logger.error("❌ Kafka consumer not initialized")
             return
         
-        logger.info(f"🚀 Starting to consume messages from topic: {self.topic}")
+        logger.info(f"🚀 Starting to consume messages from topic: {self.topic} ({self.worker_count} workers)")
+        self._start_workers()
+        last_commit = last_metrics = time.monotonic()
         
         try:
-            for message in self.consumer:
-                self.process_message(message)
+            while not self._stopping.is_set():
+                self._apply_backpressure()
+                records = self.consumer.poll(timeout_ms=500)
+                for tp, messages in records.items():
+                    for message in messages:
+                        self._dispatch(tp, message)
+                
+                now = time.monotonic()
+                if now - last_commit >= CONSUMER_COMMIT_INTERVAL:
+                    self._commit()
+                    self._update_lag()
+                    last_commit = now
+                if now - last_metrics >= CONSUMER_METRICS_INTERVAL:
+                    self._update_rate()
+                    logger.info(f"📊 Consumer metrics: {self.metrics()}")
+                    last_metrics = now
         except KeyboardInterrupt:
             logger.info("🛑 Consumer stopped by user")
         except Exception as e:
@@ -279,11 +545,22 @@ class AIResponseConsumer:
         finally:
             self.close()
     
-    def close(self):
-        """Close the Kafka consumer."""
+    def stop(self):
+        """Ask the poll loop to exit (safe to call from another thread or a signal handler)."""
+        self._stopping.set()
+    
+    def close(self, timeout=30):
+        """Drain the workers, commit what finished and close the Kafka consumer."""
+        self._stopping.set()
+        for work_queue in self._work_queues:
+            work_queue.put(_STOP)
+        deadline = time.monotonic() + timeout
+        for worker in self._workers:
+            worker.join(max(deadline - time.monotonic(), 0))
         if self.consumer:
-            self.consumer.close()
-            logger.info("🔒 Kafka consumer closed")
+            self._commit()
+            self.consumer.close(autocommit=False)
+            logger.info(f"🔒 Kafka consumer closed ({self.metrics() if self._workers else 'idle'})")
 
 # Standalone consumer for running as a separate service
 if __name__ == "__main__":
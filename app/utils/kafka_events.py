@@ -0,0 +1,134 @@
+import io
+import json
+import os
+import time
+import logging
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+# Compact, versioned events for the ai-responses topic. The voice API sends one
+# event per assistant turn with the directives it already extracted, instead of
+# the whole Realtime `response.done` object:
+#
+#   {"v": 1, "type": "AI_TURN", "call_id": ..., "transcript": ...,
+#    "directives": {"BOOKING_CONFIRMATION": {...}}, "results": [],
+#    "started_at": ms, "completed_at": ms, "sent_at": ms, "metadata": {}}
+#
+# JSON events are plain UTF-8 objects, so they look like the legacy messages
+# (which have no "v"). Binary events start with a 3-byte header:
+# 0x00, the encoding id and the schema version. The Avro schemas live in
+# app/schemas/ai_event.v<version>.avsc.
+EVENT_SCHEMA_VERSION = 1
+EVENT_ENCODING = os.getenv("KAFKA_EVENT_ENCODING", "json").lower()
+
+AI_TURN = "AI_TURN"
+DIRECTIVE_AUDIT = "DIRECTIVE_AUDIT"
+
+SCHEMA_DIR = Path(__file__).resolve().parent.parent / "schemas"
+
+_MAGIC = 0
+_ENCODING_IDS = {"msgpack": 1, "avro": 2}
+_ENCODING_NAMES = {v: k for k, v in _ENCODING_IDS.items()}
+
+try:
+    import msgpack
+except ImportError:  # optional, only needed for KAFKA_EVENT_ENCODING=msgpack
+    msgpack = None
+
+try:
+    import fastavro
+except ImportError:  # optional, only needed for KAFKA_EVENT_ENCODING=avro
+    fastavro = None
+
+_avro_schemas = {}
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def build_event(event_type, call_id, transcript=None, directives=None, results=None,
+                started_at=None, completed_at=None, metadata=None):
+    """A compact event dict. Timestamps are epoch milliseconds."""
+    return {
+        "v": EVENT_SCHEMA_VERSION,
+        "type": event_type,
+        "call_id": call_id or "unknown",
+        "transcript": transcript,
+        "directives": directives or {},
+        "results": results or [],
+        "started_at": started_at,
+        "completed_at": completed_at,
+        "sent_at": now_ms(),
+        "metadata": {k: str(v) for k, v in (metadata or {}).items()}
+    }
+
+def is_event(message):
+    """True for compact events, False for legacy send_ai_response() messages"""
+    return isinstance(message, dict) and "v" in message
+
+def available_encoding(encoding=EVENT_ENCODING):
+    """The requested encoding, or "json" if its library is not installed"""
+    if encoding == "msgpack" and msgpack is None:
+        logger.warning("⚠️ msgpack is not installed, sending Kafka events as JSON")
+        return "json"
+    if encoding == "avro" and fastavro is None:
+        logger.warning("⚠️ fastavro is not installed, sending Kafka events as JSON")
+        return "json"
+    if encoding not in ("json", "msgpack", "avro"):
+        logger.warning(f"⚠️ Unknown KAFKA_EVENT_ENCODING {encoding!r}, using JSON")
+        return "json"
+    return encoding
+
+def avro_schema(version=EVENT_SCHEMA_VERSION):
+    """Parsed Avro schema for `version`, loaded from app/schemas once"""
+    schema = _avro_schemas.get(version)
+    if schema is None:
+        with open(SCHEMA_DIR / f"ai_event.v{version}.avsc", "r", encoding="utf-8") as f:
+            schema = fastavro.parse_schema(json.load(f))
+        _avro_schemas[version] = schema
+    return schema
+
+def _to_avro(event):
+    record = dict(event)
+    record["directives"] = [{"name": name, "fields": fields} for name, fields in event["directives"].items()]
+    return record
+
+def _from_avro(record):
+    record["directives"] = {d["name"]: d["fields"] for d in record["directives"]}
+    return record
+
+def encode_event(event, encoding="json"):
+    """Serialize an event (use available_encoding() to pick `encoding`)"""
+    if encoding == "json":
+        return json.dumps(event, separators=(",", ":"), default=str).encode("utf-8")
+
+    header = bytes((_MAGIC, _ENCODING_IDS[encoding], event["v"]))
+    if encoding == "msgpack":
+        return header + msgpack.packb(event, use_bin_type=True, default=str)
+
+    buffer = io.BytesIO()
+    buffer.write(header)
+    fastavro.schemaless_writer(buffer, avro_schema(event["v"]), _to_avro(event))
+    return buffer.getvalue()
+
+def decode_event(value):
+    """
+    Deserialize a message value: a compact event in any encoding, or a legacy
+    JSON message. Raises ValueError for payloads that can't be decoded.
+    """
+    if not value:
+        raise ValueError("empty message")
+    if value[0] != _MAGIC:
+        return json.loads(value.decode("utf-8"))
+
+    if len(value) < 3 or value[1] not in _ENCODING_NAMES:
+        raise ValueError("unknown event encoding")
+    encoding, version = _ENCODING_NAMES[value[1]], value[2]
+    if encoding == "msgpack":
+        if msgpack is None:
+            raise ValueError("msgpack event received but msgpack is not installed")
+        return msgpack.unpackb(value[3:], raw=False)
+
+    if fastavro is None:
+        raise ValueError("Avro event received but fastavro is not installed")
+    return _from_avro(fastavro.schemaless_reader(io.BytesIO(value[3:]), avro_schema(version)))
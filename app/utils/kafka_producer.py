@@ -1,19 +1,48 @@
 import json
 import os
+import queue
+import threading
+import time
 from kafka import KafkaProducer
 from kafka.errors import KafkaError
 import logging
+from app.utils.kafka_events import available_encoding, encode_event, is_event
+from app.utils.metrics import REGISTRY, Histogram, counters, gauge
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Producer settings. In async mode send_ai_response() only enqueues; a background
+# thread hands messages to kafka-python, which batches them (linger/batch size),
+# compresses them and reports delivery through callbacks.
+PRODUCER_ASYNC = os.getenv("KAFKA_PRODUCER_ASYNC", "true").lower() == "true"
+PRODUCER_QUEUE_SIZE = int(os.getenv("KAFKA_PRODUCER_QUEUE_SIZE", 1000))
+PRODUCER_LINGER_MS = int(os.getenv("KAFKA_PRODUCER_LINGER_MS", 20))
+PRODUCER_BATCH_SIZE = int(os.getenv("KAFKA_PRODUCER_BATCH_SIZE", 32768))
+PRODUCER_COMPRESSION = os.getenv("KAFKA_PRODUCER_COMPRESSION", "gzip") or None
+# Longest the sender thread may block in send() on metadata or a full buffer
+PRODUCER_MAX_BLOCK_MS = int(os.getenv("KAFKA_PRODUCER_MAX_BLOCK_MS", 5000))
+
+_STOP = object()
+
+# From send_ai_response()/send_event() to the broker's ack, queue time included
+SEND_SECONDS = Histogram("kafka_producer_send_seconds", "Kafka send latency until acknowledged", ("outcome",))
+
 class AIResponseProducer:
-    def __init__(self):
+    def __init__(self, async_mode=PRODUCER_ASYNC, queue_size=PRODUCER_QUEUE_SIZE):
         self.producer = None
         self.topic = os.getenv("KAFKA_TOPIC", "ai-responses")
+        self.async_mode = async_mode
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._sender = None
+        self._metrics_lock = threading.Lock()
+        self._metrics = {"enqueued": 0, "sent": 0, "failed": 0, "dropped": 0, "bytes": 0}
+        self.event_encoding = available_encoding()
         self._initialize_producer()
-    
+        if self.producer and self.async_mode:
+            self._start_sender()
+
     def _initialize_producer(self):
         """Initialize Kafka producer with Aiven configuration."""
         try:
@@ -23,71 +52,213 @@ class AIResponseProducer:
                 'ssl_cafile': os.getenv("KAFKA_SSL_CA_FILE"),
                 'ssl_certfile': os.getenv("KAFKA_SSL_CERT_FILE"),
                 'ssl_keyfile': os.getenv("KAFKA_SSL_KEY_FILE"),
-                'value_serializer': lambda v: json.dumps(v).encode('utf-8'),
+                'value_serializer': self._serialize,
                 'key_serializer': lambda v: v.encode('utf-8') if v else None,
                 'retries': 3,
                 'retry_backoff_ms': 1000,
                 'request_timeout_ms': 30000,
+                'linger_ms': PRODUCER_LINGER_MS,
+                'batch_size': PRODUCER_BATCH_SIZE,
+                'compression_type': PRODUCER_COMPRESSION,
+                'max_block_ms': PRODUCER_MAX_BLOCK_MS,
                 'api_version': (0, 10, 1)
             }
-            
+
             # Remove None values
             kafka_config = {k: v for k, v in kafka_config.items() if v is not None}
-            
+
             self.producer = KafkaProducer(**kafka_config)
             logger.info("✅ Kafka producer initialized successfully")
-            
+
         except Exception as e:
             logger.error(f"❌ Failed to initialize Kafka producer: {e}")
             self.producer = None
-    
-    def send_ai_response(self, call_id, response_type, data, metadata=None):
+
+    def _start_sender(self):
+        self._sender = threading.Thread(target=self._sender_loop, name="kafka-sender", daemon=True)
+        self._sender.start()
+
+    def _count(self, metric, amount=1):
+        with self._metrics_lock:
+            self._metrics[metric] += amount
+
+    def metrics(self):
+        """Counters for enqueued/sent/failed/dropped messages, serialized bytes and the current queue depth."""
+        with self._metrics_lock:
+            snapshot = dict(self._metrics)
+        snapshot["queue_depth"] = self._queue.qsize()
+        return snapshot
+
+    def _build_message(self, call_id, response_type, data, metadata):
+        return {
+            "call_id": call_id,
+            "response_type": response_type,
+            "data": data,
+            "metadata": metadata or {},
+            "timestamp": json.dumps({"timestamp": "now"})  # Will be replaced with actual timestamp
+        }
+
+    def _serialize(self, message):
+        if is_event(message):
+            value = encode_event(message, self.event_encoding)
+        else:
+            value = json.dumps(message).encode('utf-8')
+        self._count("bytes", len(value))
+        return value
+
+    def send_event(self, event, on_delivery=None, wait=False):
+        """
+        Send a compact event (app/utils/kafka_events.build_event), encoded as
+        KAFKA_EVENT_ENCODING. Queuing and delivery work as in send_ai_response().
+        """
+        if not self.producer:
+            logger.error("❌ Kafka producer not initialized")
+            return False
+        return self._enqueue(event["call_id"], event, event["type"], on_delivery, wait)
+
+    def send_ai_response(self, call_id, response_type, data, metadata=None, on_delivery=None, wait=False):
         """
         Send AI response to Kafka topic.
-        
+
+        In async mode (default) the message is only queued and this returns at once;
+        True means it was accepted, False that the queue was full and it was dropped.
+        Pass wait=True (or disable KAFKA_PRODUCER_ASYNC) to block until the broker acks.
+
         Args:
             call_id (str): Unique identifier for the call
             response_type (str): Type of response (PATIENT_CREATION, BOOKING_CONFIRMATION)
             data (dict): The actual data to process
             metadata (dict): Additional metadata about the call
+            on_delivery (callable): Optional on_delivery(success, record_metadata_or_error)
+                called from the Kafka I/O thread once the send completes
+            wait (bool): Block until the send is acknowledged
         """
         if not self.producer:
             logger.error("❌ Kafka producer not initialized")
             return False
-        
+
+        message = self._build_message(call_id, response_type, data, metadata)
+        return self._enqueue(call_id, message, response_type, on_delivery, wait)
+
+    def _enqueue(self, call_id, message, response_type, on_delivery, wait):
+        if not self.async_mode or wait:
+            return self._send_sync(call_id, message, on_delivery)
+
+        try:
+            self._queue.put_nowait((call_id, message, on_delivery, time.monotonic()))
+        except queue.Full:
+            self._count("dropped")
+            logger.warning(f"⚠️ Kafka send queue full, dropping {response_type} for call {call_id}")
+            return False
+
+        self._count("enqueued")
+        return True
+
+    def _send_sync(self, call_id, message, on_delivery):
+        started = time.monotonic()
         try:
-            message = {
-                "call_id": call_id,
-                "response_type": response_type,
-                "data": data,
-                "metadata": metadata or {},
-                "timestamp": json.dumps({"timestamp": "now"})  # Will be replaced with actual timestamp
-            }
-            
             # Use call_id as key for partitioning
             future = self.producer.send(
                 self.topic,
                 key=call_id,
                 value=message
             )
-            
+
             # Wait for confirmation
             record_metadata = future.get(timeout=10)
-            logger.info(f"✅ Message sent to topic {record_metadata.topic} partition {record_metadata.partition} offset {record_metadata.offset}")
+            self._on_send_success(on_delivery, record_metadata, started)
             return True
-            
+
         except KafkaError as e:
             logger.error(f"❌ Kafka error sending message: {e}")
+            self._on_send_error(on_delivery, e, started)
             return False
         except Exception as e:
             logger.error(f"❌ Error sending message to Kafka: {e}")
+            self._on_send_error(on_delivery, e, started)
             return False
-    
-    def close(self):
-        """Close the Kafka producer."""
+
+    def _sender_loop(self):
+        """Move queued messages into kafka-python's batching buffer (runs on its own thread)."""
+        while True:
+            item = self._queue.get()
+            try:
+                if item is _STOP:
+                    return
+                call_id, message, on_delivery, enqueued_at = item
+                try:
+                    # Use call_id as key for partitioning
+                    future = self.producer.send(self.topic, key=call_id, value=message)
+                    future.add_callback(
+                        lambda record_metadata, cb=on_delivery, t=enqueued_at: self._on_send_success(cb, record_metadata, t)
+                    )
+                    future.add_errback(lambda exc, cb=on_delivery, t=enqueued_at: self._on_send_error(cb, exc, t))
+                except Exception as e:
+                    logger.error(f"❌ Error sending message to Kafka: {e}")
+                    self._on_send_error(on_delivery, e, enqueued_at)
+            finally:
+                self._queue.task_done()
+
+    def _on_send_success(self, on_delivery, record_metadata, started=None):
+        self._count("sent")
+        if started is not None:
+            SEND_SECONDS.labels(outcome="sent").observe(time.monotonic() - started)
+        logger.info(f"✅ Message sent to topic {record_metadata.topic} partition {record_metadata.partition} offset {record_metadata.offset}")
+        self._notify(on_delivery, True, record_metadata)
+
+    def _on_send_error(self, on_delivery, exc, started=None):
+        self._count("failed")
+        if started is not None:
+            SEND_SECONDS.labels(outcome="failed").observe(time.monotonic() - started)
+        logger.error(f"❌ Kafka delivery failed: {exc}")
+        self._notify(on_delivery, False, exc)
+
+    def _notify(self, on_delivery, success, result):
+        if on_delivery is None:
+            return
+        try:
+            on_delivery(success, result)
+        except Exception as e:
+            logger.error(f"❌ Kafka delivery callback raised: {e}")
+
+    def flush(self, timeout=10):
+        """Wait until queued messages are handed to Kafka and delivered (or timeout)."""
+        if not self.producer:
+            return
+        deadline = time.monotonic() + timeout
+        if self._sender and self._sender.is_alive():
+            while self._queue.unfinished_tasks and time.monotonic() < deadline:
+                time.sleep(0.01)
+        self.producer.flush(timeout=max(deadline - time.monotonic(), 0))
+
+    def close(self, timeout=10):
+        """Deliver what is queued, then close the Kafka producer."""
         if self.producer:
-            self.producer.close()
-            logger.info("🔒 Kafka producer closed")
+            deadline = time.monotonic() + timeout
+            if self._sender and self._sender.is_alive():
+                try:
+                    # A full queue with the sender stuck in send() must not block shutdown
+                    self._queue.put(_STOP, timeout=timeout)
+                    self._sender.join(max(deadline - time.monotonic(), 0))
+                except queue.Full:
+                    logger.warning(f"⚠️ Kafka sender still busy after {timeout}s; closing with {self._queue.qsize()} messages queued")
+            try:
+                self.producer.flush(timeout=max(deadline - time.monotonic(), 0))
+            except KafkaError as e:
+                logger.warning(f"⚠️ Kafka flush on close did not finish: {e}")
+            self.producer.close(timeout=max(deadline - time.monotonic(), 0))
+            logger.info(f"🔒 Kafka producer closed ({self.metrics()})")
+
+    def collect_metrics(self):
+        """metrics() as Prometheus families (Registry.register_collector)"""
+        snapshot = self.metrics()
+        return [
+            counters("kafka_producer_messages_total", "Kafka producer messages by outcome", snapshot,
+                     ("enqueued", "sent", "failed", "dropped"), label="outcome"),
+            ("kafka_producer_bytes_total", "counter", "Serialized bytes handed to Kafka", [({}, snapshot["bytes"])]),
+            gauge("kafka_producer_queue_depth", "Messages waiting for the sender thread", snapshot["queue_depth"]),
+        ]
 
 # Global producer instance
 ai_response_producer = AIResponseProducer()
+REGISTRY.register_collector(ai_response_producer.collect_metrics)
@@ -0,0 +1,49 @@
+import json
+
+# Framing for the Twilio <-> OpenAI Realtime audio relay in /voice/media-stream.
+# Audio payloads are base64 on both sides, so they are forwarded as-is: no
+# decode/re-encode, and the fixed-shape media/mark/append events are built from
+# string templates instead of going through a JSON encoder.
+
+try:
+    import orjson
+
+    def loads(data):
+        return orjson.loads(data)
+
+    def dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:  # orjson is optional; the stdlib codec gives the same output
+    loads = json.loads
+
+    def dumps(obj) -> str:
+        return json.dumps(obj, separators=(",", ":"))
+
+def _is_plain(payload) -> bool:
+    """True if `payload` can be placed inside a JSON string literal without escaping"""
+    # base64 never contains these; anything else goes through the encoder
+    return isinstance(payload, str) and '"' not in payload and "\\" not in payload
+
+def input_audio_append(payload: str) -> str:
+    """OpenAI `input_audio_buffer.append` event carrying a Twilio media payload"""
+    if _is_plain(payload):
+        return '{"type":"input_audio_buffer.append","audio":"' + payload + '"}'
+    return dumps({"type": "input_audio_buffer.append", "audio": payload})
+
+class TwilioFrames:
+    """Pre-rendered outbound Twilio frames for one media stream"""
+
+    __slots__ = ("stream_sid", "_media_prefix", "mark", "clear")
+
+    def __init__(self, stream_sid=None):
+        self.stream_sid = stream_sid
+        sid = json.dumps(stream_sid)
+        self._media_prefix = '{"event":"media","streamSid":' + sid + ',"media":{"payload":"'
+        self.mark = '{"event":"mark","streamSid":' + sid + ',"mark":{"name":"responsePart"}}'
+        self.clear = '{"event":"clear","streamSid":' + sid + '}'
+
+    def media(self, payload: str) -> str:
+        """Twilio `media` frame for an OpenAI audio delta (already base64)"""
+        if _is_plain(payload):
+            return self._media_prefix + payload + '"}}'
+        return dumps({"event": "media", "streamSid": self.stream_sid, "media": {"payload": payload}})
@@ -0,0 +1,269 @@
+import asyncio
+import base64
+import os
+import threading
+import time
+from collections import deque
+from app.utils.metrics import REGISTRY, Counter, Histogram, gauge
+
+# Per-call outbound queues for the /voice/media-stream relay. Each socket gets
+# one bounded queue and one writer task, so a slow peer only backs up its own
+# queue instead of stalling the reader on the other side. Control frames
+# (mark/clear/truncate/session events) are never dropped; audio frames are
+# dropped or coalesced once the queue is full, and the oldest audio is dropped
+# once the queue holds more than its maximum duration of audio.
+
+RELAY_POLICIES = {"drop_oldest", "coalesce"}
+
+# Caller audio (Twilio -> OpenAI) arrives as 20ms frames, so 50 frames ~ 1s
+OPENAI_QUEUE_FRAMES = int(os.getenv("VOICE_OPENAI_QUEUE_FRAMES", 50))
+OPENAI_QUEUE_POLICY = os.getenv("VOICE_OPENAI_QUEUE_POLICY", "coalesce")
+# Assistant audio (OpenAI -> Twilio) arrives in larger deltas
+TWILIO_QUEUE_FRAMES = int(os.getenv("VOICE_TWILIO_QUEUE_FRAMES", 100))
+TWILIO_QUEUE_POLICY = os.getenv("VOICE_TWILIO_QUEUE_POLICY", "coalesce")
+# Largest audio frame coalescing may build (decoded bytes); past it the oldest frame is dropped
+MAX_COALESCED_BYTES = int(os.getenv("VOICE_MAX_COALESCED_BYTES", 32000))
+# Most audio a queue may hold, however it is split into frames; past it the oldest audio is dropped
+OPENAI_QUEUE_MAX_MS = int(os.getenv("VOICE_OPENAI_QUEUE_MAX_MS", 2000))
+TWILIO_QUEUE_MAX_MS = int(os.getenv("VOICE_TWILIO_QUEUE_MAX_MS", 10000))
+
+# Both directions carry 8kHz G.711 u-law (audio/pcmu): one byte per sample
+AUDIO_BYTES_PER_MS = 8
+
+_LATENCY_SAMPLES = 512
+
+_totals_lock = threading.Lock()
+_totals = {"calls": 0, "sent": 0, "dropped": 0, "coalesced": 0, "max_depth": 0}
+_active_queues = set()
+
+RELAY_FRAMES = Counter(
+    "voice_relay_frames_total", "Frames written by the media relay, and audio frames dropped or coalesced",
+    ("queue", "outcome")
+)
+RELAY_QUEUE_SECONDS = Histogram(
+    "voice_relay_queue_seconds", "Time audio waits in a relay queue before it is written", ("queue",),
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1)
+)
+
+class RelayQueue:
+    """
+    Bounded outbound queue for one socket of one call, drained by its own writer task.
+
+    `send` is the socket's async send function; `render_audio(payload)` turns a queued
+    audio payload (base64 string) into the frame to send, at write time.
+    `max_audio_ms` caps the queued audio duration (None: only `max_frames` applies).
+    `on_error(exc)` is called once if a write fails; the queue is closed by then.
+    """
+
+    def __init__(self, name, send, render_audio, max_frames, policy="coalesce", max_audio_ms=None, on_error=None):
+        if policy not in RELAY_POLICIES:
+            raise ValueError(f"Unknown relay policy: {policy}")
+        self.name = name
+        self._send = send
+        self._render_audio = render_audio
+        self.max_frames = max(1, max_frames)
+        self.policy = policy
+        self.max_audio_bytes = max_audio_ms * AUDIO_BYTES_PER_MS if max_audio_ms else None
+        self._on_error = on_error
+        self._items = deque()  # (is_audio, payload_or_frame, enqueued_at)
+        self._audio_frames = 0
+        self._audio_bytes = 0
+        self._ready = asyncio.Event()
+        self._closed = False
+        self._writer = None
+        self._latencies = deque(maxlen=_LATENCY_SAMPLES)
+        self._stats = {"sent": 0, "dropped": 0, "coalesced": 0, "max_depth": 0}
+        self._frames = {outcome: RELAY_FRAMES.labels(queue=name, outcome=outcome) for outcome in ("sent", "dropped", "coalesced")}
+        self._queue_seconds = RELAY_QUEUE_SECONDS.labels(queue=name)
+
+    def start(self):
+        self._writer = asyncio.create_task(self._write_loop())
+        _active_queues.add(self)
+        return self
+
+    def put_audio(self, payload, received_at=None):
+        """Queue an audio payload; never waits. Applies the queue's policy when full."""
+        if self._closed:
+            return
+        received_at = received_at or time.monotonic()
+        self._audio_bytes += _audio_size(payload)
+        if self._audio_frames >= self.max_frames:
+            if self.policy == "coalesce" and self._coalesce(payload):
+                self._trim_audio()
+                return
+            self._drop_oldest_audio()
+        self._items.append((True, payload, received_at))
+        self._audio_frames += 1
+        self._trim_audio()
+        self._queued()
+
+    def put_control(self, frame):
+        """Queue a pre-rendered control frame; these are never dropped."""
+        if self._closed:
+            return
+        self._items.append((False, frame, time.monotonic()))
+        self._queued()
+
+    def discard_audio(self):
+        """Drop queued audio that has not been written yet (e.g. on barge-in)."""
+        kept = deque(item for item in self._items if not item[0])
+        self._count("dropped", len(self._items) - len(kept))
+        self._items = kept
+        self._audio_frames = 0
+        self._audio_bytes = 0
+
+    def depth(self):
+        return len(self._items)
+
+    def audio_ms(self):
+        """Duration of the audio waiting in the queue"""
+        return self._audio_bytes // AUDIO_BYTES_PER_MS
+
+    def _count(self, outcome, amount=1):
+        self._stats[outcome] += amount
+        self._frames[outcome].inc(amount)
+
+    def _coalesce(self, payload):
+        """
+        Make room by merging audio frames instead of dropping them. Returns True if
+        `payload` itself was merged into the last frame; False if room was made for it
+        (or nothing could be merged, in which case the caller drops the oldest frame).
+        """
+        items = self._items
+        last = items[-1] if items else None
+        if last and last[0] and _fits(last[1], payload):
+            # Keep the older timestamp so latency covers the whole merged frame
+            items[-1] = (True, _merge(last[1], payload), last[2])
+            self._count("coalesced")
+            return True
+        # The last frame is full: merge the oldest adjacent pair that still fits
+        for index in range(len(items) - 1):
+            first, second = items[index], items[index + 1]
+            if first[0] and second[0] and _fits(first[1], second[1]):
+                items[index] = (True, _merge(first[1], second[1]), first[2])
+                del items[index + 1]
+                self._audio_frames -= 1
+                self._count("coalesced")
+                return False
+        return False
+
+    def _drop_oldest_audio(self):
+        if self._audio_frames < self.max_frames:
+            return
+        self._drop_first_audio()
+
+    def _trim_audio(self):
+        """Drop the oldest audio while the queue holds more than max_audio_bytes (keeps the newest frame)"""
+        if self.max_audio_bytes is None:
+            return
+        while self._audio_bytes > self.max_audio_bytes and self._audio_frames > 1:
+            self._drop_first_audio()
+
+    def _drop_first_audio(self):
+        for index, item in enumerate(self._items):
+            if item[0]:
+                del self._items[index]
+                self._audio_frames -= 1
+                self._audio_bytes -= _audio_size(item[1])
+                self._count("dropped")
+                return
+
+    def _queued(self):
+        depth = len(self._items)
+        if depth > self._stats["max_depth"]:
+            self._stats["max_depth"] = depth
+        self._ready.set()
+
+    async def _write_loop(self):
+        try:
+            while True:
+                if not self._items:
+                    if self._closed:
+                        return
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+                is_audio, payload, enqueued_at = self._items.popleft()
+                if is_audio:
+                    self._audio_frames -= 1
+                    self._audio_bytes -= _audio_size(payload)
+                    payload = self._render_audio(payload)
+                await self._send(payload)
+                self._count("sent")
+                if is_audio:
+                    waited = time.monotonic() - enqueued_at
+                    self._latencies.append(waited)
+                    self._queue_seconds.observe(waited)
+        except Exception as e:
+            print(f"❌ {self.name} writer stopped: {e}")
+            self._closed = True
+            if self._on_error:
+                self._on_error(e)
+
+    async def close(self, timeout=2):
+        """Stop accepting frames, let the writer flush what is queued (bounded), then stop it."""
+        self._closed = True
+        self._ready.set()
+        if self._writer:
+            try:
+                await asyncio.wait_for(self._writer, timeout)
+            except asyncio.TimeoutError:
+                pass
+            except Exception:
+                pass
+        _active_queues.discard(self)
+        with _totals_lock:
+            for key in ("sent", "dropped", "coalesced"):
+                _totals[key] += self._stats[key]
+            _totals["max_depth"] = max(_totals["max_depth"], self._stats["max_depth"])
+
+    def stats(self):
+        """Frames sent/dropped/coalesced, current and peak depth, and audio latency (ms)."""
+        snapshot = dict(self._stats)
+        snapshot["depth"] = len(self._items)
+        snapshot.update(latency_summary(self._latencies))
+        return snapshot
+
+def _audio_size(payload):
+    """Decoded size of a base64 audio payload"""
+    return len(payload) * 3 // 4 - payload[-2:].count("=")
+
+def _fits(first, second):
+    # base64 length * 3/4 is the decoded size (to within padding)
+    return (len(first) + len(second)) * 3 // 4 <= MAX_COALESCED_BYTES
+
+def _merge(first, second):
+    return base64.b64encode(base64.b64decode(first) + base64.b64decode(second)).decode("utf-8")
+
+def latency_summary(samples):
+    """avg/p95/max in milliseconds for a sequence of latencies in seconds"""
+    if not samples:
+        return {"latency_avg_ms": None, "latency_p95_ms": None, "latency_max_ms": None}
+    ordered = sorted(samples)
+    return {
+        "latency_avg_ms": round(sum(ordered) / len(ordered) * 1000, 2),
+        "latency_p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000, 2),
+        "latency_max_ms": round(ordered[-1] * 1000, 2)
+    }
+
+def record_call():
+    with _totals_lock:
+        _totals["calls"] += 1
+
+def relay_metrics():
+    """Process-wide relay counters (finished queues) plus the live depth of active ones."""
+    with _totals_lock:
+        snapshot = dict(_totals)
+    queues = list(_active_queues)
+    snapshot["active_queues"] = len(queues)
+    snapshot["queued_frames"] = sum(queue.depth() for queue in queues)
+    return snapshot
+
+def _relay_collector():
+    snapshot = relay_metrics()
+    return [
+        ("voice_calls_total", "counter", "Media streams opened", [({}, snapshot["calls"])]),
+        gauge("voice_relay_queued_frames", "Frames waiting in relay queues", snapshot["queued_frames"]),
+    ]
+
+REGISTRY.register_collector(_relay_collector)
@@ -0,0 +1,281 @@
+import bisect
+import logging
+import os
+import resource
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# Prometheus text exposition (format 0.0.4) without extra dependencies. Metrics
+# update directly on hot paths (request latency, relayed frames, Kafka sends);
+# components that already keep their own counters (pool, producer, consumer,
+# realtime pool) register a collector that turns their metrics() snapshot into
+# samples when /metrics is scraped.
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, bool):
+        return "1" if value else "0"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        """
+        `collector()` returns [(name, type, help, [(labels, value), ...]), ...],
+        evaluated on every scrape.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            collectors = list(self._collectors)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        for collector in collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                logger.warning(f"⚠️ Metrics collector {getattr(collector, '__name__', collector)} failed: {e}")
+                continue
+            for name, kind, help_text, samples in families:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+                for labels, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+REGISTRY = Registry()
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._children[()] = self._new_child()
+        registry.register(self)
+
+    def labels(self, **labels):
+        """The child for one label combination; keep it around on hot paths"""
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _unlabeled(self):
+        return self._children[()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            lines.extend(child.render(self.name, dict(zip(self.labelnames, key))))
+        return lines
+
+class _Value:
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value):
+        self.value = value
+
+    def render(self, name, labels):
+        return [f"{name}{_format_labels(labels)} {_format_value(self.value)}"]
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._unlabeled().inc(amount)
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._unlabeled().inc(amount)
+
+    def dec(self, amount=1):
+        self._unlabeled().dec(amount)
+
+    def set(self, value):
+        self._unlabeled().set(value)
+
+class _HistogramValue:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def render(self, name, labels):
+        with self._lock:
+            counts, total = list(self.counts), self.sum
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels({**labels, 'le': _format_value(float(bound))})} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labels)} {cumulative}")
+        return lines
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help_text, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._unlabeled().observe(value)
+
+def counters(name, help_text, snapshot, keys, label="event"):
+    """Collector family: one counter sample per key of a metrics() snapshot"""
+    return (name, "counter", help_text, [({label: key}, snapshot.get(key)) for key in keys])
+
+def gauge(name, help_text, value, labels=None):
+    return (name, "gauge", help_text, [(labels or {}, value)])
+
+_started_at = time.time()
+
+def _process_collector():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    families = [
+        ("process_cpu_seconds_total", "counter", "User and system CPU time", [({}, usage.ru_utime + usage.ru_stime)]),
+        gauge("process_start_time_seconds", "Process start time (unix seconds)", _started_at),
+        gauge("process_threads", "Live Python threads", threading.active_count()),
+    ]
+    try:
+        with open("/proc/self/statm") as f:
+            rss_pages = int(f.read().split()[1])
+        families.append(gauge("process_resident_memory_bytes", "Resident memory", rss_pages * os.sysconf("SC_PAGE_SIZE")))
+    except (OSError, ValueError, IndexError):
+        families.append(gauge("process_max_resident_memory_bytes", "Peak resident memory", usage.ru_maxrss * 1024))
+    return families
+
+REGISTRY.register_collector(_process_collector)
+
+def render():
+    return REGISTRY.render()
+
+# HTTP API
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+HTTP_REQUESTS_IN_PROGRESS = Gauge("http_requests_in_progress", "HTTP requests being handled")
+
+class MetricsMiddleware:
+    """ASGI middleware: per-route latency histogram and in-flight gauge for HTTP requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        HTTP_REQUESTS_IN_PROGRESS.inc()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            HTTP_REQUESTS_IN_PROGRESS.dec()
+            # Templated path, so /api/patients/1 and /api/patients/2 share a series;
+            # unmatched paths are grouped to keep the label set bounded
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.labels(method=scope.get("method", ""), route=route, status=status).observe(
+                time.perf_counter() - started
+            )
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes would flood the service log
+
+def start_http_server(port, host="0.0.0.0"):
+    """Serve /metrics from a daemon thread (for processes without a web app, e.g. the Kafka consumer)"""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    logger.info(f"📈 Metrics served on http://{host}:{port}/metrics")
+    return server
@@ -0,0 +1,47 @@
+import base64
+import json
+from datetime import date, time
+from typing import Optional, Tuple
+
+# How list endpoints may report their total: a real COUNT(*), the planner's
+# row estimate (no table scan), or nothing at all
+COUNT_MODES = {"exact", "estimated", "none"}
+
+def encode_cursor(appointment_date: date, appointment_time: time, appointment_id: int) -> str:
+    """Encode the (appointment_date, appointment_time, id) sort key of the last row as an opaque cursor"""
+    if isinstance(appointment_time, str):
+        appointment_time = time.fromisoformat(appointment_time)
+    payload = json.dumps([
+        appointment_date.isoformat(),
+        appointment_time.isoformat(),
+        appointment_id
+    ])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[date, time, int]:
+    """Decode a cursor produced by encode_cursor; raises ValueError if it is malformed"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        raw_date, raw_time, raw_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return date.fromisoformat(raw_date), time.fromisoformat(raw_time), int(raw_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+def estimate_count(cur, query: str, params) -> int:
+    """Return the planner's row estimate for `query` without executing it"""
+    cur.execute(f"EXPLAIN (FORMAT JSON) {query}", params)
+    row = cur.fetchone()
+    plan = row["QUERY PLAN"] if isinstance(row, dict) else row[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+def count_rows(cur, query: str, params, count: str) -> Optional[int]:
+    """Count the rows `query` would return using the requested count mode"""
+    if count == "none":
+        return None
+    if count == "estimated":
+        return estimate_count(cur, query, params)
+    cur.execute(f"SELECT COUNT(*) AS total FROM ({query}) AS counted", params)
+    row = cur.fetchone()
+    return row["total"] if isinstance(row, dict) else row[0]
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+from app.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# bcrypt cost (2^rounds iterations). Hashes with a different cost are
+# rehashed on the user's next successful login.
+BCRYPT_ROUNDS = int(os.getenv("AUTH_BCRYPT_ROUNDS", 12))
+
+# Password hashing runs bcrypt on a small dedicated thread pool, never on the
+# event loop. bcrypt's C code releases the GIL, so each worker can use its own
+# core while the loop keeps serving other requests. Jobs beyond the workers plus
+# AUTH_HASH_MAX_PENDING are refused (PasswordHasherBusy -> 503) instead of
+# piling up behind a login burst.
+HASH_WORKERS = int(os.getenv("AUTH_HASH_WORKERS", min(4, os.cpu_count() or 1)))
+HASH_MAX_PENDING = int(os.getenv("AUTH_HASH_MAX_PENDING", 32))
+
+# bcrypt only uses the first 72 bytes of a password
+BCRYPT_MAX_BYTES = 72
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(HASH_WORKERS + HASH_MAX_PENDING)
+
+PASSWORD_HASH_SECONDS = Histogram(
+    "auth_password_hash_seconds", "Password hash/verify time, queueing included", ("operation",)
+)
+PASSWORD_REHASHES = Counter("auth_password_rehashes_total", "Password hashes upgraded to AUTH_BCRYPT_ROUNDS at login")
+PASSWORD_REJECTED = Counter("auth_password_rejected_total", "Hash/verify jobs refused because the hasher was saturated")
+
+class PasswordHasherBusy(Exception):
+    """Raised when every hashing worker is busy and the wait queue is full"""
+
+def hasher_busy() -> HTTPException:
+    """503 for a request refused with PasswordHasherBusy"""
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password checks right now. Please try again.",
+        headers={"Retry-After": "1"}
+    )
+
+def _truncate(password: str) -> str:
+    password_bytes = password.encode('utf-8')
+    if len(password_bytes) > BCRYPT_MAX_BYTES:
+        return password_bytes[:BCRYPT_MAX_BYTES].decode('utf-8', errors='ignore')
+    return password
+
+def hash_password_sync(password: str) -> str:
+    """Hash a password on the calling thread (scripts and worker threads)"""
+    try:
+        return pwd_context.hash(_truncate(password))
+    except Exception as e:
+        logger.error(f"❌ Error hashing password: {e}")
+        raise ValueError(f"Failed to hash password: {str(e)}")
+
+def verify_and_update_sync(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Check a password on the calling thread. Returns (valid, new_hash); new_hash
+    is set when the stored hash uses another cost and should be replaced.
+    """
+    try:
+        return pwd_context.verify_and_update(_truncate(plain_password), hashed_password)
+    except Exception as e:
+        # Malformed hash, or one created from a password longer than 72 bytes
+        logger.warning(f"⚠️ Password verification failed: {e}")
+        return False, None
+
+async def _run(operation, func, *args):
+    if not _slots.acquire(blocking=False):
+        PASSWORD_REJECTED.inc()
+        raise PasswordHasherBusy("Too many concurrent password checks")
+    started = time.perf_counter()
+
+    def finished(_):
+        # Runs when the bcrypt job ends, on the worker thread. A request cancelled
+        # while waiting does not free its slot before the worker is done with it.
+        _slots.release()
+        PASSWORD_HASH_SECONDS.labels(operation=operation).observe(time.perf_counter() - started)
+
+    try:
+        fut = _executor.submit(func, *args)
+    except BaseException:
+        _slots.release()
+        raise
+    fut.add_done_callback(finished)
+    return await asyncio.wrap_future(fut)
+
+async def get_password_hash(password: str) -> str:
+    """Hash a password off the event loop (bcrypt max 72 bytes)"""
+    return await _run("hash", hash_password_sync, password)
+
+async def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """verify_and_update_sync() off the event loop"""
+    valid, new_hash = await _run("verify", verify_and_update_sync, plain_password, hashed_password)
+    if new_hash:
+        PASSWORD_REHASHES.inc()
+    return valid, new_hash
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password against its hash off the event loop"""
+    valid, _ = await _run("verify", verify_and_update_sync, plain_password, hashed_password)
+    return valid
@@ -0,0 +1,189 @@
+import logging
+import os
+import re
+import threading
+import time
+from contextvars import ContextVar
+
+from psycopg2 import extensions
+from app.utils.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Per-request SQL instrumentation. Every pooled connection hands out cursors that
+# time execute() into the current request's QueryStats. The middleware adds
+# them to the response as a Server-Timing header, logs chatty requests, and
+# flags the same statement shape repeated within one request (N+1).
+QUERY_STATS_ENABLED = os.getenv("DB_QUERY_STATS", "true").lower() == "true"
+# Add the Server-Timing header (visible in browser dev tools)
+QUERY_STATS_SERVER_TIMING = os.getenv("DB_QUERY_SERVER_TIMING", "true").lower() == "true"
+# Log every request's query summary, not only flagged ones
+QUERY_STATS_LOG_ALL = os.getenv("DB_QUERY_LOG_ALL", "false").lower() == "true"
+# A request is flagged when it exceeds any of these
+QUERY_STATS_WARN_COUNT = int(os.getenv("DB_QUERY_WARN_COUNT", 10))
+QUERY_STATS_WARN_MS = float(os.getenv("DB_QUERY_WARN_MS", 200))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("DB_N_PLUS_ONE_THRESHOLD", 3))
+
+# Transaction control is not a round trip worth optimizing away
+_CONTROL_STATEMENTS = re.compile(r"^\s*(BEGIN|COMMIT|ROLLBACK|SAVEPOINT|RELEASE)\b", re.IGNORECASE)
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+_current: ContextVar = ContextVar("query_stats", default=None)
+
+DB_QUERIES_PER_REQUEST = Histogram(
+    "http_request_db_queries", "Database queries per HTTP request", ("method", "route"),
+    buckets=(1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+)
+DB_SECONDS_PER_REQUEST = Histogram("http_request_db_seconds", "Database time per HTTP request", ("method", "route"))
+N_PLUS_ONE_REQUESTS = Counter(
+    "http_request_n_plus_one_total", "Requests that repeated a statement shape (possible N+1)", ("method", "route")
+)
+
+def statement_shape(query) -> str:
+    """The statement with literals replaced and whitespace collapsed, so repeats compare equal"""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    elif not isinstance(query, str):
+        query = str(query)  # psycopg2.sql.Composed
+    query = _STRING_LITERAL.sub("?", query)
+    query = _NUMBER_LITERAL.sub("?", query)
+    return _WHITESPACE.sub(" ", query).strip()
+
+class QueryStats:
+    """Queries issued while handling one request. record() may be called from run_db threads."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest_seconds = 0.0
+        self.slowest = None
+        self.shapes = {}  # raw query -> times seen; normalized when reported
+        self._lock = threading.Lock()
+
+    def record(self, query, seconds, calls=1):
+        with self._lock:
+            self.count += calls
+            self.seconds += seconds
+            if seconds > self.slowest_seconds:
+                self.slowest_seconds = seconds
+                self.slowest = query
+            self.shapes[query] = self.shapes.get(query, 0) + calls
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD):
+        """[(shape, times)] for statement shapes run at least `threshold` times, most frequent first"""
+        with self._lock:
+            shapes = list(self.shapes.items())
+        counts = {}
+        for query, times in shapes:
+            shape = statement_shape(query)
+            if not _CONTROL_STATEMENTS.match(shape):
+                counts[shape] = counts.get(shape, 0) + times
+        return sorted(((shape, times) for shape, times in counts.items() if times >= threshold), key=lambda item: -item[1])
+
+    def server_timing(self) -> str:
+        return (
+            f'db;dur={self.seconds * 1000:.1f};desc="{self.count} queries", '
+            f'db-slowest;dur={self.slowest_seconds * 1000:.1f}'
+        )
+
+def current_stats():
+    """QueryStats of the request being handled, or None outside a request"""
+    return _current.get()
+
+class _TimedCursorMixin:
+    def execute(self, query, vars=None):
+        stats = _current.get()
+        if stats is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            stats.record(query, time.perf_counter() - started)
+
+    def executemany(self, query, vars_list):
+        stats = _current.get()
+        if stats is None:
+            return super().executemany(query, vars_list)
+        vars_list = list(vars_list)
+        started = time.perf_counter()
+        try:
+            return super().executemany(query, vars_list)
+        finally:
+            # psycopg2 runs one statement per parameter set
+            stats.record(query, time.perf_counter() - started, calls=max(len(vars_list), 1))
+
+_timed_cursor_classes = {}
+
+def timed_cursor_class(base):
+    """`base` cursor class (RealDictCursor, ...) with timed execute()"""
+    timed = _timed_cursor_classes.get(base)
+    if timed is None:
+        timed = _timed_cursor_classes[base] = type(f"Timed{base.__name__}", (_TimedCursorMixin, base), {})
+    return timed
+
+class InstrumentedConnection(extensions.connection):
+    """psycopg2 connection whose cursors report to the current request's QueryStats"""
+
+    def cursor(self, name=None, cursor_factory=None, *args, **kwargs):
+        base = cursor_factory or self.cursor_factory or extensions.cursor
+        return super().cursor(name, timed_cursor_class(base), *args, **kwargs)
+
+class QueryStatsMiddleware:
+    """
+    ASGI middleware: collects QueryStats for each HTTP request, adds a
+    Server-Timing header and logs requests that are chatty, slow or repeat a
+    statement shape.
+    """
+
+    def __init__(self, app, server_timing=QUERY_STATS_SERVER_TIMING):
+        self.app = app
+        self.server_timing = server_timing
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not QUERY_STATS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats()
+        token = _current.set(stats)
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start" and self.server_timing and stats.count:
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", stats.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _current.reset(token)
+            if stats.count:
+                self._report(scope, stats)
+
+    def _report(self, scope, stats):
+        route = getattr(scope.get("route"), "path", None)
+        endpoint = f"{scope.get('method', '')} {route or scope.get('path', '')}"
+        repeated = stats.repeated()
+        labels = {"method": scope.get("method", ""), "route": route or "unmatched"}
+        DB_QUERIES_PER_REQUEST.labels(**labels).observe(stats.count)
+        DB_SECONDS_PER_REQUEST.labels(**labels).observe(stats.seconds)
+        if repeated:
+            N_PLUS_ONE_REQUESTS.labels(**labels).inc()
+
+        flagged = repeated or stats.count > QUERY_STATS_WARN_COUNT or stats.seconds * 1000 > QUERY_STATS_WARN_MS
+        if not (flagged or QUERY_STATS_LOG_ALL):
+            return
+        summary = (
+            f"{endpoint}: {stats.count} queries, {stats.seconds * 1000:.1f}ms in DB, "
+            f"slowest {stats.slowest_seconds * 1000:.1f}ms: {statement_shape(stats.slowest)[:200]}"
+        )
+        if not flagged:
+            logger.info(f"🗄️ {summary}")
+            return
+        logger.warning(f"🗄️ {summary}")
+        for shape, times in repeated[:3]:
+            logger.warning(f"🔁 Possible N+1 in {endpoint}: {times}x {shape[:200]}")
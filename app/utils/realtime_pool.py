@@ -0,0 +1,135 @@
+import asyncio
+import os
+import time
+
+# Pool of pre-connected OpenAI Realtime sessions for /voice/media-stream.
+# Sessions are opened and configured (session.update with the static system
+# prompt, acknowledged by session.updated) ahead of time, so a new call skips
+# the TLS/WebSocket handshake and session setup. A claimed session belongs to
+# that call and is never returned: it carries the call's conversation state.
+
+REALTIME_POOL_SIZE = int(os.getenv("VOICE_REALTIME_POOL_SIZE", 2))
+# Idle sessions older than this are closed and replaced; keep it well under the
+# Realtime API's maximum session duration so a claimed session has room for a call
+REALTIME_SESSION_TTL = float(os.getenv("VOICE_REALTIME_SESSION_TTL", 300))
+REALTIME_WARM_TIMEOUT = float(os.getenv("VOICE_REALTIME_WARM_TIMEOUT", 10))
+
+class RealtimeSessionPool:
+    """
+    Keeps up to `size` ready sessions. `open_session()` must return a connected,
+    configured WebSocket; the pool only tracks, recycles and hands them out.
+    """
+
+    def __init__(self, open_session, size=REALTIME_POOL_SIZE, ttl=REALTIME_SESSION_TTL):
+        self._open_session = open_session
+        self.size = max(0, size)
+        self.ttl = ttl
+        self._ready = []  # (created_at, websocket), oldest first
+        self._wakeup = asyncio.Event()
+        self._task = None
+        self._closed = False
+        self._metrics = {"hits": 0, "misses": 0, "warmed": 0, "expired": 0, "failed": 0}
+        self._warm_seconds = 0.0
+
+    async def start(self):
+        """Start filling the pool in the background (no-op when the pool size is 0)."""
+        if self.size and self._task is None:
+            self._closed = False
+            self._task = asyncio.create_task(self._maintain())
+
+    async def acquire(self):
+        """Claim a ready session, or return None so the caller connects the usual way."""
+        while self._ready:
+            created_at, websocket = self._ready.pop()  # newest first: most time left
+            if self._usable(created_at, websocket):
+                self._metrics["hits"] += 1
+                self._wakeup.set()
+                return websocket
+            await self._discard(websocket, "expired")
+        self._metrics["misses"] += 1
+        self._wakeup.set()
+        return None
+
+    def _usable(self, created_at, websocket):
+        return time.monotonic() - created_at < self.ttl and websocket.state.name == 'OPEN'
+
+    async def _discard(self, websocket, reason):
+        self._metrics[reason] += 1
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+
+    async def _warm_one(self):
+        started = time.monotonic()
+        try:
+            websocket = await asyncio.wait_for(self._open_session(), REALTIME_WARM_TIMEOUT)
+        except Exception as e:
+            self._metrics["failed"] += 1
+            print(f"⚠️ Could not pre-warm OpenAI Realtime session: {e}")
+            return False
+        if self._closed:
+            await websocket.close()
+            return False
+        self._ready.append((time.monotonic(), websocket))
+        self._metrics["warmed"] += 1
+        self._warm_seconds += time.monotonic() - started
+        return True
+
+    async def _maintain(self):
+        backoff = 1
+        while not self._closed:
+            # Recycle sessions that expired or were closed by the server while idle
+            fresh = []
+            for created_at, websocket in self._ready:
+                if self._usable(created_at, websocket):
+                    fresh.append((created_at, websocket))
+                else:
+                    await self._discard(websocket, "expired")
+            self._ready = fresh
+
+            missing = self.size - len(self._ready)
+            if missing > 0:
+                results = await asyncio.gather(*(self._warm_one() for _ in range(missing)))
+                if not all(results):
+                    # OpenAI unreachable or rejecting: retry later instead of spinning
+                    await asyncio.sleep(backoff)
+                    backoff = min(backoff * 2, 60)
+                    continue
+                backoff = 1
+
+            # Sleep until a session is claimed or the oldest one is due for recycling
+            next_expiry = min((created_at + self.ttl for created_at, _ in self._ready), default=None)
+            timeout = max(next_expiry - time.monotonic(), 0.1) if next_expiry else self.ttl
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def close(self):
+        """Stop refilling and close idle sessions."""
+        self._closed = True
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception:
+                pass
+            self._task = None
+        ready, self._ready = self._ready, []
+        for _, websocket in ready:
+            try:
+                await websocket.close()
+            except Exception:
+                pass
+
+    def metrics(self):
+        """hits/misses/warmed/expired/failed counters, ready sessions and mean warm-up time."""
+        snapshot = dict(self._metrics)
+        snapshot["ready"] = len(self._ready)
+        snapshot["size"] = self.size
+        snapshot["warm_avg_ms"] = round(self._warm_seconds / self._metrics["warmed"] * 1000, 1) if self._metrics["warmed"] else None
+        return snapshot
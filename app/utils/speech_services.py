@@ -1,47 +1,207 @@
 from google.cloud import texttospeech
+from google.api_core import exceptions as google_exceptions
 from azure.storage.blob import BlobServiceClient, ContentSettings
 from app.utils.azure_utils import get_google_cloud_service_account_from_key_vault
+from app.utils.tts_cache import TTS_CACHE_ENABLED, TTSCache, speech_key
+from app.utils.metrics import REGISTRY, Histogram, counters
 from google.oauth2.service_account import Credentials
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import asyncio
 import os
 import json
 import re
+import threading
+import time
+
+# The Google service account is read from Key Vault once and kept for
+# TTS_CREDENTIALS_TTL seconds (so a rotated key is picked up); the access tokens
+# it issues are refreshed by the Google client itself. Synthesis and upload are
+# blocking calls, so the async API runs them on a small dedicated thread pool.
+# Repeated phrases are served from a content-addressed cache (app/utils/tts_cache.py).
+TTS_CREDENTIALS_TTL = float(os.getenv("TTS_CREDENTIALS_TTL", 3600))
+TTS_WORKERS = int(os.getenv("TTS_WORKERS", 4))
+
+SPEECH_SECONDS = Histogram("tts_operation_seconds", "Text-to-speech synthesis and blob upload time", ("operation",))
 
 def get_credentials():
     service_account_info = json.loads(get_google_cloud_service_account_from_key_vault())
     credentials = Credentials.from_service_account_info(service_account_info)
     return credentials
 
-def synthesize_speech(text, language_code="en-US", voice_name="en-US-Wavenet-D"):
-    credentials = get_credentials()
-    client = texttospeech.TextToSpeechClient(credentials=credentials)
+class SpeechService:
+    """Long-lived Google TTS + Azure Blob Storage clients shared by every synthesis."""
+
+    def __init__(self, workers=TTS_WORKERS, credentials_ttl=TTS_CREDENTIALS_TTL, cache=None):
+        self.credentials_ttl = credentials_ttl
+        self.cache = cache
+        self._key_locks = {}  # key -> [lock, users]; one synthesis per phrase at a time
+        self._tts_lock = threading.Lock()
+        self._blob_lock = threading.Lock()
+        self._tts_client = None
+        self._credentials_expire_at = 0
+        self._blob_service_client = None
+        self._executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="tts")
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "requests": 0, "failed": 0, "credential_refreshes": 0,
+            "synthesis_count": 0, "synthesis_seconds": 0.0, "synthesis_max_seconds": 0.0,
+            "upload_count": 0, "upload_seconds": 0.0, "upload_max_seconds": 0.0
+        }
+
+    def _tts(self, refresh=False):
+        with self._tts_lock:
+            if refresh or self._tts_client is None or time.monotonic() >= self._credentials_expire_at:
+                self._tts_client = texttospeech.TextToSpeechClient(credentials=get_credentials())
+                self._credentials_expire_at = time.monotonic() + self.credentials_ttl
+                self._count("credential_refreshes")
+            return self._tts_client
+
+    def _blob_service(self):
+        with self._blob_lock:
+            if self._blob_service_client is None:
+                self._blob_service_client = BlobServiceClient.from_connection_string(
+                    os.getenv('BYTHEAPP_AZURE_STORAGE_CONNECTION_STRING')
+                )
+            return self._blob_service_client
+
+    def _count(self, metric, amount=1):
+        with self._metrics_lock:
+            self._metrics[metric] += amount
+
+    def _timed(self, metric, seconds):
+        SPEECH_SECONDS.labels(operation=metric).observe(seconds)
+        with self._metrics_lock:
+            self._metrics[f"{metric}_count"] += 1
+            self._metrics[f"{metric}_seconds"] += seconds
+            self._metrics[f"{metric}_max_seconds"] = max(self._metrics[f"{metric}_max_seconds"], seconds)
 
-    # Configure the request
-    synthesis_input = texttospeech.SynthesisInput(text=text)
-    voice = texttospeech.VoiceSelectionParams(language_code=language_code, name=voice_name)
-    audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
+    def synthesize_audio(self, text, language_code="en-US", voice_name="en-US-Wavenet-D"):
+        """Return MP3 bytes for `text` (blocking)."""
+        synthesis_input = texttospeech.SynthesisInput(text=text)
+        voice = texttospeech.VoiceSelectionParams(language_code=language_code, name=voice_name)
+        audio_config = texttospeech.AudioConfig(audio_encoding=texttospeech.AudioEncoding.MP3)
 
-    # Synthesize speech
-    response = client.synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+        started = time.perf_counter()
+        try:
+            response = self._tts().synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+        except (google_exceptions.Unauthenticated, google_exceptions.PermissionDenied):
+            # The service account key may have been rotated: reload it once
+            response = self._tts(refresh=True).synthesize_speech(input=synthesis_input, voice=voice, audio_config=audio_config)
+        self._timed("synthesis", time.perf_counter() - started)
+        return response.audio_content
 
-    # Handle Azure blob Storage upload
-    blob_service_client = BlobServiceClient.from_connection_string(os.getenv('BYTHEAPP_AZURE_STORAGE_CONNECTION_STRING'))
-    container_name = os.getenv('AZURE_STORAGE_VOICE_CONTAINER')  # Using environment variable for container name
+    def _blob_client(self, blob_name):
+        container_name = os.getenv('AZURE_STORAGE_VOICE_CONTAINER')
+        return self._blob_service().get_blob_client(container=container_name, blob=blob_name)
 
-    sanitized_text = re.sub(r'[^a-zA-Z0-9]', '', text[:10])
+    def blob_url(self, blob_name):
+        # Assuming the container is configured to allow public access
+        container_name = os.getenv('AZURE_STORAGE_VOICE_CONTAINER')
+        return f"https://{self._blob_service().account_name}.blob.core.windows.net/{container_name}/{blob_name}"
 
-    # Generate a unique filename for the audio file
-    blob_name = f"{sanitized_text}-{os.urandom(4).hex()}.mp3"
-    
-    # Get the blob client for uploading the file
-    blob_client = blob_service_client.get_blob_client(container=container_name, blob=blob_name)
+    def upload_audio(self, audio_content, blob_name):
+        """Upload MP3 bytes to the voice container and return the public URL (blocking)."""
+        started = time.perf_counter()
+        self._blob_client(blob_name).upload_blob(
+            audio_content, overwrite=True, content_settings=ContentSettings(content_type='audio/mpeg')
+        )
+        self._timed("upload", time.perf_counter() - started)
+        return self.blob_url(blob_name)
 
-    # Ensure to set the correct content settings for MP3
-    content_settings = ContentSettings(content_type='audio/mpeg')
+    @contextmanager
+    def _phrase_lock(self, key):
+        with self._metrics_lock:
+            entry = self._key_locks.setdefault(key, [threading.Lock(), 0])
+            entry[1] += 1
+        try:
+            with entry[0]:
+                yield
+        finally:
+            with self._metrics_lock:
+                entry[1] -= 1
+                if not entry[1]:
+                    self._key_locks.pop(key, None)
 
-    # Upload the audio content to Azure Blob Storage
-    blob_client.upload_blob(response.audio_content, overwrite=True, content_settings=content_settings)
+    def _synthesize_cached(self, text, language_code, voice_name):
+        key = speech_key(text, language_code, voice_name)
+        blob_name = f"tts/{key}.mp3"
+        if self.cache.lookup(key):
+            return self.blob_url(blob_name)
 
-    # Assuming the container is configured to allow public access
-    audio_url = f"https://{blob_service_client.account_name}.blob.core.windows.net/{container_name}/{blob_name}"
+        # Concurrent requests for the same phrase wait for the first one
+        with self._phrase_lock(key):
+            if self.cache.lookup(key):
+                return self.blob_url(blob_name)
+            if self._blob_client(blob_name).exists():
+                self.cache.record_blob_hit(key)
+                return self.blob_url(blob_name)
+            audio_content = self.synthesize_audio(text, language_code, voice_name)
+            url = self.upload_audio(audio_content, blob_name)
+            self.cache.store(key)
+            return url
+
+    def synthesize(self, text, language_code="en-US", voice_name="en-US-Wavenet-D"):
+        """Synthesize `text`, upload it and return the audio URL (blocking)."""
+        self._count("requests")
+        try:
+            if self.cache is not None:
+                return self._synthesize_cached(text, language_code, voice_name)
+            audio_content = self.synthesize_audio(text, language_code, voice_name)
+            sanitized_text = re.sub(r'[^a-zA-Z0-9]', '', text[:10])
+            return self.upload_audio(audio_content, f"{sanitized_text}-{os.urandom(4).hex()}.mp3")
+        except Exception:
+            self._count("failed")
+            raise
+
+    async def synthesize_async(self, text, language_code="en-US", voice_name="en-US-Wavenet-D"):
+        """synthesize() on the TTS thread pool, so the event loop keeps serving calls."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.synthesize, text, language_code, voice_name)
+
+    def metrics(self):
+        """Request/failure/credential-refresh counters, synthesis/upload timings in ms and cache tiers."""
+        with self._metrics_lock:
+            m = dict(self._metrics)
+        snapshot = {
+            "requests": m["requests"],
+            "failed": m["failed"],
+            "credential_refreshes": m["credential_refreshes"],
+            "synthesis_avg_ms": round(m["synthesis_seconds"] / max(m["synthesis_count"], 1) * 1000, 1),
+            "synthesis_max_ms": round(m["synthesis_max_seconds"] * 1000, 1),
+            "upload_avg_ms": round(m["upload_seconds"] / max(m["upload_count"], 1) * 1000, 1),
+            "upload_max_ms": round(m["upload_max_seconds"] * 1000, 1)
+        }
+        if self.cache is not None:
+            snapshot["cache"] = self.cache.metrics()
+        return snapshot
+
+    def collect_metrics(self):
+        """metrics() counters and cache tiers as Prometheus families (Registry.register_collector)"""
+        snapshot = self.metrics()
+        families = [
+            counters("tts_events_total", "Speech requests, failures and credential refreshes", snapshot,
+                     ("requests", "failed", "credential_refreshes")),
+        ]
+        cache = snapshot.get("cache")
+        if cache is not None:
+            families += [
+                counters("tts_cache_lookups_total", "Speech cache lookups by the tier that answered", cache,
+                         ("memory_hits", "disk_hits", "blob_hits", "misses"), label="result"),
+                ("tts_cache_evictions_total", "counter", "Keys evicted from the disk tier", [({}, cache["evicted"])]),
+                ("tts_cache_items", "gauge", "Cached clips per tier",
+                 [({"tier": "memory"}, cache["memory_items"]), ({"tier": "disk"}, cache["disk_items"])]),
+            ]
+        return families
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+speech_service = SpeechService(cache=TTSCache() if TTS_CACHE_ENABLED else None)
+REGISTRY.register_collector(speech_service.collect_metrics)
+
+def synthesize_speech(text, language_code="en-US", voice_name="en-US-Wavenet-D"):
+    return speech_service.synthesize(text, language_code, voice_name)
 
-    return audio_url
+async def synthesize_speech_async(text, language_code="en-US", voice_name="en-US-Wavenet-D"):
+    return await speech_service.synthesize_async(text, language_code, voice_name)
@@ -0,0 +1,25 @@
+import os
+from app.utils.cache import TTLCache
+from app.utils.db import run_db
+
+# Stats are read from trigger-maintained rollup tables (sql_files/add_stats_rollups.sql)
+# and additionally cached per process for this many seconds; 0 disables the cache.
+STATS_CACHE_TTL = float(os.getenv("STATS_CACHE_TTL", 30))
+
+_stats_cache = TTLCache(ttl=STATS_CACHE_TTL, max_size=256)
+
+async def cached_stats(key, loader, *args):
+    """Serve a stats helper from cache, running it off the event loop on a miss"""
+    cache_key = (key, *args)
+    value = _stats_cache.get(cache_key)
+    if value is None:
+        value = await run_db(loader, *args)
+        _stats_cache.set(cache_key, value)
+    return value
+
+def invalidate_stats(key=None):
+    """Drop cached stats for one key (all argument variants), or everything"""
+    if key is None:
+        _stats_cache.clear()
+    else:
+        _stats_cache.invalidate_where(lambda cache_key: cache_key[0] == key)
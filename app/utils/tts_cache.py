@@ -0,0 +1,129 @@
+import hashlib
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Content-addressed cache for synthesized speech. An utterance is identified by
+# hash(text, language_code, voice_name); its blob is stored under that hash, so
+# the same phrase always maps to the same URL. Lookups go memory -> local disk ->
+# blob storage, and only a miss in all three synthesizes and uploads. The local
+# tiers only remember which keys are uploaded; the audio is served by URL.
+TTS_CACHE_ENABLED = os.getenv("TTS_CACHE_ENABLED", "true").lower() == "true"
+TTS_CACHE_MEMORY_ITEMS = int(os.getenv("TTS_CACHE_MEMORY_ITEMS", 1024))
+TTS_CACHE_DIR = os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "tts-cache"))
+TTS_CACHE_DISK_ITEMS = int(os.getenv("TTS_CACHE_DISK_ITEMS", 100000))
+# Bump when the audio settings change so old blobs are not reused
+TTS_CACHE_VERSION = "mp3-v1"
+
+def speech_key(text, language_code, voice_name):
+    """Hex digest identifying one utterance"""
+    digest = hashlib.sha256()
+    for part in (TTS_CACHE_VERSION, language_code, voice_name, text):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class TTSCache:
+    """
+    Local tiers in front of blob storage: an in-memory LRU of known keys and an
+    LRU directory of empty `<key>.key` files bounded by `disk_items`, so known
+    keys survive restarts. A key is only added after its blob exists, so a hit
+    means the URL can be returned as is.
+    """
+
+    def __init__(self, directory=TTS_CACHE_DIR, memory_items=TTS_CACHE_MEMORY_ITEMS, disk_items=TTS_CACHE_DISK_ITEMS):
+        self.directory = directory
+        self.memory_items = memory_items
+        self.disk_items = disk_items
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()  # key -> None, most recently used last
+        self._disk = OrderedDict()    # key -> None, most recently used last
+        self._metrics = {"memory_hits": 0, "disk_hits": 0, "blob_hits": 0, "misses": 0, "evicted": 0}
+        self._load_disk_index()
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.key")
+
+    def _load_disk_index(self):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            entries = []
+            for name in os.listdir(self.directory):
+                path = os.path.join(self.directory, name)
+                if name.endswith(".key"):
+                    entries.append((os.stat(path).st_mtime, name[:-4]))
+                elif name.endswith((".mp3", ".tmp")):
+                    os.remove(path)  # audio kept by older versions, never read
+        except OSError as e:
+            print(f"⚠️ TTS disk cache unavailable ({self.directory}): {e}")
+            self.disk_items = 0
+            return
+        for _, key in sorted(entries):
+            self._disk[key] = None
+        with self._lock:
+            self._evict_disk()
+
+    def _remember(self, key):
+        self._memory[key] = None
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        while len(self._disk) > self.disk_items:
+            key, _ = self._disk.popitem(last=False)
+            self._metrics["evicted"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def lookup(self, key):
+        """True if the key's blob is known to exist (memory or disk hit)."""
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                self._metrics["memory_hits"] += 1
+                return True
+            if key in self._disk:
+                self._disk.move_to_end(key)
+                self._remember(key)
+                self._metrics["disk_hits"] += 1
+                try:
+                    os.utime(self._path(key))  # keep LRU order across restarts
+                except OSError:
+                    pass
+                return True
+        return False
+
+    def record_blob_hit(self, key):
+        """The blob already existed in storage (uploaded by another replica or earlier)."""
+        with self._lock:
+            self._remember(key)
+            self._metrics["blob_hits"] += 1
+
+    def store(self, key):
+        """Record a freshly uploaded utterance in both local tiers."""
+        with self._lock:
+            self._remember(key)
+            self._metrics["misses"] += 1
+        if not self.disk_items:
+            return
+        try:
+            # An empty file: nothing partial can be left behind
+            open(self._path(key), "a").close()
+        except OSError as e:
+            print(f"⚠️ Could not write TTS cache file: {e}")
+            return
+        with self._lock:
+            self._disk[key] = None
+            self._disk.move_to_end(key)
+            self._evict_disk()
+
+    def metrics(self):
+        with self._lock:
+            snapshot = dict(self._metrics)
+            snapshot["memory_items"] = len(self._memory)
+            snapshot["disk_items"] = len(self._disk)
+        return snapshot
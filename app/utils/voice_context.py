@@ -0,0 +1,163 @@
+import os
+import json
+import time
+import select
+import logging
+import threading
+import psycopg2
+from app.utils.cache import TTLCache
+from app.utils.db import fetch_available_slots, fetch_dentists, open_dedicated_connection, run_db
+from app.utils.booking import build_context_text
+
+logger = logging.getLogger(__name__)
+
+# The availability/dentist RAG message injected at the start of every call is
+# rendered once and cached. Writes in this process invalidate it directly;
+# writes elsewhere (Kafka consumer, other replicas, SQL) arrive through
+# LISTEN availability_context (sql_files/add_availability_context_notify.sql).
+# A background thread rebuilds the message after each change, so call setup
+# normally sends a precomputed string without touching Postgres.
+AVAILABILITY_CONTEXT_CHANNEL = "availability_context"
+AVAILABILITY_CONTEXT_LIMIT = 5
+# Safety net in case a notification is missed
+VOICE_CONTEXT_TTL = float(os.getenv("VOICE_CONTEXT_TTL", 300))
+VOICE_CONTEXT_LISTEN = os.getenv("VOICE_CONTEXT_LISTEN", "true").lower() == "true"
+# Bulk writes send bursts of notifications; wait this long and rebuild once
+VOICE_CONTEXT_DEBOUNCE = float(os.getenv("VOICE_CONTEXT_DEBOUNCE", 0.2))
+
+_context_cache = TTLCache(ttl=VOICE_CONTEXT_TTL, max_size=16)
+_generation = 0
+_generation_lock = threading.Lock()
+_loaded_limits = {AVAILABILITY_CONTEXT_LIMIT}
+_refresh_requested = threading.Event()
+_stopping = threading.Event()
+_refresher = None
+
+def render_availability_context(limit=AVAILABILITY_CONTEXT_LIMIT) -> str:
+    """Query open slots and dentists and render the system message, serialized and ready to send"""
+    slots = fetch_available_slots(limit=limit)
+    if slots:
+        availability_text = build_context_text(slots)
+    else:
+        availability_text = "Currently no available appointments."
+
+    dentists = fetch_dentists()
+    if dentists:
+        dentist_info = "\n".join([f"{d['name']} ({d['specialty']})" for d in dentists])
+    else:
+        dentist_info = "No dentists found."
+
+    context_text = f"Available appointments:\n{availability_text}\n\nDentists in this office:\n{dentist_info}"
+
+    context_message = {
+        "type": "conversation.item.create",
+        "item": {
+            "type": "message",
+            "role": "system",
+            "content": [
+                {
+                    "type": "input_text",
+                    "text": (
+                        f"Here are the available appointments:\n{context_text}\n\n"
+                        "When booking an appointment, always ask for the patient's full name "
+                        "if it has not been provided. Use this name when saving the appointment."
+                    )
+                }
+            ]
+        }
+    }
+    return json.dumps(context_message)
+
+def _load(limit):
+    generation = _generation
+    message = render_availability_context(limit)
+    with _generation_lock:
+        # Don't cache a result that an invalidation overtook while it was loading
+        if generation == _generation:
+            _context_cache.set(limit, message)
+    _loaded_limits.add(limit)
+    return message
+
+async def get_availability_context(limit=AVAILABILITY_CONTEXT_LIMIT) -> str:
+    """The cached availability message, rendered off the event loop on a miss"""
+    message = _context_cache.get(limit)
+    if message is None:
+        message = await run_db(_load, limit)
+    return message
+
+def invalidate_availability_context():
+    """Drop the cached message after an availability, appointment or dentist write"""
+    global _generation
+    with _generation_lock:
+        _generation += 1
+        _context_cache.clear()
+    _refresh_requested.set()
+
+def _listen():
+    connection = open_dedicated_connection()
+    with connection.cursor() as cur:
+        cur.execute(f"LISTEN {AVAILABILITY_CONTEXT_CHANNEL}")
+    return connection
+
+def _refresh_loop():
+    listen_conn = None
+    retry_at = 0
+    backoff = 1
+    while not _stopping.is_set():
+        if VOICE_CONTEXT_LISTEN and listen_conn is None and time.monotonic() >= retry_at:
+            try:
+                listen_conn = _listen()
+                backoff = 1
+                # Changes made while we were not listening were missed
+                invalidate_availability_context()
+            except psycopg2.Error as e:
+                logger.warning(f"⚠️ Could not LISTEN for availability changes (retrying in {backoff}s): {e}")
+                retry_at = time.monotonic() + backoff
+                backoff = min(backoff * 2, 60)
+
+        if listen_conn is not None:
+            try:
+                if select.select([listen_conn], [], [], 1.0)[0]:
+                    listen_conn.poll()
+                    if listen_conn.notifies:
+                        listen_conn.notifies.clear()
+                        invalidate_availability_context()
+            except (psycopg2.Error, OSError, ValueError) as e:
+                logger.warning(f"⚠️ Lost availability LISTEN connection: {e}")
+                try:
+                    listen_conn.close()
+                except psycopg2.Error:
+                    pass
+                listen_conn = None
+        else:
+            _refresh_requested.wait(1.0)
+
+        if _refresh_requested.is_set() and not _stopping.is_set():
+            _stopping.wait(VOICE_CONTEXT_DEBOUNCE)
+            _refresh_requested.clear()
+            for limit in list(_loaded_limits):
+                try:
+                    _load(limit)
+                except Exception as e:
+                    logger.error(f"❌ Failed to rebuild availability context: {e}")
+
+    if listen_conn is not None:
+        listen_conn.close()
+
+def start_context_refresher():
+    """Start the background thread that listens for changes and rebuilds the context"""
+    global _refresher
+    if _refresher is not None and _refresher.is_alive():
+        return
+    _stopping.clear()
+    _refresh_requested.set()  # build the default context at startup
+    _refresher = threading.Thread(target=_refresh_loop, name="voice-context-refresher", daemon=True)
+    _refresher.start()
+
+def stop_context_refresher(timeout=5):
+    global _refresher
+    _stopping.set()
+    _refresh_requested.set()
+    if _refresher is not None:
+        _refresher.join(timeout)
+        _refresher = None
@@ -5,10 +5,8 @@ This script resets the admin password to a new valid password
 """
 
 import sys
-from passlib.context import CryptContext
 from app.utils.db import conn
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from app.utils.passwords import hash_password_sync
 
 def reset_admin_password(new_password: str):
     """Reset the admin user's password"""
@@ -22,8 +20,8 @@ def reset_admin_password(new_password: str):
         print("❌ Error: Password must be at least 8 characters")
         return False
     
-    # Hash the new password
-    hashed_password = pwd_context.hash(new_password)
+    # Hash the new password (same cost as the API, AUTH_BCRYPT_ROUNDS)
+    hashed_password = hash_password_sync(new_password)
     
     # Update in database
     try:
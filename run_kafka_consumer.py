@@ -5,6 +5,7 @@ Run this as a separate service to process AI responses from Kafka.
 """
 
 import os
+import signal
 import sys
 import logging
 from pathlib import Path
@@ -14,6 +15,7 @@ project_root = Path(__file__).parent
 sys.path.insert(0, str(project_root))
 
 from app.utils.kafka_consumer import AIResponseConsumer
+from app.utils.metrics import REGISTRY, start_http_server
 
 # Configure logging
 logging.basicConfig(
@@ -27,6 +29,9 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+# Prometheus scrape port for this service; 0 disables it
+METRICS_PORT = int(os.getenv("KAFKA_CONSUMER_METRICS_PORT", 9102))
+
 def main():
     """Main function to start the Kafka consumer."""
     logger.info("🚀 Starting Kafka Consumer Service...")
@@ -50,6 +55,11 @@ def main():
         consumer = AIResponseConsumer()
         if consumer.consumer:
             logger.info("✅ Consumer initialized successfully")
+            if METRICS_PORT:
+                REGISTRY.register_collector(consumer.collect_metrics)
+                start_http_server(METRICS_PORT)
+            # Stop polling, drain the workers and commit on shutdown
+            signal.signal(signal.SIGTERM, lambda signum, frame: consumer.stop())
             consumer.start_consuming()
         else:
             logger.error("❌ Failed to initialize consumer")
@@ -0,0 +1,21 @@
+-- Indexes for keyset (cursor) pagination of appointment lists
+-- Pages are ordered by (appointment_date, appointment_time, id) and continue with
+-- WHERE (appointment_date, appointment_time, id) > (cursor values)
+
+-- GET /api/appointments
+CREATE INDEX IF NOT EXISTS idx_appointments_date_time_id
+ON appointments (appointment_date, appointment_time, id);
+
+-- GET /api/dashboard/appointments/today (active appointments only)
+CREATE INDEX IF NOT EXISTS idx_appointments_active_date_time_id
+ON appointments (appointment_date, appointment_time, id)
+WHERE status NOT IN ('cancelled', 'rescheduled', 'completed', 'no_show');
+
+-- Keep planner estimates used by count=estimated fresh
+ANALYZE appointments;
+
+-- Verify the indexes
+SELECT indexname, indexdef
+FROM pg_indexes
+WHERE tablename = 'appointments'
+AND indexname LIKE 'idx_appointments_%date_time_id';
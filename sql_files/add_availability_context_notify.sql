@@ -0,0 +1,33 @@
+-- Notify listeners when anything in the voice assistant's availability context changes
+-- The API caches the rendered availability/dentist context (app/utils/voice_context.py)
+-- and rebuilds it on NOTIFY availability_context, so writes from the Kafka consumer,
+-- other replicas or manual SQL reach every process without polling.
+-- Run after add_availability_slots.sql; safe to re-run
+
+CREATE OR REPLACE FUNCTION notify_availability_context()
+RETURNS TRIGGER AS $$
+BEGIN
+    -- Sent on commit; identical notifications in one transaction are collapsed
+    PERFORM pg_notify('availability_context', TG_TABLE_NAME);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level: one notification per statement, however many slot rows it touches
+DROP TRIGGER IF EXISTS availability_slots_context_notify ON availability_slots;
+CREATE TRIGGER availability_slots_context_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON availability_slots
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_availability_context();
+
+-- Dentist names and specialties are part of the context
+DROP TRIGGER IF EXISTS dentists_context_notify ON dentists;
+CREATE TRIGGER dentists_context_notify
+    AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON dentists
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_availability_context();
+
+-- Verify the triggers
+SELECT tgname, tgrelid::regclass AS table_name
+FROM pg_trigger
+WHERE tgname IN ('availability_slots_context_notify', 'dentists_context_notify');
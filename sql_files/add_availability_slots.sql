@@ -0,0 +1,83 @@
+-- Move availability time slots from the availability.time_slots JSONB array to one row per slot
+-- Booking becomes a single conditional UPDATE on one row instead of rewriting the whole day's array
+-- Run after setup_availability_table.sql; safe to re-run
+
+-- Create availability_slots table if it doesn't exist
+CREATE TABLE IF NOT EXISTS availability_slots (
+    id SERIAL PRIMARY KEY,
+    availability_id INTEGER NOT NULL REFERENCES availability(id) ON DELETE CASCADE,
+    dentist_id INTEGER NOT NULL REFERENCES dentists(id) ON DELETE CASCADE,
+    date DATE NOT NULL,
+    start_time TIME NOT NULL,
+    end_time TIME NOT NULL,
+    available BOOLEAN NOT NULL DEFAULT TRUE,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(dentist_id, date, start_time),
+    CHECK (end_time > start_time)
+);
+
+-- Rebuilding a day's time_slots array
+CREATE INDEX IF NOT EXISTS idx_availability_slots_availability_id ON availability_slots(availability_id, start_time);
+
+-- Open-slot lookups (voice assistant context, available-only searches)
+CREATE INDEX IF NOT EXISTS idx_availability_slots_open ON availability_slots(date, start_time) WHERE available;
+
+-- Backfill from the JSONB column
+INSERT INTO availability_slots (availability_id, dentist_id, date, start_time, end_time, available)
+SELECT
+    a.id,
+    a.dentist_id,
+    a.date,
+    (slot->>'start')::time,
+    (slot->>'end')::time,
+    COALESCE((slot->>'available')::boolean, TRUE)
+FROM availability a
+CROSS JOIN jsonb_array_elements(a.time_slots) AS slot
+ON CONFLICT (dentist_id, date, start_time) DO NOTHING;
+
+-- The JSONB column is no longer written by the API; empty it so it cannot drift
+-- (past dates are left alone because of chk_availability_date)
+UPDATE availability SET time_slots = '[]'::jsonb
+WHERE time_slots <> '[]'::jsonb AND date >= CURRENT_DATE;
+
+COMMENT ON COLUMN availability.time_slots IS
+    'Deprecated: slots are stored in availability_slots (see add_availability_slots.sql)';
+
+-- Point the slot views at the new table
+CREATE OR REPLACE VIEW available_slots_view AS
+SELECT
+    a.id,
+    a.dentist_id,
+    d.name as dentist_name,
+    a.date,
+    jsonb_build_object(
+        'start', to_char(s.start_time, 'HH24:MI'),
+        'end', to_char(s.end_time, 'HH24:MI'),
+        'available', s.available
+    ) as time_slot
+FROM availability a
+JOIN dentists d ON a.dentist_id = d.id
+JOIN availability_slots s ON s.availability_id = a.id
+WHERE s.available;
+
+CREATE OR REPLACE VIEW booked_slots_view AS
+SELECT
+    a.id,
+    a.dentist_id,
+    d.name as dentist_name,
+    a.date,
+    jsonb_build_object(
+        'start', to_char(s.start_time, 'HH24:MI'),
+        'end', to_char(s.end_time, 'HH24:MI'),
+        'available', s.available
+    ) as time_slot
+FROM availability a
+JOIN dentists d ON a.dentist_id = d.id
+JOIN availability_slots s ON s.availability_id = a.id
+WHERE NOT s.available;
+
+-- Verify the migration
+SELECT
+    (SELECT COUNT(*) FROM availability) as availability_records,
+    (SELECT COUNT(*) FROM availability_slots) as slot_rows,
+    (SELECT COUNT(*) FROM availability_slots WHERE available) as open_slots;
@@ -0,0 +1,19 @@
+-- Caller-ID lookup indexes
+-- /voice/incoming-call looks up the caller's patient record and recent appointments by
+-- the last 10 digits of the phone number (Twilio sends E.164, stored numbers are free-form).
+-- These expression indexes must match CALLER_ID_DIGITS_SQL in app/utils/db.py exactly.
+-- Safe to re-run
+
+CREATE INDEX IF NOT EXISTS idx_patients_phone_digits
+    ON patients ((right(regexp_replace(phone, '\D', '', 'g'), 10)));
+
+CREATE INDEX IF NOT EXISTS idx_appointments_phone_digits
+    ON appointments ((right(regexp_replace(phone, '\D', '', 'g'), 10)), appointment_date DESC, appointment_time DESC);
+
+ANALYZE patients;
+ANALYZE appointments;
+
+-- Verify the indexes
+SELECT indexname, indexdef
+FROM pg_indexes
+WHERE indexname IN ('idx_patients_phone_digits', 'idx_appointments_phone_digits');
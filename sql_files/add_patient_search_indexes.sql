@@ -0,0 +1,27 @@
+-- Trigram indexes for patient search
+-- Lets GET /api/patients?search=... use an index for ILIKE '%term%' (search_mode=contains)
+-- and for ranked typo-tolerant matching (search_mode=fuzzy)
+
+-- Enable pg_trgm (available on Azure Database for PostgreSQL; allow-list it if required)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+CREATE INDEX IF NOT EXISTS idx_patients_name_trgm ON patients USING GIN (name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_email_trgm ON patients USING GIN (email gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_patients_phone_trgm ON patients USING GIN (phone gin_trgm_ops);
+
+-- Default listing order (newest first) without a sort
+CREATE INDEX IF NOT EXISTS idx_patients_created_at_id ON patients (created_at DESC, id DESC);
+
+-- Keep planner estimates used by count=estimated fresh
+ANALYZE patients;
+
+-- Verify the indexes
+SELECT indexname, indexdef
+FROM pg_indexes
+WHERE tablename = 'patients'
+AND indexname IN (
+    'idx_patients_name_trgm',
+    'idx_patients_email_trgm',
+    'idx_patients_phone_trgm',
+    'idx_patients_created_at_id'
+);
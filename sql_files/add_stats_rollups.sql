@@ -0,0 +1,241 @@
+-- Incrementally maintained statistics for the dashboard and /stats endpoints
+-- Triggers keep small rollup tables in step with appointments, patients and availability,
+-- so the stats queries read a handful of rollup rows instead of scanning the base tables.
+-- Run after add_availability_slots.sql; safe to re-run (rollups are rebuilt from scratch)
+
+BEGIN;
+
+-- Block writes while triggers are installed and the rollups are backfilled
+LOCK TABLE appointments, patients, availability, availability_slots IN SHARE ROW EXCLUSIVE MODE;
+
+-- ---------------------------------------------------------------------------
+-- Appointments: one row per (day, dentist, status, treatment)
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS appointment_daily_stats (
+    appointment_date DATE NOT NULL,
+    dentist_id INTEGER NOT NULL,
+    status VARCHAR(50) NOT NULL,      -- '' when the appointment has no status
+    treatment VARCHAR(255) NOT NULL,  -- '' when the appointment has no treatment
+    appointment_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (appointment_date, dentist_id, status, treatment)
+);
+
+CREATE INDEX IF NOT EXISTS idx_appointment_daily_stats_status ON appointment_daily_stats(status, appointment_date);
+CREATE INDEX IF NOT EXISTS idx_appointment_daily_stats_dentist ON appointment_daily_stats(dentist_id);
+
+CREATE OR REPLACE FUNCTION apply_appointment_daily_stats(
+    p_date DATE, p_dentist_id INTEGER, p_status VARCHAR, p_treatment VARCHAR, p_delta INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO appointment_daily_stats (appointment_date, dentist_id, status, treatment, appointment_count)
+    VALUES (p_date, p_dentist_id, COALESCE(p_status, ''), COALESCE(p_treatment, ''), p_delta)
+    ON CONFLICT (appointment_date, dentist_id, status, treatment)
+    DO UPDATE SET appointment_count = appointment_daily_stats.appointment_count + EXCLUDED.appointment_count;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION update_appointment_daily_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE'
+       AND OLD.appointment_date = NEW.appointment_date
+       AND OLD.dentist_id = NEW.dentist_id
+       AND OLD.status IS NOT DISTINCT FROM NEW.status
+       AND OLD.treatment IS NOT DISTINCT FROM NEW.treatment THEN
+        RETURN NULL;
+    END IF;
+
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_appointment_daily_stats(OLD.appointment_date, OLD.dentist_id, OLD.status, OLD.treatment, -1);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_appointment_daily_stats(NEW.appointment_date, NEW.dentist_id, NEW.status, NEW.treatment, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS appointment_daily_stats_trigger ON appointments;
+CREATE TRIGGER appointment_daily_stats_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF appointment_date, dentist_id, status, treatment ON appointments
+    FOR EACH ROW
+    EXECUTE FUNCTION update_appointment_daily_stats();
+
+TRUNCATE appointment_daily_stats;
+INSERT INTO appointment_daily_stats (appointment_date, dentist_id, status, treatment, appointment_count)
+SELECT appointment_date, dentist_id, COALESCE(status, ''), COALESCE(treatment, ''), COUNT(*)
+FROM appointments
+GROUP BY appointment_date, dentist_id, COALESCE(status, ''), COALESCE(treatment, '');
+
+-- ---------------------------------------------------------------------------
+-- Patients: counts per status, and per day for sign-ups / next appointments
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS patient_status_stats (
+    status VARCHAR(50) PRIMARY KEY,
+    patient_count INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS patient_daily_stats (
+    stat_date DATE NOT NULL,
+    metric VARCHAR(20) NOT NULL,  -- 'created' or 'next_appointment'
+    patient_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (metric, stat_date)
+);
+
+CREATE OR REPLACE FUNCTION apply_patient_daily_stats(p_metric VARCHAR, p_date DATE, p_delta INTEGER)
+RETURNS VOID AS $$
+BEGIN
+    IF p_date IS NULL THEN
+        RETURN;
+    END IF;
+    INSERT INTO patient_daily_stats (metric, stat_date, patient_count)
+    VALUES (p_metric, p_date, p_delta)
+    ON CONFLICT (metric, stat_date)
+    DO UPDATE SET patient_count = patient_daily_stats.patient_count + EXCLUDED.patient_count;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION update_patient_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF TG_OP = 'DELETE' OR OLD.status IS DISTINCT FROM NEW.status THEN
+            UPDATE patient_status_stats SET patient_count = patient_count - 1 WHERE status = OLD.status;
+        END IF;
+        IF TG_OP = 'DELETE' OR OLD.created_at::date IS DISTINCT FROM NEW.created_at::date THEN
+            PERFORM apply_patient_daily_stats('created', OLD.created_at::date, -1);
+        END IF;
+        IF TG_OP = 'DELETE' OR OLD.next_appointment IS DISTINCT FROM NEW.next_appointment THEN
+            PERFORM apply_patient_daily_stats('next_appointment', OLD.next_appointment, -1);
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        IF TG_OP = 'INSERT' OR OLD.status IS DISTINCT FROM NEW.status THEN
+            INSERT INTO patient_status_stats (status, patient_count)
+            VALUES (NEW.status, 1)
+            ON CONFLICT (status) DO UPDATE SET patient_count = patient_status_stats.patient_count + 1;
+        END IF;
+        IF TG_OP = 'INSERT' OR OLD.created_at::date IS DISTINCT FROM NEW.created_at::date THEN
+            PERFORM apply_patient_daily_stats('created', NEW.created_at::date, 1);
+        END IF;
+        IF TG_OP = 'INSERT' OR OLD.next_appointment IS DISTINCT FROM NEW.next_appointment THEN
+            PERFORM apply_patient_daily_stats('next_appointment', NEW.next_appointment, 1);
+        END IF;
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS patient_stats_trigger ON patients;
+CREATE TRIGGER patient_stats_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF status, created_at, next_appointment ON patients
+    FOR EACH ROW
+    EXECUTE FUNCTION update_patient_stats();
+
+TRUNCATE patient_status_stats;
+INSERT INTO patient_status_stats (status, patient_count)
+SELECT status, COUNT(*) FROM patients GROUP BY status;
+
+TRUNCATE patient_daily_stats;
+INSERT INTO patient_daily_stats (metric, stat_date, patient_count)
+SELECT 'created', created_at::date, COUNT(*) FROM patients WHERE created_at IS NOT NULL GROUP BY created_at::date
+UNION ALL
+SELECT 'next_appointment', next_appointment, COUNT(*) FROM patients WHERE next_appointment IS NOT NULL GROUP BY next_appointment;
+
+-- ---------------------------------------------------------------------------
+-- Availability: records and open/booked slots per dentist
+-- ---------------------------------------------------------------------------
+CREATE TABLE IF NOT EXISTS availability_dentist_stats (
+    dentist_id INTEGER PRIMARY KEY,
+    availability_count INTEGER NOT NULL DEFAULT 0,
+    open_slots INTEGER NOT NULL DEFAULT 0,
+    booked_slots INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE OR REPLACE FUNCTION apply_availability_dentist_stats(
+    p_dentist_id INTEGER, p_records INTEGER, p_open INTEGER, p_booked INTEGER
+)
+RETURNS VOID AS $$
+BEGIN
+    INSERT INTO availability_dentist_stats (dentist_id, availability_count, open_slots, booked_slots)
+    VALUES (p_dentist_id, p_records, p_open, p_booked)
+    ON CONFLICT (dentist_id) DO UPDATE SET
+        availability_count = availability_dentist_stats.availability_count + EXCLUDED.availability_count,
+        open_slots = availability_dentist_stats.open_slots + EXCLUDED.open_slots,
+        booked_slots = availability_dentist_stats.booked_slots + EXCLUDED.booked_slots;
+END;
+$$ language 'plpgsql';
+
+CREATE OR REPLACE FUNCTION update_availability_record_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.dentist_id = NEW.dentist_id THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_availability_dentist_stats(OLD.dentist_id, -1, 0, 0);
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_availability_dentist_stats(NEW.dentist_id, 1, 0, 0);
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS availability_record_stats_trigger ON availability;
+CREATE TRIGGER availability_record_stats_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF dentist_id ON availability
+    FOR EACH ROW
+    EXECUTE FUNCTION update_availability_record_stats();
+
+CREATE OR REPLACE FUNCTION update_availability_slot_stats()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'UPDATE' AND OLD.dentist_id = NEW.dentist_id AND OLD.available = NEW.available THEN
+        RETURN NULL;
+    END IF;
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        PERFORM apply_availability_dentist_stats(
+            OLD.dentist_id, 0,
+            CASE WHEN OLD.available THEN -1 ELSE 0 END,
+            CASE WHEN OLD.available THEN 0 ELSE -1 END
+        );
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        PERFORM apply_availability_dentist_stats(
+            NEW.dentist_id, 0,
+            CASE WHEN NEW.available THEN 1 ELSE 0 END,
+            CASE WHEN NEW.available THEN 0 ELSE 1 END
+        );
+    END IF;
+    RETURN NULL;
+END;
+$$ language 'plpgsql';
+
+DROP TRIGGER IF EXISTS availability_slot_stats_trigger ON availability_slots;
+CREATE TRIGGER availability_slot_stats_trigger
+    AFTER INSERT OR DELETE OR UPDATE OF dentist_id, available ON availability_slots
+    FOR EACH ROW
+    EXECUTE FUNCTION update_availability_slot_stats();
+
+TRUNCATE availability_dentist_stats;
+INSERT INTO availability_dentist_stats (dentist_id, availability_count, open_slots, booked_slots)
+SELECT
+    d.id,
+    (SELECT COUNT(*) FROM availability a WHERE a.dentist_id = d.id),
+    (SELECT COUNT(*) FROM availability_slots s WHERE s.dentist_id = d.id AND s.available),
+    (SELECT COUNT(*) FROM availability_slots s WHERE s.dentist_id = d.id AND NOT s.available)
+FROM dentists d;
+
+COMMIT;
+
+-- Verify the rollups match the base tables
+SELECT
+    (SELECT COUNT(*) FROM appointments) as appointments,
+    (SELECT SUM(appointment_count) FROM appointment_daily_stats) as appointments_rollup,
+    (SELECT COUNT(*) FROM patients) as patients,
+    (SELECT SUM(patient_count) FROM patient_status_stats) as patients_rollup,
+    (SELECT COUNT(*) FROM availability_slots) as slots,
+    (SELECT SUM(open_slots + booked_slots) FROM availability_dentist_stats) as slots_rollup;
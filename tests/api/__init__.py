@@ -0,0 +1 @@
+# API benchmark tests package
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+REST API Benchmark
+Drives the appointment, availability, patient and dashboard endpoints at a
+fixed concurrency and records latency percentiles and throughput per scenario
+into a JSON results file. Pass --compare with an earlier results file to see
+the difference.
+
+Usage:
+    python tests/api/seed_benchmark_data.py --reset --scale medium   # once
+    python tests/api/benchmark_api.py --concurrency 16 --duration 20 --output results/api-$(git rev-parse --short HEAD).json
+    python tests/api/benchmark_api.py --compare results/api-main.json --output results/api-branch.json
+
+The scenarios only use the HTTP API, so any deployment seeded with
+seed_benchmark_data.py can be measured. appointments_create books open slots
+far in the future. The appointments are deleted and their slots released
+after the run.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
+from pathlib import Path
+
+import requests
+
+# Add project root to path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from tests.api.seed_benchmark_data import FIRST_NAMES, LAST_NAMES, TREATMENTS, patient_name, patient_phone
+
+API_BASE = os.getenv("API_BASE", "http://localhost:8080")
+BENCH_NOTE = "api-benchmark"
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 2)
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+class ApiClient:
+    """A requests.Session per thread, all sharing one bearer token."""
+
+    def __init__(self, base_url, token=None):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self._local = threading.local()
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            if self.token:
+                session.headers["Authorization"] = f"Bearer {self.token}"
+        return session
+
+    def request(self, method, path, **kwargs):
+        return self.session().request(method, self.base_url + path, timeout=30, **kwargs)
+
+    def login(self, username, password):
+        response = self.request("POST", "/auth/login", json={"username": username, "password": password})
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+
+class Scenarios:
+    """Request builders. Each returns (method, path, kwargs) for one randomized request."""
+
+    def __init__(self, client, rng, days):
+        self.client = client
+        self.rng = rng
+        self.today = date.today()
+        self.days = days
+        self.dentist_ids = [d["id"] for d in client.request("GET", "/api/dentists").json()]
+        if not self.dentist_ids:
+            raise RuntimeError("No dentists found; seed the database with tests/api/seed_benchmark_data.py first")
+        self.open_slots = []
+        self.created = []  # (appointment_id, availability_id, slot)
+        self._lock = threading.Lock()
+
+    def _dentist(self):
+        return self.rng.choice(self.dentist_ids)
+
+    def _day(self, ahead=None):
+        day = self.today + timedelta(days=self.rng.randint(0, ahead or self.days))
+        while day.weekday() >= 5:
+            day += timedelta(days=1)
+        return day
+
+    def _surname(self):
+        return self.rng.choice(LAST_NAMES)
+
+    def appointments_list(self):
+        return "GET", "/api/appointments", {"params": {"page_size": 25}}
+
+    def appointments_deep_page(self):
+        return "GET", "/api/appointments", {"params": {"page": self.rng.randint(50, 400), "page_size": 25}}
+
+    def appointments_filtered(self):
+        start = self._day(self.days // 2)
+        return "GET", "/api/appointments", {"params": {
+            "dentist_id": self._dentist(), "date_from": start.isoformat(),
+            "date_to": (start + timedelta(days=14)).isoformat(), "status": "confirmed"}}
+
+    def appointments_by_patient(self):
+        return "GET", "/api/appointments", {"params": {"patient": self._surname(), "count": "estimated"}}
+
+    def appointment_detail(self):
+        return "GET", f"/api/appointments/{self.rng.randint(1, 1000)}", {}
+
+    def appointments_create(self):
+        with self._lock:
+            if not self.open_slots:
+                return None
+            availability_id, dentist_id, day, slot = self.open_slots.pop()
+        patient_id = self.rng.randint(1, 1000)
+        return "POST", "/api/appointments", {
+            "json": {
+                "patient": patient_name(patient_id), "phone": patient_phone(patient_id), "dentist_id": dentist_id,
+                "appointment_date": day, "appointment_time": slot["start"],
+                "treatment": self.rng.choice(TREATMENTS), "notes": BENCH_NOTE},
+            "_created": (availability_id, slot)}
+
+    def patients_search(self):
+        return "GET", "/api/patients", {"params": {"search": self._surname()}}
+
+    def patients_search_fuzzy(self):
+        name = f"{self.rng.choice(FIRST_NAMES)} {self._surname()}"
+        typo = name[:-2] + name[-1] + name[-2]
+        return "GET", "/api/patients", {"params": {"search": typo, "search_mode": "fuzzy"}}
+
+    def patients_list(self):
+        return "GET", "/api/patients", {"params": {"page": self.rng.randint(1, 100), "count": "estimated"}}
+
+    def availability_range(self):
+        start = self._day(self.days // 2)
+        return "GET", "/api/availability", {"params": {
+            "dentist_id": self._dentist(), "date_from": start.isoformat(),
+            "date_to": (start + timedelta(days=7)).isoformat()}}
+
+    def availability_open_slots(self):
+        return "GET", f"/api/availability/dentist/{self._dentist()}/available", {"params": {"date": self._day().isoformat()}}
+
+    def dashboard_stats(self):
+        return "GET", "/api/dashboard/stats", {}
+
+    def dashboard_today(self):
+        return "GET", "/api/dashboard/appointments/today", {"params": {"page_size": 10}}
+
+    def dashboard_upcoming(self):
+        return "GET", "/api/dashboard/appointments/today", {"params": {"filter_type": "upcoming", "page_size": 10}}
+
+    def dentists_list(self):
+        return "GET", "/api/dentists", {}
+
+    def prepare_open_slots(self, needed):
+        """Collect open slots in the last month of the seeded range, where created appointments disturb nothing else"""
+        week = self.today + timedelta(days=max(self.days - 30, 0))
+        while len(self.open_slots) < needed and week <= self.today + timedelta(days=self.days):
+            for dentist_id in self.dentist_ids:
+                response = self.client.request("GET", "/api/availability", params={
+                    "dentist_id": dentist_id, "date_from": week.isoformat(),
+                    "date_to": (week + timedelta(days=6)).isoformat(), "available_only": "true"})
+                for record in response.json():
+                    for slot in record["time_slots"]:
+                        if slot["available"]:
+                            self.open_slots.append((record["id"], dentist_id, record["date"], slot))
+            week += timedelta(days=7)
+        self.rng.shuffle(self.open_slots)
+        del self.open_slots[needed:]
+
+    def cleanup(self):
+        """Delete the appointments created by the run and release their slots"""
+        for appointment_id, availability_id, slot in self.created:
+            self.client.request("DELETE", f"/api/appointments/{appointment_id}")
+            self.client.request("POST", f"/api/availability/{availability_id}/release-slot", json=slot)
+        removed = len(self.created)
+        self.created.clear()
+        return removed
+
+SCENARIOS = [
+    "appointments_list", "appointments_deep_page", "appointments_filtered", "appointments_by_patient",
+    "appointment_detail", "appointments_create", "patients_search", "patients_search_fuzzy", "patients_list",
+    "availability_range", "availability_open_slots", "dashboard_stats", "dashboard_today", "dashboard_upcoming",
+    "dentists_list",
+]
+
+def run_scenario(client, scenarios, name, concurrency, duration, warmup):
+    """Run one scenario with `concurrency` closed-loop workers for `duration` seconds after `warmup`"""
+    build = getattr(scenarios, name)
+    latencies = []
+    statuses = Counter()
+    errors = Counter()
+    lock = threading.Lock()
+    measure_from = time.perf_counter() + warmup
+    stop_at = measure_from + duration
+
+    def worker():
+        local_latencies, local_statuses, local_errors = [], Counter(), Counter()
+        while True:
+            started = time.perf_counter()
+            if started >= stop_at:
+                break
+            request = build()
+            if request is None:
+                break  # appointments_create ran out of open slots
+            method, path, kwargs = request
+            created = kwargs.pop("_created", None)
+            try:
+                response = client.request(method, path, **kwargs)
+                status = response.status_code
+                if created and status == 200:
+                    with lock:
+                        scenarios.created.append((response.json()["id"], *created))
+            except requests.RequestException as e:
+                status = "error"
+                local_errors[type(e).__name__] += 1
+            if started >= measure_from:
+                local_latencies.append(time.perf_counter() - started)
+                local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+            errors.update(local_errors)
+
+    wall_started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    measured = max(min(time.perf_counter(), stop_at) - max(measure_from, wall_started), 1e-9)
+
+    ok = sum(count for status, count in statuses.items() if status != "error" and status < 400)
+    return {
+        "requests": len(latencies),
+        "ok": ok,
+        "error_rate": round(1 - ok / len(latencies), 4) if latencies else None,
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+        "errors": dict(errors),
+        "throughput_rps": round(len(latencies) / measured, 1),
+        "mean_ms": ms(sum(latencies) / len(latencies)) if latencies else None,
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p90_ms": ms(percentile(latencies, 0.90)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(max(latencies) if latencies else None),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=project_root,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def print_table(results, baseline=None):
+    header = f"{'scenario':<26}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>9}"
+    if baseline:
+        header += f"{'Δ rps':>9}{'Δ p50':>9}{'Δ p99':>9}"
+    print(header)
+    print("-" * len(header))
+    for name, r in results["scenarios"].items():
+        line = f"{name:<26}{r['throughput_rps']:>9}{r['p50_ms'] or '-':>10}{r['p95_ms'] or '-':>10}{r['p99_ms'] or '-':>10}{r['error_rate'] or 0:>9.2%}"
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base:
+            def change(key):
+                if not base.get(key) or r.get(key) is None:
+                    return "-"
+                return f"{(r[key] - base[key]) / base[key]:+.0%}"
+            line += f"{change('throughput_rps'):>9}{change('p50_ms'):>9}{change('p99_ms'):>9}"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=API_BASE)
+    parser.add_argument("--username", default=os.getenv("BENCH_USERNAME", "admin"))
+    parser.add_argument("--password", default=os.getenv("BENCH_PASSWORD", "admin123"))
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=15, help="measured seconds per scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="unmeasured seconds before each scenario")
+    parser.add_argument("--days", type=int, default=365, help="days of availability the dataset was seeded with")
+    parser.add_argument("--scenarios", help=f"comma-separated subset of: {', '.join(SCENARIOS)}")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", default="api_benchmark_results.json")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    selected = args.scenarios.split(",") if args.scenarios else SCENARIOS
+    unknown = set(selected) - set(SCENARIOS)
+    if unknown:
+        print(f"❌ Unknown scenarios: {', '.join(sorted(unknown))}")
+        return 1
+
+    client = ApiClient(args.base_url)
+    client.login(args.username, args.password)
+    scenarios = Scenarios(client, random.Random(args.seed), args.days)
+    if "appointments_create" in selected:
+        # Enough distinct open slots for a generous upper bound on create throughput
+        scenarios.prepare_open_slots(int(200 * (args.duration + args.warmup)))
+        print(f"🗓️  {len(scenarios.open_slots)} open slots reserved for appointments_create")
+
+    results = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "commit": git_commit(),
+            "base_url": args.base_url,
+            "concurrency": args.concurrency,
+            "duration_seconds": args.duration,
+            "warmup_seconds": args.warmup,
+            "seed": args.seed,
+            "client": f"{platform.node()} / Python {platform.python_version()}",
+        },
+        "scenarios": {},
+    }
+    try:
+        for name in selected:
+            print(f"⏱️  {name} ({args.concurrency} workers, {args.duration}s)")
+            results["scenarios"][name] = run_scenario(client, scenarios, name, args.concurrency, args.duration, args.warmup)
+    finally:
+        if scenarios.created:
+            print(f"🧹 Removed {scenarios.cleanup()} benchmark appointments")
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"💾 Results written to {args.output}\n")
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print(f"Compared with {args.compare} (commit {baseline['meta'].get('commit')}, concurrency {baseline['meta'].get('concurrency')})")
+    print_table(results, baseline)
+
+    failing = [name for name, r in results["scenarios"].items() if r["error_rate"]]
+    if failing:
+        print(f"\n⚠️  Errors in: {', '.join(failing)}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
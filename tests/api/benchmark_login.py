@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Login Benchmark
+Measures logins per second and how much a login burst slows down everything
+else. While closed-loop workers POST /auth/login, probes request other
+authenticated endpoints every --probe-interval seconds. Their latency is
+compared with an idle baseline taken first.
+
+- GET /auth/me would queue behind every password check if bcrypt ran on the
+  event loop.
+- GET /api/dentists needs a pooled connection for the whole request. It would
+  time out if logins held connections while bcrypt runs. Run the burst with
+  --concurrency above POSTGRES_POOL_MAX_SIZE (default 10) to show this.
+
+Usage:
+    python tests/api/benchmark_login.py --concurrency 16 --duration 20
+    python tests/api/benchmark_login.py --probe-path /auth/me --probe-path /api/patients
+    python tests/api/benchmark_login.py --local --rounds 12 --workers 4   # hasher only, no server
+
+--local skips HTTP. It runs concurrent password checks through
+app/utils/passwords.py in this process, once inline on the event loop (the
+old behaviour) and once on the hashing pool. It reports checks per second and
+the worst event-loop stall for each.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import requests
+
+# Add project root to path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from tests.api.benchmark_api import API_BASE, ApiClient, git_commit, ms, percentile
+
+def latency_summary(latencies):
+    return {
+        "requests": len(latencies),
+        "p50_ms": ms(percentile(latencies, 0.50)),
+        "p95_ms": ms(percentile(latencies, 0.95)),
+        "p99_ms": ms(percentile(latencies, 0.99)),
+        "max_ms": ms(max(latencies) if latencies else None),
+    }
+
+DEFAULT_PROBE_PATHS = ["/auth/me", "/api/dentists"]
+
+class Probe:
+    """GET `path` at a fixed interval on its own thread, recording latency and failures."""
+
+    def __init__(self, client, path, interval):
+        self.client = client
+        self.path = path
+        self.interval = interval
+        self.latencies = []
+        self.failures = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            started = time.perf_counter()
+            try:
+                response = self.client.request("GET", self.path)
+                if response.status_code == 200:
+                    self.latencies.append(time.perf_counter() - started)
+                else:
+                    self.failures[str(response.status_code)] += 1
+            except requests.RequestException:
+                self.failures["error"] += 1
+            self._stop.wait(max(self.interval - (time.perf_counter() - started), 0))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def summary(self):
+        return {**latency_summary(self.latencies), "failures": dict(self.failures)}
+
+def start_probes(client, paths, interval):
+    probes = [Probe(client, path, interval) for path in paths]
+    for probe in probes:
+        probe.start()
+    return probes
+
+def stop_probes(probes):
+    for probe in probes:
+        probe.stop()
+    return {probe.path: probe.summary() for probe in probes}
+
+def login_burst(base_url, username, password, concurrency, duration):
+    """Closed-loop logins for `duration` seconds"""
+    latencies = []
+    statuses = Counter()
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+    client = ApiClient(base_url)
+
+    def worker():
+        local_latencies, local_statuses = [], Counter()
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                response = client.request("POST", "/auth/login", json={"username": username, "password": password})
+                status = response.status_code
+            except requests.RequestException:
+                status = "error"
+            local_latencies.append(time.perf_counter() - started)
+            local_statuses[status] += 1
+        with lock:
+            latencies.extend(local_latencies)
+            statuses.update(local_statuses)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    elapsed = time.perf_counter() - started
+
+    ok = statuses.get(200, 0)
+    return {
+        **latency_summary(latencies),
+        "logins_per_second": round(ok / elapsed, 1),
+        "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+    }
+
+def run_http(args):
+    client = ApiClient(args.base_url)
+    client.login(args.username, args.password)
+
+    paths = args.probe_path or DEFAULT_PROBE_PATHS
+
+    print(f"⏱️  Idle probe baseline ({args.baseline}s): {', '.join(paths)}")
+    probes = start_probes(client, paths, args.probe_interval)
+    time.sleep(args.baseline)
+    idle = stop_probes(probes)
+
+    print(f"🔐 Login burst ({args.concurrency} workers, {args.duration}s)")
+    probes = start_probes(client, paths, args.probe_interval)
+    try:
+        logins = login_burst(args.base_url, args.username, args.password, args.concurrency, args.duration)
+    finally:
+        during = stop_probes(probes)
+    return {
+        "logins": logins,
+        "probes": {path: {"idle": idle[path], "during_logins": during[path]} for path in paths},
+    }
+
+async def _loop_stall(work, tick=0.005):
+    """Run `work` while a ticker measures how late the event loop wakes it up"""
+    stalls = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + tick
+            await asyncio.sleep(tick)
+            stalls.append(max(time.perf_counter() - expected, 0))
+
+    ticker_task = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    try:
+        results = await work()
+    finally:
+        done.set()
+        await ticker_task
+    return results, time.perf_counter() - started, stalls
+
+async def run_local(args):
+    # Configure the hashing module before it is imported
+    os.environ["AUTH_BCRYPT_ROUNDS"] = str(args.rounds)
+    os.environ["AUTH_HASH_WORKERS"] = str(args.workers)
+    os.environ["AUTH_HASH_MAX_PENDING"] = str(args.checks)
+    from app.utils import passwords
+
+    stored = passwords.hash_password_sync(args.password)
+
+    async def inline():
+        # The old code path: bcrypt directly inside the coroutine
+        results = []
+        for _ in range(args.checks):
+            results.append(passwords.verify_and_update_sync(args.password, stored)[0])
+            await asyncio.sleep(0)
+        return results
+
+    async def pooled():
+        return await asyncio.gather(*(passwords.verify_password(args.password, stored) for _ in range(args.checks)))
+
+    report = {}
+    for name, work in (("inline", inline), ("pool", pooled)):
+        print(f"⏱️  {args.checks} password checks, {name}")
+        results, elapsed, stalls = await _loop_stall(work)
+        assert all(results), "password check failed"
+        report[name] = {
+            "checks_per_second": round(args.checks / elapsed, 1),
+            "loop_stall_p99_ms": ms(percentile(stalls, 0.99)),
+            "loop_stall_max_ms": ms(max(stalls) if stalls else None),
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=API_BASE)
+    parser.add_argument("--username", default=os.getenv("BENCH_USERNAME", "admin"))
+    parser.add_argument("--password", default=os.getenv("BENCH_PASSWORD", "admin123"))
+    parser.add_argument("--concurrency", type=int, default=16, help="concurrent login workers")
+    parser.add_argument("--duration", type=float, default=20, help="seconds of logins")
+    parser.add_argument("--baseline", type=float, default=5, help="seconds of idle probing before the burst")
+    parser.add_argument("--probe-interval", type=float, default=0.05)
+    parser.add_argument("--probe-path", action="append",
+                        help=f"endpoint to probe during the burst, repeatable (default: {' '.join(DEFAULT_PROBE_PATHS)})")
+    parser.add_argument("--local", action="store_true", help="benchmark the hasher in-process instead of over HTTP")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost for --local")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="hashing threads for --local")
+    parser.add_argument("--checks", type=int, default=32, help="password checks for --local")
+    parser.add_argument("--output", help="write the results as JSON")
+    args = parser.parse_args()
+
+    meta = {"timestamp": datetime.now(timezone.utc).isoformat(), "commit": git_commit()}
+    if args.local:
+        meta.update({"mode": "local", "rounds": args.rounds, "workers": args.workers, "checks": args.checks})
+        results = asyncio.run(run_local(args))
+    else:
+        meta.update({"mode": "http", "base_url": args.base_url, "concurrency": args.concurrency,
+                     "duration_seconds": args.duration})
+        results = run_http(args)
+
+    report = {"meta": meta, "results": results}
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"💾 Results written to {args.output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Benchmark Data Seeder
+Creates the schema from sql_files/ in an empty PostgreSQL database and fills it
+with a deterministic synthetic clinic: dentists, a year or more of weekday
+availability, patients and appointments booked into those slots.
+
+Usage:
+    POSTGRES_DB=clinic_bench python tests/api/seed_benchmark_data.py --scale medium
+    POSTGRES_DB=clinic_bench python tests/api/seed_benchmark_data.py --reset --patients 500000
+
+The same --scale and --seed always produce the same rows, so results from
+tests/api/benchmark_api.py runs on different commits can be compared.
+"""
+
+import argparse
+import io
+import os
+import random
+import re
+import sys
+import time
+from datetime import date, timedelta
+from pathlib import Path
+
+import psycopg2
+from dotenv import load_dotenv
+
+# Add project root to path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+load_dotenv()
+
+SQL_DIR = project_root / "sql_files"
+
+# Tables and triggers. The sample rows are stripped, because their fixed
+# 2024 dates fail the date CHECK constraints added right after them.
+SCHEMA_FILES = [
+    "setup_users_table.sql",
+    "setup_dentists_table.sql",
+    "add_dentist_working_hours.sql",
+    "setup_patients_table.sql",
+    "add_patient_fields.sql",
+    "setup_availability_table.sql",
+    "setup_appointments_table.sql",
+    "fix_appointments_table.sql",
+    "add_availability_slots.sql",
+    "add_availability_context_notify.sql",
+    "setup_settings_table.sql",
+]
+# Indexes and rollups, built once the data is loaded (much faster than maintaining them row by row)
+POST_LOAD_FILES = [
+    "add_patient_search_indexes.sql",
+    "add_appointment_keyset_indexes.sql",
+    "add_caller_id_indexes.sql",
+    "add_stats_rollups.sql",
+]
+SAMPLE_ROWS = re.compile(r"^INSERT INTO (dentists|patients|appointments|availability) .*?;[ \t]*$", re.MULTILINE | re.DOTALL)
+
+RESET_TABLES = [
+    "appointment_daily_stats", "patient_status_stats", "patient_daily_stats", "availability_dentist_stats",
+    "availability_slots", "appointments", "availability", "patients", "dentists", "settings", "users",
+]
+
+SCALES = {
+    "small":  {"dentists": 5,  "days": 30,  "patients": 2000,   "appointments": 1500},
+    "medium": {"dentists": 20, "days": 365, "patients": 50000,  "appointments": 50000},
+    "large":  {"dentists": 60, "days": 730, "patients": 300000, "appointments": 300000},
+}
+
+# 30-minute slots from 08:00 to 17:30, Monday to Friday
+SLOT_STARTS = [f"{h:02d}:{m:02d}" for h in range(8, 18) for m in (0, 30)]
+SLOT_ENDS = SLOT_STARTS[1:] + ["18:00"]
+
+FIRST_NAMES = [
+    "James", "Mary", "John", "Patricia", "Robert", "Jennifer", "Michael", "Linda", "William", "Elizabeth",
+    "David", "Barbara", "Richard", "Susan", "Joseph", "Jessica", "Thomas", "Sarah", "Charles", "Karen",
+    "Daniel", "Nancy", "Matthew", "Lisa", "Anthony", "Betty", "Mark", "Margaret", "Steven", "Sandra",
+    "Paul", "Ashley", "Andrew", "Emily", "Joshua", "Donna", "Kevin", "Michelle", "Brian", "Amanda",
+]
+LAST_NAMES = [
+    "Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+    "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin",
+    "Lee", "Perez", "Thompson", "White", "Harris", "Sanchez", "Clark", "Ramirez", "Lewis", "Robinson",
+    "Walker", "Young", "Allen", "King", "Wright", "Scott", "Torres", "Nguyen", "Hill", "Flores",
+]
+SPECIALTIES = ["General Dentistry", "Orthodontics", "Oral Surgery", "Periodontics", "Pediatric Dentistry", "Endodontics"]
+TREATMENTS = [
+    "Regular Cleaning", "Dental Checkup", "Dental Filling", "Tooth Extraction", "Root Canal",
+    "Crown Placement", "Teeth Whitening", "Orthodontic Consultation", "Gum Treatment", "Dental Implant",
+]
+APPOINTMENT_STATUSES = [("confirmed", 80), ("completed", 8), ("cancelled", 6), ("rescheduled", 2), ("no_show", 2), ("arrived", 2)]
+PATIENT_STATUSES = [("active", 85), ("inactive", 10), ("pending", 4), ("suspended", 1)]
+WORKING_HOURS = '{"monday": {"start": "08:00", "end": "18:00"}, "tuesday": {"start": "08:00", "end": "18:00"}, ' \
+                '"wednesday": {"start": "08:00", "end": "18:00"}, "thursday": {"start": "08:00", "end": "18:00"}, ' \
+                '"friday": {"start": "08:00", "end": "18:00"}}'
+
+def connect():
+    connection = psycopg2.connect(
+        dbname=os.getenv("POSTGRES_DB"),
+        user=os.getenv("POSTGRES_USER"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        host=os.getenv("POSTGRES_HOST"),
+        port=os.getenv("POSTGRES_PORT", 28370),
+    )
+    connection.autocommit = True
+    return connection
+
+def patient_name(patient_id):
+    """Deterministic name for a patient id, so the benchmark can derive search terms without the database"""
+    return f"{FIRST_NAMES[patient_id % len(FIRST_NAMES)]} {LAST_NAMES[(patient_id // len(FIRST_NAMES)) % len(LAST_NAMES)]}"
+
+def patient_phone(patient_id):
+    return f"({200 + patient_id // 10000000 % 800:03d}) {patient_id // 10000 % 1000:03d}-{patient_id % 10000:04d}"
+
+def weekdays(start, days):
+    return [start + timedelta(days=i) for i in range(days) if (start + timedelta(days=i)).weekday() < 5]
+
+def weighted(rng, choices):
+    values, weights = zip(*choices)
+    return rng.choices(values, weights=weights)[0]
+
+def run_sql_file(cur, name, strip_samples=False):
+    sql = (SQL_DIR / name).read_text()
+    if strip_samples:
+        sql = SAMPLE_ROWS.sub("", sql)
+    cur.execute(sql)
+
+def copy_rows(cur, table, columns, rows, batch=50000):
+    """COPY rows (tuples, None for NULL) into `table` in batches"""
+    buffer = io.StringIO()
+    count = 0
+
+    def flush():
+        buffer.seek(0)
+        cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT text)", buffer)
+        buffer.seek(0)
+        buffer.truncate()
+
+    for row in rows:
+        buffer.write("\t".join("\\N" if value is None else str(value) for value in row))
+        buffer.write("\n")
+        count += 1
+        if count % batch == 0:
+            flush()
+    if count % batch:
+        flush()
+    return count
+
+def reset(cur):
+    for table in RESET_TABLES:
+        cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE")
+
+def seed(cur, dentists, days, patients, appointments, seed_value):
+    rng = random.Random(seed_value)
+    today = date.today()
+    dates = weekdays(today, days)
+    slots_per_dentist = len(dates) * len(SLOT_STARTS)
+    total_slots = dentists * slots_per_dentist
+    if appointments > total_slots:
+        raise ValueError(f"{appointments} appointments do not fit in {total_slots} slots; add dentists or days")
+
+    counts = {}
+    counts["dentists"] = copy_rows(cur, "dentists",
+        ["id", "name", "specialty", "email", "phone", "license", "years_of_experience", "working_days", "working_hours"],
+        ((i, f"Dr. {FIRST_NAMES[i % len(FIRST_NAMES)]} {LAST_NAMES[(i * 7) % len(LAST_NAMES)]}",
+          SPECIALTIES[i % len(SPECIALTIES)], f"dentist{i}@bench.example.com", f"+1-555-{i:04d}",
+          f"DDS-B{i:05d}", rng.randint(1, 35), "5 days/week", WORKING_HOURS)
+         for i in range(1, dentists + 1)))
+
+    def patient_rows():
+        for i in range(1, patients + 1):
+            last_visit = today - timedelta(days=rng.randint(1, 1000)) if rng.random() < 0.8 else None
+            next_visit = today + timedelta(days=rng.randint(0, days)) if rng.random() < 0.3 else None
+            created = today - timedelta(days=rng.randint(0, 1500))
+            yield (i, patient_name(i), f"patient{i}@bench.example.com", patient_phone(i),
+                   date(1940, 1, 1) + timedelta(days=rng.randint(0, 365 * 65)), last_visit, next_visit,
+                   weighted(rng, PATIENT_STATUSES), f"{rng.randint(1, 9999)} Main Street", created)
+    counts["patients"] = copy_rows(cur, "patients",
+        ["id", "name", "email", "phone", "date_of_birth", "last_visit", "next_appointment", "status", "address", "created_at"],
+        patient_rows())
+
+    # Pick the booked slots up front so slot rows and appointments agree
+    booked = {}
+    for index in rng.sample(range(total_slots), appointments):
+        booked[index] = weighted(rng, APPOINTMENT_STATUSES)
+
+    counts["availability"] = copy_rows(cur, "availability", ["id", "dentist_id", "date", "time_slots"],
+        ((d * len(dates) + n + 1, d + 1, day, "[]") for d in range(dentists) for n, day in enumerate(dates)))
+
+    def slot_rows():
+        for d in range(dentists):
+            for n, day in enumerate(dates):
+                for s, start in enumerate(SLOT_STARTS):
+                    status = booked.get(d * slots_per_dentist + n * len(SLOT_STARTS) + s)
+                    available = status is None or status in ("cancelled", "rescheduled")
+                    yield (d * len(dates) + n + 1, d + 1, day, start, SLOT_ENDS[s], "t" if available else "f")
+    counts["availability_slots"] = copy_rows(cur, "availability_slots",
+        ["availability_id", "dentist_id", "date", "start_time", "end_time", "available"], slot_rows())
+
+    def appointment_rows():
+        for index in sorted(booked):
+            d, rest = divmod(index, slots_per_dentist)
+            n, s = divmod(rest, len(SLOT_STARTS))
+            patient_id = rng.randint(1, patients)
+            yield (patient_name(patient_id), patient_phone(patient_id), d + 1, dates[n], SLOT_STARTS[s],
+                   rng.choice(TREATMENTS), booked[index], None)
+    counts["appointments"] = copy_rows(cur, "appointments",
+        ["patient", "phone", "dentist_id", "appointment_date", "appointment_time", "treatment", "status", "notes"],
+        appointment_rows())
+
+    for table in ("dentists", "patients", "availability"):
+        cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="medium")
+    parser.add_argument("--dentists", type=int)
+    parser.add_argument("--days", type=int, help="days of availability from today (weekdays get slots)")
+    parser.add_argument("--patients", type=int)
+    parser.add_argument("--appointments", type=int)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--reset", action="store_true", help="drop the clinic tables first")
+    parser.add_argument("--force", action="store_true", help="allow --reset on a database whose name lacks 'bench' or 'test'")
+    args = parser.parse_args()
+
+    sizes = dict(SCALES[args.scale])
+    for key in sizes:
+        if getattr(args, key) is not None:
+            sizes[key] = getattr(args, key)
+
+    database = os.getenv("POSTGRES_DB") or ""
+    if args.reset and not args.force and not re.search("bench|test", database):
+        print(f"❌ Refusing to reset '{database}': use a database named *bench* or *test*, or pass --force")
+        return 1
+
+    connection = connect()
+    try:
+        with connection.cursor() as cur:
+            if args.reset:
+                print(f"🗑️  Dropping clinic tables in '{database}'")
+                reset(cur)
+            cur.execute("SELECT to_regclass('dentists') IS NOT NULL")
+            if cur.fetchone()[0]:
+                print("❌ The schema already exists; pass --reset to drop it and seed again")
+                return 1
+
+            started = time.perf_counter()
+            print("🏗️  Creating schema from sql_files/")
+            for name in SCHEMA_FILES:
+                run_sql_file(cur, name, strip_samples=True)
+
+            print(f"🌱 Seeding {sizes} (seed {args.seed})")
+            counts = seed(cur, sizes["dentists"], sizes["days"], sizes["patients"], sizes["appointments"], args.seed)
+
+            print("📇 Building indexes and rollups")
+            for name in POST_LOAD_FILES:
+                run_sql_file(cur, name)
+            cur.execute("ANALYZE")
+
+        print(f"✅ Seeded in {time.perf_counter() - started:.1f}s: {counts}")
+        return 0
+    finally:
+        connection.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
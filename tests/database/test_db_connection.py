@@ -6,21 +6,31 @@ Tests PostgreSQL connection and basic operations
 
 import os
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # Add project root to path
 project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
-from app.utils.db import conn, fetch_dentists, find_patient_by_name
+from app.utils.db import (
+    connection,
+    get_pool,
+    fetch_dentists,
+    find_patient_by_name,
+    fetch_available_slots,
+    set_slot_availability
+)
 
 def test_db_connection():
     """Test database connection."""
     print("🔌 Testing Database Connection...")
     
     try:
-        if conn.closed == 0:
-            print("✅ Database connection: OK")
+        with connection() as db_conn:
+            is_open = db_conn.closed == 0
+        if is_open:
+            print(f"✅ Database connection: OK (pool: {get_pool().stats()})")
             return True
         else:
             print("❌ Database connection: FAILED")
@@ -64,6 +74,39 @@ def test_patient_lookup():
         print(f"❌ Error in patient lookup: {e}")
         return False
 
+def test_concurrent_slot_booking():
+    """Test that concurrent bookings of one slot have exactly one winner."""
+    print("🗓️ Testing concurrent slot booking...")
+    
+    try:
+        slots = fetch_available_slots(limit=1)
+        if not slots:
+            print("⚠️ No open slots to test with (skipped)")
+            return True
+        
+        slot = slots[0]
+        start = slot['time_slot']['start']
+        attempts = 5
+        with ThreadPoolExecutor(max_workers=attempts) as executor:
+            results = list(executor.map(
+                lambda _: set_slot_availability(slot['dentist_id'], slot['date'], start, available=False),
+                range(attempts)
+            ))
+        winners = [result for result in results if result is not None]
+        
+        # Put the slot back
+        set_slot_availability(slot['dentist_id'], slot['date'], start, available=True)
+        
+        if len(winners) == 1:
+            print(f"✅ Exactly one of {attempts} concurrent bookings succeeded")
+            return True
+        else:
+            print(f"❌ {len(winners)} of {attempts} concurrent bookings succeeded")
+            return False
+    except Exception as e:
+        print(f"❌ Error in concurrent booking: {e}")
+        return False
+
 def run_all_tests():
     """Run all database tests."""
     print("🧪 Database Tests")
@@ -82,7 +125,8 @@ def run_all_tests():
     tests = [
         test_db_connection,
         test_fetch_dentists,
-        test_patient_lookup
+        test_patient_lookup,
+        test_concurrent_slot_booking
     ]
     
     passed = 0
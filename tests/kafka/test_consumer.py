@@ -65,14 +65,38 @@ def test_consumer_startup():
         # Let it run for 5 seconds
         time.sleep(5)
         
+        consumer.stop()
+        consumer_thread.join(timeout=35)
+        print(f"📊 Consumer metrics: {consumer.metrics()}")
         print("✅ Consumer test completed")
-        consumer.close()
         return True
         
     except Exception as e:
         print(f"❌ Consumer test failed: {e}")
         return False
 
+def test_offsets_commit_point():
+    """Committed offset must never pass a message that is still being processed."""
+    print("🔢 Testing Offset Commit Point...")
+    
+    from app.utils.kafka_consumer import _PartitionOffsets
+    
+    offsets = _PartitionOffsets()
+    for offset in (10, 11, 12):
+        offsets.dispatched(offset)
+    offsets.finished(10)
+    offsets.finished(12)
+    if offsets.commit_point() != 11:
+        print(f"❌ Expected commit point 11, got {offsets.commit_point()}")
+        return False
+    offsets.finished(11)
+    if offsets.commit_point() != 13:
+        print(f"❌ Expected commit point 13, got {offsets.commit_point()}")
+        return False
+    
+    print("✅ Commit point tracks the first unfinished offset")
+    return True
+
 def run_all_tests():
     """Run all consumer tests."""
     print("🧪 Kafka Consumer Tests")
@@ -89,6 +113,7 @@ def run_all_tests():
     print()
     
     tests = [
+        test_offsets_commit_point,
         test_consumer_connection,
         test_consumer_startup
     ]
@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Kafka Event Encoding Tests
+Round-trips compact events through every available encoding and compares
+their size with the legacy AI_RESPONSE message. Needs no broker.
+"""
+
+import sys
+import json
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.utils.kafka_events import (
+    AI_TURN, DIRECTIVE_AUDIT, available_encoding, build_event, decode_event, encode_event, now_ms
+)
+
+TRANSCRIPT = (
+    "Perfect, you're all set with Dr. Smith on October 25th at 10 AM. "
+    'BOOKING_CONFIRMATION: {"dentist": "Dr. Smith", "date": "2025-10-25", "time": "10:00", "patient_name": "John Doe"}'
+)
+BOOKING = {"dentist": "Dr. Smith", "date": "2025-10-25", "time": "10:00", "patient_name": "John Doe", "phone": "N/A"}
+
+def legacy_message():
+    """What process_ai_text_response used to send: the whole response.done object."""
+    full_response = {
+        "type": "response.done",
+        "event_id": "event_" + "x" * 22,
+        "response": {
+            "object": "realtime.response",
+            "id": "resp_" + "x" * 22,
+            "status": "completed",
+            "output": [{
+                "id": "item_" + "x" * 22,
+                "object": "realtime.item",
+                "type": "message",
+                "status": "completed",
+                "role": "assistant",
+                "content": [{"type": "output_audio", "transcript": TRANSCRIPT}]
+            }],
+            "usage": {
+                "total_tokens": 1832, "input_tokens": 1519, "output_tokens": 313,
+                "input_token_details": {"text_tokens": 1203, "audio_tokens": 316, "cached_tokens": 1152},
+                "output_token_details": {"text_tokens": 88, "audio_tokens": 225}
+            }
+        }
+    }
+    return {
+        "call_id": "CA" + "0" * 32,
+        "response_type": "AI_RESPONSE",
+        "data": {"raw_text": TRANSCRIPT, "full_response": full_response, "timestamp": "2025-10-20T10:00:00"},
+        "metadata": {"source": "voice_ai", "call_id": "CA" + "0" * 32, "response_type": "complete_ai_response"}
+    }
+
+def test_round_trip():
+    """Every available encoding decodes back to the same event."""
+    print("🔁 Testing event round-trips...")
+    events = [
+        build_event(AI_TURN, "CA" + "0" * 32, transcript=TRANSCRIPT, directives={"BOOKING_CONFIRMATION": BOOKING},
+                    started_at=now_ms() - 1200, completed_at=now_ms(), metadata={"source": "voice_ai"}),
+        build_event(DIRECTIVE_AUDIT, "CA" + "0" * 32, directives={"BOOKING_CONFIRMATION": BOOKING},
+                    results=[{"directive": "BOOKING_CONFIRMATION", "ok": True, "patient_name": "John Doe"}])
+    ]
+    for encoding in ("json", "msgpack", "avro"):
+        if available_encoding(encoding) != encoding:
+            print(f"   ⏭️  {encoding}: library not installed")
+            continue
+        for event in events:
+            decoded = decode_event(encode_event(event, encoding))
+            if decoded != event:
+                print(f"❌ {encoding} round-trip changed the event: {decoded}")
+                return False
+        print(f"   ✅ {encoding}")
+    return True
+
+def test_legacy_messages_decode():
+    """Messages from send_ai_response() still decode as before."""
+    print("📜 Testing legacy message decoding...")
+    message = legacy_message()
+    if decode_event(json.dumps(message).encode("utf-8")) != message:
+        print("❌ Legacy message changed")
+        return False
+    print("✅ Legacy message decodes unchanged")
+    return True
+
+def test_event_size():
+    """Compare the compact event with the legacy message."""
+    print("📏 Comparing message sizes...")
+    legacy_size = len(json.dumps(legacy_message()).encode("utf-8"))
+    event = build_event(AI_TURN, "CA" + "0" * 32, transcript=TRANSCRIPT, directives={"BOOKING_CONFIRMATION": BOOKING},
+                        started_at=now_ms() - 1200, completed_at=now_ms(), metadata={"source": "voice_ai"})
+    print(f"   legacy AI_RESPONSE json: {legacy_size} bytes")
+    for encoding in ("json", "msgpack", "avro"):
+        if available_encoding(encoding) == encoding:
+            size = len(encode_event(event, encoding))
+            print(f"   AI_TURN {encoding}: {size} bytes ({size / legacy_size:.0%} of legacy)")
+    return len(encode_event(event, "json")) < legacy_size
+
+def run_all_tests():
+    """Run all event tests."""
+    print("🧪 Kafka Event Encoding Tests")
+    print("=" * 40)
+
+    tests = [test_round_trip, test_legacy_messages_decode, test_event_size]
+    passed = 0
+    for test in tests:
+        if test():
+            passed += 1
+        print()
+
+    print(f"📊 Results: {passed}/{len(tests)} tests passed")
+    return passed == len(tests)
+
+if __name__ == "__main__":
+    success = run_all_tests()
+    sys.exit(0 if success else 1)
@@ -7,6 +7,7 @@ Tests sending messages to Kafka topic
 import os
 import sys
 import json
+import time
 from datetime import datetime
 from pathlib import Path
 
@@ -15,6 +16,7 @@ project_root = Path(__file__).parent.parent.parent
 sys.path.insert(0, str(project_root))
 
 from app.utils.kafka_producer import ai_response_producer
+from app.utils.kafka_events import AI_TURN, build_event, now_ms
 
 def test_producer_connection():
     """Test if producer can connect to Kafka."""
@@ -87,6 +89,73 @@ def test_send_booking_confirmation():
         print(f"❌ Error sending booking confirmation: {e}")
         return False
 
+def test_async_delivery():
+    """Test that a queued message is delivered and reported through the callback."""
+    print("📬 Testing async delivery callback...")
+    
+    try:
+        deliveries = []
+        start = time.perf_counter()
+        accepted = ai_response_producer.send_ai_response(
+            call_id="test-async-001",
+            response_type="AI_RESPONSE",
+            data={"raw_text": "async delivery test"},
+            metadata={"test": True, "timestamp": datetime.now().isoformat()},
+            on_delivery=lambda success, result: deliveries.append(success)
+        )
+        enqueue_ms = (time.perf_counter() - start) * 1000
+        ai_response_producer.flush(timeout=15)
+        
+        print(f"   Enqueue took {enqueue_ms:.2f} ms, metrics: {ai_response_producer.metrics()}")
+        if accepted and deliveries == [True]:
+            print("✅ Message delivered and callback fired!")
+            return True
+        else:
+            print(f"❌ Delivery not confirmed (accepted={accepted}, deliveries={deliveries})")
+            return False
+            
+    except Exception as e:
+        print(f"❌ Error in async delivery: {e}")
+        return False
+
+def test_send_ai_turn_event():
+    """Test sending a compact AI_TURN event."""
+    print(f"📦 Testing AI_TURN event ({ai_response_producer.event_encoding})...")
+    
+    try:
+        deliveries = []
+        event = build_event(
+            AI_TURN,
+            "test-turn-001",
+            transcript="You're booked with Dr. Test Smith on 2025-10-25 at 10:00.",
+            directives={
+                "BOOKING_CONFIRMATION": {
+                    "dentist": "Dr. Test Smith",
+                    "date": "2025-10-25",
+                    "time": "10:00",
+                    "patient_name": "Test Patient"
+                }
+            },
+            completed_at=now_ms(),
+            metadata={"test": True}
+        )
+        accepted = ai_response_producer.send_event(
+            event,
+            on_delivery=lambda success, result: deliveries.append(success)
+        )
+        ai_response_producer.flush(timeout=15)
+        
+        if accepted and deliveries == [True]:
+            print("✅ AI_TURN event delivered!")
+            return True
+        else:
+            print(f"❌ Delivery not confirmed (accepted={accepted}, deliveries={deliveries})")
+            return False
+            
+    except Exception as e:
+        print(f"❌ Error sending AI_TURN event: {e}")
+        return False
+
 def run_all_tests():
     """Run all producer tests."""
     print("🧪 Kafka Producer Tests")
@@ -105,7 +174,9 @@ def run_all_tests():
     tests = [
         test_producer_connection,
         test_send_patient_creation,
-        test_send_booking_confirmation
+        test_send_booking_confirmation,
+        test_async_delivery,
+        test_send_ai_turn_event
     ]
     
     passed = 0
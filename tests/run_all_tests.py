@@ -23,12 +23,15 @@ def run_kafka_tests():
     try:
         from tests.kafka.test_producer import run_all_tests as test_producer
         from tests.kafka.test_consumer import run_all_tests as test_consumer
+        from tests.kafka.test_events import run_all_tests as test_events
         
+        events_success = test_events()
+        print()
         producer_success = test_producer()
         print()
         consumer_success = test_consumer()
         
-        return producer_success and consumer_success
+        return events_success and producer_success and consumer_success
     except Exception as e:
         print(f"❌ Kafka tests failed: {e}")
         return False
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Test Streaming Directive Parsing
+Feeds an AI transcript to DirectiveStreamParser in small deltas, the way
+response.output_audio_transcript.delta events arrive.
+"""
+
+import sys
+import random
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.utils.directives import DirectiveStreamParser, extract_directives
+
+TRANSCRIPT = (
+    'Thanks David, I have everything I need. PATIENT_CREATION: {"name": "David Sam", "email": "david.sam@gmail.com", '
+    '"phone": "(408) 818-2809", "date_of_birth": "01/02/1984"} \n\nBOOKING_CONFIRMATION: {"dentist": "Dr. Sarah Nguyen", '
+    '"date": "2025-11-15", "time": "15:00", "patient_name": "David Sam"} \n\nYour appointment is confirmed for '
+    "November 15, 2025, at 3:00 PM with Dr. Sarah Nguyen. You're all set! If you have any other questions, feel free to ask."
+)
+
+def deltas(text, seed):
+    rng = random.Random(seed)
+    i = 0
+    while i < len(text):
+        size = rng.randint(1, 8)
+        yield text[i:i + size]
+        i += size
+
+def test_matches_full_text():
+    """Any split into deltas yields the same directives as parsing the whole text."""
+    print("🧩 Testing delta splits...")
+    expected = extract_directives(TRANSCRIPT)
+    for seed in range(200):
+        parser = DirectiveStreamParser()
+        emitted = []
+        for delta in deltas(TRANSCRIPT, seed):
+            emitted.extend(parser.feed(delta))
+        if [name for name, _ in emitted] != ["PATIENT_CREATION", "BOOKING_CONFIRMATION"] or parser.finish() != expected:
+            print(f"❌ Split {seed} produced {emitted}")
+            return False
+    print(f"✅ 200 splits matched: {expected}")
+    return True
+
+def test_emitted_once():
+    """A directive repeated in the same response is emitted only the first time."""
+    print("🔂 Testing repeated directives...")
+    parser = DirectiveStreamParser()
+    first = parser.feed('BOOKING_CONFIRMATION: {"dentist": "Dr. A", "date": "2025-11-15", "time": "15:00", "patient_name": "X"}')
+    again = parser.feed(' To confirm, BOOKING_CONFIRMATION: {"dentist": "Dr. A", "date": "2025-11-15", "time": "15:00", "patient_name": "X"}')
+    mention = parser.feed(" I will not say PATIENT_CREATION: here.")
+    if len(first) == 1 and not again and not mention:
+        print("✅ Emitted once, plain mentions ignored")
+        return True
+    print(f"❌ Got {first}, {again}, {mention}")
+    return False
+
+def test_finish_keeps_emitted():
+    """finish() fills in the booking phone on a copy, not on the dict feed() emitted."""
+    print("📞 Testing finish() copies...")
+    parser = DirectiveStreamParser()
+    (_, booking), = parser.feed('BOOKING_CONFIRMATION: {"dentist": "Dr. A", "date": "2025-11-15", "time": "15:00", "patient_name": "X"}')
+    final = parser.finish()
+    if "phone" not in booking and final["BOOKING_CONFIRMATION"]["phone"] == "N/A":
+        print("✅ Emitted booking unchanged")
+        return True
+    print(f"❌ Emitted {booking}, final {final}")
+    return False
+
+def test_time_to_action():
+    """How much of the response remains when the booking becomes available."""
+    print("⏱️ Testing time to action...")
+    parser = DirectiveStreamParser()
+    seen = 0
+    booked_at = None
+    start = time.perf_counter()
+    for delta in deltas(TRANSCRIPT, 0):
+        seen += len(delta)
+        for name, _ in parser.feed(delta):
+            if name == "BOOKING_CONFIRMATION":
+                booked_at = seen
+    elapsed_us = (time.perf_counter() - start) * 1e6
+    if booked_at is None:
+        print("❌ Booking never emitted")
+        return False
+    print(f"✅ Booking ready after {booked_at}/{len(TRANSCRIPT)} characters "
+          f"({1 - booked_at / len(TRANSCRIPT):.0%} of the response still to be spoken); parsing took {elapsed_us:.0f}µs")
+    return True
+
+if __name__ == "__main__":
+    print("🧪 Testing Streaming Directive Parser")
+    print("=" * 40)
+    results = [test_matches_full_text(), test_emitted_once(), test_finish_keeps_emitted(), test_time_to_action()]
+    print()
+    print(f"📊 Results: {sum(results)}/{len(results)} tests passed")
+    sys.exit(0 if all(results) else 1)
@@ -86,11 +86,12 @@ def test_patient_api():
         
         if response.status_code == 200:
             data = response.json()
+            patients = data.get('items', [])
             print("✅ Get all patients working!")
-            print(f"Found {len(data)} patients")
+            print(f"Found {data.get('total_items')} patients ({len(patients)} on page {data.get('page')})")
             
-            if data:
-                patient = data[0]
+            if patients:
+                patient = patients[0]
                 print(f"\nSample patient:")
                 print(f"  Name: {patient.get('name')}")
                 print(f"  Address: {patient.get('address')}")
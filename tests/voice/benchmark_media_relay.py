@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Media Relay Benchmark
+Measures frames/sec on one core for the /voice/media-stream relay path:
+the old decode/re-encode + json path against the app.utils.media_frames path,
+and checks that a slow peer backs up only its own relay queue, that queued
+audio is capped by duration, and that a failed write is reported.
+No network, Twilio or OpenAI needed.
+"""
+
+import asyncio
+import base64
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+# Add project root to path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from app.utils.media_frames import TwilioFrames, input_audio_append, loads
+from app.utils.media_relay import RelayQueue
+
+STREAM_SID = "MZ18ad3ab5a668481ce02b83e7395059f0"
+FRAMES = int(os.getenv("BENCH_FRAMES", 50000))
+
+def twilio_media_message(sequence):
+    """A 20ms inbound g711 ulaw frame as Twilio sends it"""
+    return json.dumps({
+        "event": "media",
+        "sequenceNumber": str(sequence),
+        "media": {
+            "track": "inbound",
+            "chunk": str(sequence),
+            "timestamp": str(sequence * 20),
+            "payload": base64.b64encode(os.urandom(160)).decode("utf-8")
+        },
+        "streamSid": STREAM_SID
+    })
+
+def openai_delta_message(size):
+    """An OpenAI Realtime audio delta of `size` bytes of audio"""
+    return json.dumps({
+        "type": "response.output_audio.delta",
+        "event_id": "event_4950",
+        "response_id": "resp_001",
+        "item_id": "item_008",
+        "output_index": 0,
+        "content_index": 0,
+        "delta": base64.b64encode(os.urandom(size)).decode("utf-8")
+    })
+
+def legacy_inbound(message):
+    data = json.loads(message)
+    if data['event'] == 'media':
+        int(data['media']['timestamp'])
+        return json.dumps({"type": "input_audio_buffer.append", "audio": data['media']['payload']})
+
+def relay_inbound(message):
+    data = loads(message)
+    if data['event'] == 'media':
+        media = data['media']
+        int(media['timestamp'])
+        return input_audio_append(media['payload'])
+
+def legacy_outbound(message):
+    response = json.loads(message)
+    if response.get('type') == 'response.output_audio.delta' and 'delta' in response:
+        audio_payload = base64.b64encode(base64.b64decode(response['delta'])).decode('utf-8')
+        # Starlette's send_json does json.dumps
+        return json.dumps({"event": "media", "streamSid": STREAM_SID, "media": {"payload": audio_payload}})
+
+def relay_outbound(message, frames=TwilioFrames(STREAM_SID)):
+    response = loads(message)
+    if response.get('type') == 'response.output_audio.delta' and 'delta' in response:
+        return frames.media(response['delta'])
+
+def frames_per_second(handler, messages):
+    start = time.perf_counter()
+    for message in messages:
+        handler(message)
+    return len(messages) / (time.perf_counter() - start)
+
+def test_relay_output_matches():
+    """The relay path must produce the same frames as the old path."""
+    print("🔍 Checking relay output...")
+    inbound = twilio_media_message(1)
+    outbound = openai_delta_message(800)
+    if json.loads(relay_inbound(inbound)) != json.loads(legacy_inbound(inbound)):
+        print("❌ input_audio_buffer.append frame differs")
+        return False
+    if json.loads(relay_outbound(outbound)) != json.loads(legacy_outbound(outbound)):
+        print("❌ Twilio media frame differs")
+        return False
+    print("✅ Relay frames match")
+    return True
+
+def test_slow_peer_isolation():
+    """A stalled Twilio socket must not slow down caller audio or lose assistant audio."""
+    print("🐢 Checking relay queues with a slow peer...")
+
+    async def scenario():
+        to_openai, to_twilio = [], []
+
+        async def fast_send(frame):
+            to_openai.append(frame)
+
+        async def slow_send(frame):
+            await asyncio.sleep(0.02)
+            to_twilio.append(frame)
+
+        frames = TwilioFrames(STREAM_SID)
+        openai_out = RelayQueue("openai", fast_send, input_audio_append, 50, "coalesce").start()
+        twilio_out = RelayQueue("twilio", slow_send, frames.media, 10, "coalesce").start()
+        delta = base64.b64encode(os.urandom(800)).decode("utf-8")
+        caller = base64.b64encode(os.urandom(160)).decode("utf-8")
+        for _ in range(100):
+            twilio_out.put_audio(delta)
+            openai_out.put_audio(caller)
+            await asyncio.sleep(0)
+        await asyncio.sleep(0.01)
+        caller_stats = openai_out.stats()
+        await openai_out.close()
+        await twilio_out.close(timeout=5)
+        relayed = sum(len(base64.b64decode(json.loads(frame)["media"]["payload"])) for frame in to_twilio)
+        return caller_stats, twilio_out.stats(), relayed
+
+    caller_stats, twilio_stats, relayed = asyncio.run(scenario())
+    print(f"📊 to_openai: {caller_stats}")
+    print(f"📊 to_twilio: {twilio_stats}")
+    if caller_stats["sent"] != 100:
+        print("❌ Caller audio was held up by the slow Twilio socket")
+        return False
+    if relayed != 100 * 800:
+        print(f"❌ Assistant audio lost: relayed {relayed} of {100 * 800} bytes")
+        return False
+    print("✅ Slow peer only backed up its own queue; coalescing kept all audio")
+    return True
+
+def test_audio_duration_cap():
+    """Coalescing must not let a stalled queue hold more than max_audio_ms of audio."""
+    print("⏳ Checking the queued audio cap...")
+
+    async def scenario():
+        stalled = asyncio.Event()
+
+        async def stalled_send(frame):
+            await stalled.wait()
+
+        queue = RelayQueue("twilio", stalled_send, TwilioFrames(STREAM_SID).media, 10, "coalesce", max_audio_ms=1000).start()
+        frame = base64.b64encode(os.urandom(160)).decode("utf-8")  # 20ms
+        for _ in range(500):  # 10s of audio
+            queue.put_audio(frame)
+        queued_ms, stats = queue.audio_ms(), queue.stats()
+        stalled.set()
+        await queue.close()
+        return queued_ms, stats
+
+    queued_ms, stats = asyncio.run(scenario())
+    print(f"📊 queued {queued_ms}ms: {stats}")
+    if queued_ms > 1000:
+        print(f"❌ Queue holds {queued_ms}ms of audio, cap is 1000ms")
+        return False
+    print("✅ Oldest audio dropped once the queue held max_audio_ms")
+    return True
+
+def test_write_failure_reported():
+    """A failed write must close the queue and call on_error, so the call can end."""
+    print("📵 Checking that a failed write is reported...")
+
+    async def scenario():
+        errors = []
+
+        async def hung_up(frame):
+            raise ConnectionError("peer went away")
+
+        queue = RelayQueue("twilio", hung_up, TwilioFrames(STREAM_SID).media, 10, on_error=errors.append).start()
+        queue.put_audio(base64.b64encode(os.urandom(160)).decode("utf-8"))
+        await asyncio.sleep(0.01)
+        await queue.close()
+        return errors
+
+    errors = asyncio.run(scenario())
+    if len(errors) != 1:
+        print(f"❌ on_error called {len(errors)} times")
+        return False
+    print("✅ Write failure reported")
+    return True
+
+def run_benchmark():
+    """Compare both paths on inbound frames and on small/large outbound deltas."""
+    print(f"⏱️  Benchmarking {FRAMES} frames per case (single core)...")
+    cases = [
+        ("Twilio -> OpenAI (160B)", [twilio_media_message(i) for i in range(FRAMES)], legacy_inbound, relay_inbound),
+        ("OpenAI -> Twilio (800B)", [openai_delta_message(800)] * FRAMES, legacy_outbound, relay_outbound),
+        ("OpenAI -> Twilio (4800B)", [openai_delta_message(4800)] * FRAMES, legacy_outbound, relay_outbound),
+    ]
+    for name, messages, legacy, relay in cases:
+        before = frames_per_second(legacy, messages)
+        after = frames_per_second(relay, messages)
+        print(f"📊 {name}: legacy {before:,.0f} frames/s, relay {after:,.0f} frames/s ({after / before:.1f}x)")
+    return True
+
+if __name__ == "__main__":
+    print("🧪 Media Relay Benchmark")
+    print("=" * 40)
+    if (test_relay_output_matches() and test_slow_peer_isolation()
+            and test_audio_duration_cap() and test_write_failure_reported()):
+        run_benchmark()
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI Realtime Server
+A local stand-in for the Realtime API, for load-testing /voice/media-stream.
+Start the app with OPENAI_REALTIME_URL=ws://127.0.0.1:8765 to use it.
+
+- Acknowledges session.update with session.updated
+- Answers response.create with a short spoken reply: audio deltas,
+  transcript deltas and response.done
+- Echoes every input_audio_buffer.append back as an audio delta, so the
+  load generator can time a frame through the bridge and back
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import sys
+import itertools
+
+import websockets
+
+REPLY_FRAMES = 25  # 0.5s of 20ms audio per response.create
+REPLY_TRANSCRIPT = "Hello, thanks for calling the dental office. How can I help you today?"
+
+class FakeRealtimeServer:
+    def __init__(self, host="127.0.0.1", port=8765, reply_frames=REPLY_FRAMES):
+        self.host = host
+        self.port = port
+        self.reply_frames = reply_frames
+        self._server = None
+        self._ids = itertools.count(1)
+        self.stats = {"sessions": 0, "active": 0, "appended": 0, "echoed": 0, "responses": 0}
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}"
+
+    def _id(self, prefix):
+        return f"{prefix}_{next(self._ids):08d}"
+
+    async def start(self):
+        self._server = await websockets.serve(self._session, self.host, self.port, max_size=None)
+        return self
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _send(self, websocket, event):
+        event.setdefault("event_id", self._id("event"))
+        await websocket.send(json.dumps(event))
+
+    async def _respond(self, websocket):
+        """A short assistant turn, paced like real audio."""
+        response_id, item_id = self._id("resp"), self._id("item")
+        self.stats["responses"] += 1
+        await self._send(websocket, {"type": "response.created", "response": {"id": response_id, "status": "in_progress"}})
+        words = REPLY_TRANSCRIPT.split(" ")
+        for i in range(self.reply_frames):
+            await self._send(websocket, {
+                "type": "response.output_audio.delta", "response_id": response_id, "item_id": item_id,
+                "output_index": 0, "content_index": 0,
+                "delta": base64.b64encode(b"\xff" * 160).decode("ascii")
+            })
+            if i < len(words):
+                await self._send(websocket, {
+                    "type": "response.output_audio_transcript.delta", "response_id": response_id,
+                    "item_id": item_id, "delta": words[i] + " "
+                })
+            await asyncio.sleep(0.02)
+        await self._send(websocket, {
+            "type": "response.done",
+            "response": {
+                "id": response_id, "status": "completed",
+                "output": [{
+                    "id": item_id, "type": "message", "role": "assistant",
+                    "content": [{"type": "output_audio", "transcript": REPLY_TRANSCRIPT}]
+                }]
+            }
+        })
+
+    async def _session(self, websocket):
+        self.stats["sessions"] += 1
+        self.stats["active"] += 1
+        echo_item = self._id("item")
+        replies = set()
+        try:
+            await self._send(websocket, {"type": "session.created", "session": {"id": self._id("sess")}})
+            async for message in websocket:
+                event = json.loads(message)
+                event_type = event.get("type")
+                if event_type == "input_audio_buffer.append":
+                    self.stats["appended"] += 1
+                    await self._send(websocket, {
+                        "type": "response.output_audio.delta", "response_id": "resp_echo", "item_id": echo_item,
+                        "output_index": 0, "content_index": 0, "delta": event["audio"]
+                    })
+                    self.stats["echoed"] += 1
+                elif event_type == "session.update":
+                    await self._send(websocket, {"type": "session.updated", "session": event.get("session", {})})
+                elif event_type == "response.create":
+                    task = asyncio.create_task(self._respond(websocket))
+                    replies.add(task)
+                    task.add_done_callback(replies.discard)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            for task in replies:
+                task.cancel()
+            self.stats["active"] -= 1
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=os.getenv("FAKE_REALTIME_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("FAKE_REALTIME_PORT", 8765)))
+    parser.add_argument("--reply-frames", type=int, default=REPLY_FRAMES)
+    args = parser.parse_args()
+
+    server = await FakeRealtimeServer(args.host, args.port, args.reply_frames).start()
+    print(f"🤖 Fake OpenAI Realtime server listening on {server.url}")
+    print(f"   Start the app with OPENAI_REALTIME_URL={server.url}")
+    try:
+        while True:
+            await asyncio.sleep(10)
+            print(f"📊 {server.stats}")
+    finally:
+        await server.close()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        sys.exit(0)
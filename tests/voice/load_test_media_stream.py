@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+Media Stream Load Test
+Opens N simulated Twilio media streams against /voice/media-stream and
+reports relay latency, frame loss, and the app's CPU and memory per call.
+
+Each call sends 20ms μ-law frames in real time after the usual `connected` /
+`start` events, echoes marks back as Twilio does, and ends with `stop`. Every
+frame carries a sequence number. The fake Realtime server echoes caller audio
+back as assistant audio, so each frame's round trip through the bridge
+(Twilio -> app -> OpenAI -> app -> Twilio) is timed.
+
+Usage:
+    python tests/voice/fake_realtime_server.py &
+    OPENAI_REALTIME_URL=ws://127.0.0.1:8765 uvicorn app:app --port 5050 &
+    python tests/voice/load_test_media_stream.py --calls 50 --duration 60 --pid $(pgrep -f "uvicorn app:app")
+
+--fake-openai starts the fake server inside this process instead.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import struct
+import sys
+import time
+import uuid
+from pathlib import Path
+
+import websockets
+
+# Add project root to path
+project_root = Path(__file__).parent.parent.parent
+sys.path.insert(0, str(project_root))
+
+from tests.voice.fake_realtime_server import FakeRealtimeServer
+
+FRAME_MS = 20
+FRAME_BYTES = 160  # 20ms of 8kHz μ-law
+MAGIC = b"LOAD"
+GRACE_SECONDS = 1.0  # let the last echoes arrive before sending `stop`
+
+def percentile(samples, fraction):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+def ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+class ProcessSampler:
+    """CPU and RSS of the app process, read from /proc (Linux)."""
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []  # (monotonic, cpu_seconds, rss_bytes)
+        self._task = None
+
+    def _read(self):
+        with open(f"/proc/{self.pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        cpu_seconds = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        with open(f"/proc/{self.pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+        return time.monotonic(), cpu_seconds, rss_kb * 1024
+
+    async def _run(self):
+        while True:
+            try:
+                self.samples.append(self._read())
+            except (OSError, StopIteration):
+                return
+            await asyncio.sleep(1)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def summary(self, calls, steady_from):
+        if len(self.samples) < 2:
+            return None
+        baseline_rss = self.samples[0][2]
+        steady = [s for s in self.samples if s[0] >= steady_from] or self.samples
+        if len(steady) >= 2:
+            (t0, cpu0, _), (t1, cpu1, _) = steady[0], steady[-1]
+            cpu_percent = (cpu1 - cpu0) / max(t1 - t0, 1e-9) * 100
+        else:
+            cpu_percent = 0.0
+        peak_rss = max(s[2] for s in self.samples)
+        return {
+            "cpu_percent": round(cpu_percent, 1),
+            "cpu_percent_per_call": round(cpu_percent / max(calls, 1), 2),
+            "rss_baseline_mb": round(baseline_rss / 2**20, 1),
+            "rss_peak_mb": round(peak_rss / 2**20, 1),
+            "rss_per_call_kb": round((peak_rss - baseline_rss) / max(calls, 1) / 1024, 1),
+        }
+
+class SimulatedCall:
+    """One Twilio media stream: real-time outbound audio plus echo/mark handling."""
+
+    def __init__(self, url, duration, index):
+        self.url = url
+        self.duration = duration
+        self.stream_sid = "MZ" + uuid.uuid4().hex
+        self.call_sid = "CA" + uuid.uuid4().hex
+        self.caller = f"+1555{index:07d}"
+        self.sent_at = {}
+        self.latencies = []
+        self.stats = {"sent": 0, "echoed": 0, "other_audio": 0, "marks": 0, "clears": 0, "late_sends": 0}
+        self.setup_seconds = None
+        self.error = None
+        self._opened_at = None
+
+    def _media(self, sequence):
+        audio = MAGIC + struct.pack(">I", sequence) + b"\xff" * (FRAME_BYTES - 8)
+        return json.dumps({
+            "event": "media",
+            "sequenceNumber": str(sequence + 2),
+            "media": {
+                "track": "inbound",
+                "chunk": str(sequence + 1),
+                "timestamp": str(sequence * FRAME_MS),
+                "payload": base64.b64encode(audio).decode("ascii")
+            },
+            "streamSid": self.stream_sid
+        })
+
+    async def _send_audio(self, websocket):
+        frames = int(self.duration * 1000 / FRAME_MS)
+        start = time.monotonic()
+        for sequence in range(frames):
+            # Absolute schedule, so a slow iteration doesn't shift later frames
+            delay = start + sequence * FRAME_MS / 1000 - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -FRAME_MS / 1000:
+                self.stats["late_sends"] += 1
+            self.sent_at[sequence] = time.perf_counter()
+            await websocket.send(self._media(sequence))
+            self.stats["sent"] += 1
+        await asyncio.sleep(GRACE_SECONDS)
+
+    async def _receive(self, websocket):
+        async for message in websocket:
+            data = json.loads(message)
+            event = data.get("event")
+            if event == "media":
+                audio = base64.b64decode(data["media"]["payload"])
+                received_at = time.perf_counter()
+                if self.setup_seconds is None:
+                    self.setup_seconds = time.monotonic() - self._opened_at
+                # The bridge may coalesce several 160-byte frames (echoes and
+                # greeting alike) into one payload, so check every frame in it
+                tagged = False
+                for offset in range(0, len(audio) - 7, FRAME_BYTES):
+                    if audio[offset:offset + 4] != MAGIC:
+                        continue
+                    tagged = True
+                    sent_at = self.sent_at.pop(struct.unpack(">I", audio[offset + 4:offset + 8])[0], None)
+                    if sent_at is not None:
+                        self.latencies.append(received_at - sent_at)
+                        self.stats["echoed"] += 1
+                if not tagged:
+                    # Greeting audio
+                    self.stats["other_audio"] += 1
+            elif event == "mark":
+                # Twilio reports a mark once the audio before it has played
+                self.stats["marks"] += 1
+                await websocket.send(json.dumps({"event": "mark", "streamSid": self.stream_sid, "mark": data.get("mark", {})}))
+            elif event == "clear":
+                self.stats["clears"] += 1
+
+    async def run(self):
+        self._opened_at = time.monotonic()
+        try:
+            async with websockets.connect(self.url, max_size=None) as websocket:
+                await websocket.send(json.dumps({"event": "connected", "protocol": "Call", "version": "1.0.0"}))
+                await websocket.send(json.dumps({
+                    "event": "start",
+                    "sequenceNumber": "1",
+                    "start": {
+                        "streamSid": self.stream_sid,
+                        "callSid": self.call_sid,
+                        "accountSid": "AC" + "0" * 32,
+                        "tracks": ["inbound"],
+                        "customParameters": {"caller": self.caller},
+                        "mediaFormat": {"encoding": "audio/x-mulaw", "sampleRate": 8000, "channels": 1}
+                    },
+                    "streamSid": self.stream_sid
+                }))
+                receiver = asyncio.create_task(self._receive(websocket))
+                try:
+                    await self._send_audio(websocket)
+                    await websocket.send(json.dumps({"event": "stop", "streamSid": self.stream_sid, "stop": {"callSid": self.call_sid}}))
+                finally:
+                    receiver.cancel()
+                    try:
+                        await receiver
+                    except (asyncio.CancelledError, websockets.ConnectionClosed):
+                        pass
+        except (OSError, websockets.WebSocketException) as e:
+            self.error = str(e)
+
+async def run_load_test(url, calls, duration, ramp, pid=None):
+    sampler = ProcessSampler(pid) if pid else None
+    if sampler:
+        sampler.start()
+        await asyncio.sleep(1.1)  # baseline sample before any call
+
+    simulated = [SimulatedCall(url, duration, i) for i in range(calls)]
+
+    async def start_call(index, call):
+        await asyncio.sleep(ramp * index / max(calls, 1))
+        await call.run()
+
+    started = time.monotonic()
+    await asyncio.gather(*(start_call(i, call) for i, call in enumerate(simulated)))
+    elapsed = time.monotonic() - started
+    if sampler:
+        await sampler.stop()
+
+    completed = [call for call in simulated if call.error is None]
+    latencies = [latency for call in completed for latency in call.latencies]
+    sent = sum(call.stats["sent"] for call in completed)
+    echoed = sum(call.stats["echoed"] for call in completed)
+    setup = [call.setup_seconds for call in completed if call.setup_seconds is not None]
+    report = {
+        "calls": calls,
+        "failed_calls": calls - len(completed),
+        "duration_seconds": round(elapsed, 1),
+        "frames_sent": sent,
+        "frames_echoed": echoed,
+        "frame_loss_percent": round((sent - echoed) / sent * 100, 3) if sent else None,
+        "other_audio_frames": sum(call.stats["other_audio"] for call in completed),
+        "marks": sum(call.stats["marks"] for call in completed),
+        "latency_p50_ms": ms(percentile(latencies, 0.50)),
+        "latency_p95_ms": ms(percentile(latencies, 0.95)),
+        "latency_p99_ms": ms(percentile(latencies, 0.99)),
+        "latency_max_ms": ms(max(latencies) if latencies else None),
+        "setup_p50_ms": ms(percentile(setup, 0.50)),
+        "setup_p99_ms": ms(percentile(setup, 0.99)),
+        # Non-zero means this generator, not the app, fell behind
+        "generator_late_sends": sum(call.stats["late_sends"] for call in completed),
+    }
+    if sampler:
+        report["process"] = sampler.summary(len(completed), started + ramp)
+    errors = sorted({call.error for call in simulated if call.error})
+    if errors:
+        report["errors"] = errors[:5]
+    return report
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default=os.getenv("LOAD_TEST_URL", "ws://127.0.0.1:5050/voice/media-stream"))
+    parser.add_argument("--calls", type=int, default=10, help="concurrent simulated calls")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of audio each call sends")
+    parser.add_argument("--ramp", type=float, default=5, help="seconds over which the calls are opened")
+    parser.add_argument("--pid", type=int, help="app process to sample for CPU and memory")
+    parser.add_argument("--fake-openai", action="store_true", help="run the fake Realtime server in this process")
+    parser.add_argument("--fake-port", type=int, default=8765)
+    parser.add_argument("--max-loss", type=float, help="fail if frame loss %% exceeds this")
+    parser.add_argument("--max-p99-ms", type=float, help="fail if p99 relay latency exceeds this")
+    args = parser.parse_args()
+
+    fake = None
+    if args.fake_openai:
+        fake = await FakeRealtimeServer(port=args.fake_port).start()
+        print(f"🤖 Fake OpenAI Realtime server on {fake.url} (start the app with OPENAI_REALTIME_URL={fake.url})")
+
+    print(f"📞 {args.calls} calls x {args.duration}s against {args.url}")
+    try:
+        report = await run_load_test(args.url, args.calls, args.duration, args.ramp, args.pid)
+    finally:
+        if fake:
+            await fake.close()
+
+    print(json.dumps(report, indent=2))
+    failed = report["failed_calls"] > 0
+    if args.max_loss is not None and (report["frame_loss_percent"] or 0) > args.max_loss:
+        print(f"❌ Frame loss {report['frame_loss_percent']}% exceeds {args.max_loss}%")
+        failed = True
+    if args.max_p99_ms is not None and (report["latency_p99_ms"] or 0) > args.max_p99_ms:
+        print(f"❌ p99 latency {report['latency_p99_ms']}ms exceeds {args.max_p99_ms}ms")
+        failed = True
+    print("✅ Load test passed" if not failed else "❌ Load test failed")
+    return 0 if not failed else 1
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))